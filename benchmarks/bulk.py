@@ -0,0 +1,85 @@
+"""Measure the client CPU time and the request bytes of sending 10,000
+statuses in bulk requests, per JSON serializer and with and without gzip
+compression. Requests go to a local stand-in for Elasticsearch's bulk
+endpoint that only counts the bytes it receives.
+
+Usage, from the root of the repository:
+python -m benchmarks.bulk
+"""
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk
+from gzip import decompress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import thread_time
+
+from mastodon_search.crawl.save import SERIALIZERS
+from mastodon_search.crawl.examples import CRAWLED_AT, STATUSES
+from mastodon_search.crawl.transform import status_to_action
+
+STATUS_COUNT = 10_000
+CHUNK_SIZE = 500
+
+
+class _BulkHandler(BaseHTTPRequestHandler):
+    """Answer bulk requests as if all actions succeeded."""
+    received = 0
+
+    def do_PUT(self) -> None:
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        _BulkHandler.received += len(body)
+        if (self.headers.get('Content-Encoding') == 'gzip'):
+            body = decompress(body)
+        # Every index action is followed by its document.
+        items = [b'{"index":{"status":201}}'] * (body.count(b'\n') // 2)
+        response = b'{"errors":false,"took":1,"items":[' \
+            + b','.join(items) + b']}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def _actions() -> list[dict]:
+    actions = []
+    for i in range(STATUS_COUNT):
+        status = {**STATUSES[i % len(STATUSES)], 'id': str(i)}
+        actions.append(status_to_action(
+            status, 'example.com', 'api/v1/timelines/public', CRAWLED_AT))
+    return actions
+
+
+def measure(
+    url: str, actions: list[dict], serializer: str, http_compress: bool
+) -> tuple[float, int]:
+    """Return the CPU seconds and request bytes of sending all actions."""
+    client = Elasticsearch(
+        url, serializer=SERIALIZERS[serializer](),
+        http_compress=http_compress)
+    _BulkHandler.received = 0
+    start = thread_time()
+    for _ in streaming_bulk(client, actions, chunk_size=CHUNK_SIZE):
+        pass
+    return thread_time() - start, _BulkHandler.received
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _BulkHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    actions = _actions()
+    print(f'Per {STATUS_COUNT} statuses:')
+    print(f'{"serializer":10} {"gzip":5} {"CPU s":>7} {"MiB sent":>9}')
+    for serializer in SERIALIZERS:
+        for http_compress in (False, True):
+            # Warm up connections and caches.
+            measure(url, actions[:CHUNK_SIZE], serializer, http_compress)
+            seconds, sent = measure(url, actions, serializer, http_compress)
+            print(f'{serializer:10} {str(http_compress):5} {seconds:7.3f} '
+                +f'{sent / 2**20:9.2f}')
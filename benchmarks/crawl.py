@@ -0,0 +1,307 @@
+"""Measure statuses per second, the latency from fetching a status to
+indexing it and the peak memory of _Save, Crawler and Streamer, against
+local stand-ins for Mastodon and Elasticsearch (see fake.py), without
+network. Every scenario runs in a fresh process, so its peak RSS is its own.
+
+save -- write pre-parsed statuses to _Save as fast as possible. Latency is
+    measured from write_status.
+crawler -- catch up on a timeline of statuses with Crawler, unthrottled.
+streamer -- stream statuses posted at a constant rate with Streamer.
+Crawler and Streamer receive statuses as Mastodon.py's typed entities, which
+are much slower to create than to save, so their scenarios are smaller.
+
+Results can be saved as JSON and compared to those of another commit:
+python -m benchmarks.crawl --output before.json
+python -m benchmarks.crawl --compare before.json
+
+Usage, from the root of the repository: python -m benchmarks.crawl [OPTIONS]
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, UTC
+from json import dump, load
+from multiprocessing import get_context
+from platform import python_version
+from resource import getrusage, RUSAGE_SELF
+from statistics import quantiles
+# Only runs git to record the commit of the results.
+from subprocess import DEVNULL, run  # nosec B404
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+
+import click
+import orjson
+
+from benchmarks.fake import FakeElasticsearch, FakeInstance, FakeMastodon
+from mastodon_search.crawl.snowflake import datetime_to_id
+from mastodon_search.crawl.transform import status_id
+
+SCENARIOS = ['save', 'crawler', 'streamer']
+API_METHOD = 'api/v1/timelines/public'
+# Number of distinct statuses written in the save scenario.
+STATUS_POOL_SIZE = 1000
+# Queue settings of the crawling processes, scaled down so that statuses
+# are indexed within a short benchmark.
+FLUSH_COUNT = 500
+FLUSH_AGE = 1
+BULK_WORKERS = 2
+# Requests per second of the benchmarked crawlers. Crawlers are throttled
+# to 1 request per second until an instance reports its rate limit, which
+# the benchmarked instance does not, so this would only measure the limit.
+REQUESTS_PER_SECOND = 1000
+# Whether a higher value is better, by metric.
+METRICS = {
+    'statuses_per_second': True,
+    'latency_p50': False,
+    'latency_p99': False,
+    'rss_peak_mib': False,
+}
+
+
+def _rss_mib() -> float:
+    """Return the peak resident set size of this process in MiB."""
+    return getrusage(RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def _save(port: int):
+    from mastodon_search.crawl.save import _Save
+    save = _Save(
+        flush_count=FLUSH_COUNT, flush_age=FLUSH_AGE,
+        bulk_workers=BULK_WORKERS)
+    save.init_elastic_connection('http://127.0.0.1', '', port, '')
+    return save
+
+
+def _fast_session():
+    from mastodon_search.crawl.crawl import Crawler
+    from mastodon_search.crawl.ratelimit import _TokenBucket
+    return Crawler._session(_TokenBucket(
+        per_second=REQUESTS_PER_SECOND, burst=REQUESTS_PER_SECOND))
+
+
+def run_save(port: int, n: int) -> dict:
+    """Write n statuses to _Save and wait until all are indexed."""
+    from benchmarks.fake import StatusGenerator
+    from mastodon_search.crawl.poll import parse_statuses
+    generator = StatusGenerator('example.com')
+    now = datetime.now(tz=UTC)
+    first_id = int(datetime_to_id(now))
+    # Parsed beforehand, so that only _Save is measured. Statuses are reused
+    # with new IDs, so that they do not dominate the memory usage.
+    statuses = parse_statuses(orjson.dumps([
+        generator.status(str(first_id + i), now)
+        for i in range(STATUS_POOL_SIZE)
+    ]))
+    save = _save(port)
+    baseline = _rss_mib()
+    written_at = {}
+    start = perf_counter()
+    for i in range(n):
+        status = {
+            **statuses[i % STATUS_POOL_SIZE], 'id': str(first_id + i)}
+        written_at[status['id']] = monotonic()
+        save.write_status(status, 'example.com', API_METHOD)
+    save.save_queued()
+    return {
+        'seconds': perf_counter() - start,
+        'rss_baseline_mib': baseline,
+        'rss_peak_mib': _rss_mib(),
+        'written_at': written_at,
+    }
+
+
+def run_crawler(port: int, url: str) -> dict:
+    """Crawl all statuses of an instance and wait until all are indexed."""
+    from mastodon_search.crawl.crawl import Crawler
+    save = _save(port)
+    crawler = Crawler(url, save, quiet=True)
+    crawler.mastodon.session = _fast_session()
+    baseline = _rss_mib()
+    start = perf_counter()
+    crawler._crawl_updates(min_id='0', return_on_up_to_date=True)
+    save.save_queued()
+    return {
+        'seconds': perf_counter() - start,
+        'rss_baseline_mib': baseline,
+        'rss_peak_mib': _rss_mib(),
+    }
+
+
+def run_streamer(port: int, url: str, seconds: float) -> dict:
+    """Stream an instance for some seconds and save what was received."""
+    from mastodon_search.crawl.stream import Streamer
+    save = _save(port)
+    streamer = Streamer(url, save, quiet=True)
+    streamer.crawler.mastodon.session = _fast_session()
+    baseline = _rss_mib()
+    start = perf_counter()
+    # Runs until the process ends.
+    Thread(target=streamer.stream, daemon=True).start()
+    sleep(seconds)
+    save.save_queued()
+    return {
+        'seconds': perf_counter() - start,
+        'rss_baseline_mib': baseline,
+        'rss_peak_mib': _rss_mib(),
+    }
+
+
+def _in_process(function, *args) -> dict:
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=get_context('spawn')
+    ) as executor:
+        return executor.submit(function, *args).result()
+
+
+def _summary(
+    result: dict, instance: str, sent_at: dict[str, float],
+    indexed: dict[str, float]
+) -> dict:
+    """Summarize a scenario's result.
+
+    Arguments:
+    result -- what the scenario returned
+    instance -- the instance its statuses were crawled from
+    sent_at -- when every status was sent to the crawler, by ID
+    indexed -- when every document arrived at Elasticsearch, by _id
+    """
+    latencies = []
+    for key, sent in sent_at.items():
+        doc_id = str(status_id({'id': key}, instance))
+        if (doc_id in indexed):
+            latencies.append(indexed[doc_id] - sent)
+    percentiles = quantiles(latencies, n=100, method='inclusive') \
+        if len(latencies) > 1 \
+        else [latencies[0] if latencies else None] * 99
+    return {
+        'statuses': len(latencies),
+        'seconds': result['seconds'],
+        'statuses_per_second': len(latencies) / result['seconds'],
+        'latency_p50': percentiles[49],
+        'latency_p99': percentiles[98],
+        'rss_baseline_mib': result['rss_baseline_mib'],
+        'rss_peak_mib': result['rss_peak_mib'],
+    }
+
+
+def benchmark(
+    scenario: str, statuses: int, crawl_statuses: int, stream_rate: float,
+    stream_seconds: float
+) -> dict:
+    """Run a scenario against fresh stand-ins and return its results."""
+    elastic = FakeElasticsearch()
+    elastic.start()
+    instance = FakeInstance(
+        'bench', max_statuses=max(crawl_statuses, 10_000))
+    mastodon = FakeMastodon([instance])
+    mastodon.start()
+    url = mastodon.url(instance)
+    try:
+        if (scenario == 'save'):
+            result = _in_process(run_save, elastic.port, statuses)
+            sent_at = result['written_at']
+            url = 'example.com'
+        elif (scenario == 'crawler'):
+            instance.post(crawl_statuses)
+            result = _in_process(run_crawler, elastic.port, url)
+        else:
+            instance.rate = stream_rate
+            result = _in_process(
+                run_streamer, elastic.port, url, stream_seconds)
+        if (scenario != 'save'):
+            sent_at = instance.served_at
+    finally:
+        mastodon.stop()
+        mastodon.shutdown()
+        elastic.shutdown()
+    return _summary(result, url, sent_at, elastic.indexed)
+
+
+def _commit() -> str | None:
+    process = run(  # nosec B603 B607
+        ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+        text=True, stdin=DEVNULL)
+    return process.stdout.strip() or None
+
+
+def _compare(results: dict, previous: dict) -> None:
+    print(f'Compared to {previous.get("commit")} '
+        +f'({previous.get("created_at")}):')
+    print(f'{"scenario":9} {"metric":20} {"before":>10} {"after":>10} '
+        +f'{"change":>8}')
+    for scenario, result in results.items():
+        before = previous['results'].get(scenario)
+        if (before is None):
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if (not old or new is None):
+                continue
+            change = new / old - 1
+            worse = change < 0 if higher_is_better else change > 0
+            print(f'{scenario:9} {metric:20} {old:10.3f} {new:10.3f} '
+                +f'{change:+7.1%}' + (' worse' if worse else ''))
+
+
+@click.command()
+@click.option(
+    '-s', '--scenario', type=click.Choice(SCENARIOS), multiple=True,
+    help='Scenario to run. Can be given multiple times. Default: all')
+@click.option(
+    '--statuses', type=int, default=20_000, show_default=True,
+    help='Number of statuses of the save scenario.')
+@click.option(
+    '--crawl-statuses', type=int, default=400, show_default=True,
+    help='Number of statuses of the crawler scenario.')
+@click.option(
+    '--stream-rate', type=float, default=5, show_default=True,
+    help='Statuses posted per second in the streamer scenario.')
+@click.option(
+    '--stream-seconds', type=float, default=20, show_default=True,
+    help='Duration of the streamer scenario in seconds.')
+@click.option(
+    '-o', '--output', type=click.Path(dir_okay=False),
+    help='Save the results to this JSON file.')
+@click.option(
+    '-c', '--compare', type=click.Path(exists=True, dir_okay=False),
+    help='Compare the results to those saved in this JSON file.')
+def main(
+    scenario: tuple[str], statuses: int, crawl_statuses: int,
+    stream_rate: float, stream_seconds: float, output: str | None,
+    compare: str | None
+) -> None:
+    results = {}
+    print(f'{"scenario":9} {"statuses":>8} {"statuses/s":>10} '
+        +f'{"p50 s":>7} {"p99 s":>7} {"RSS MiB":>8} {"peak MiB":>8}')
+    for name in scenario or SCENARIOS:
+        result = benchmark(
+            name, statuses, crawl_statuses, stream_rate, stream_seconds)
+        results[name] = result
+        print(f'{name:9} {result["statuses"]:8} '
+            +f'{result["statuses_per_second"]:10.0f} '
+            +f'{result["latency_p50"] or 0:7.3f} '
+            +f'{result["latency_p99"] or 0:7.3f} '
+            +f'{result["rss_baseline_mib"]:8.1f} '
+            +f'{result["rss_peak_mib"]:8.1f}', flush=True)
+    run_info = {
+        'commit': _commit(),
+        'created_at': datetime.now(tz=UTC).isoformat(timespec='seconds'),
+        'python': python_version(),
+        'options': {
+            'statuses': statuses,
+            'crawl_statuses': crawl_statuses,
+            'stream_rate': stream_rate,
+            'stream_seconds': stream_seconds,
+        },
+        'results': results,
+    }
+    if (output):
+        with open(output, mode='w') as f:
+            dump(run_info, f, indent=1)
+    if (compare):
+        with open(compare) as f:
+            _compare(results, load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,622 @@
+"""Local stand-ins for Mastodon instances and Elasticsearch, and a generator
+of synthetic statuses, to measure crawling without network.
+
+FakeMastodon serves the public timeline and the public stream of any
+number of instances at http://127.0.0.1:<port>/<name>. FakeElasticsearch
+answers bulk requests as if all actions succeeded and records when every
+document arrived, so the latency from serving a status to indexing it can be
+measured.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timedelta, UTC
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+# Pseudo-random statuses and faults, not for security.
+from random import Random
+from threading import Event, Lock, Thread
+from time import monotonic, sleep, time
+import sys
+from urllib.parse import parse_qs, urlsplit
+
+import orjson
+
+from mastodon_search.crawl.snowflake import datetime_to_id
+
+WORDS = (
+    'the of and to in is that for it on was with as be at by this from '
+    'mastodon fediverse federated instance timeline toot boost post server '
+    'open source community weather coffee music photo cat dog book city '
+    'train election science climate research data search corpus'
+).split()
+LANGUAGES = ['en'] * 6 + ['de', 'ja', 'fr', 'es', None]
+REMOTE_DOMAINS = [
+    'mastodon.social', 'fosstodon.org', 'chaos.social', 'mstdn.jp',
+    'mas.to', 'hachyderm.io', 'infosec.exchange', 'pawoo.net',
+]
+
+
+class StatusGenerator:
+    """Generate statuses that look like those of the Mastodon API: with
+    media, cards, polls, mentions, tags and emojis in realistic shares,
+    from local and remote accounts.
+    """
+    def __init__(
+        self, domain: str, seed: int = 0, remote_share: float = 0.6,
+        accounts: int = 1000
+    ) -> None:
+        """Arguments:
+        domain -- domain of the instance the statuses are served by
+        seed -- seed of the random generator
+        remote_share -- share of statuses by accounts of other instances,
+            as on federated timelines
+        accounts -- number of distinct accounts posting
+        """
+        self.accounts = accounts
+        self.domain = domain
+        self.random = Random(seed)  # nosec B311
+        self.remote_share = remote_share
+
+    def _account(self, number: int) -> dict:
+        rnd = Random(number)  # nosec B311
+        remote = rnd.random() < self.remote_share
+        domain = rnd.choice(REMOTE_DOMAINS) if remote else self.domain
+        username = f'user{number}'
+        created_at = datetime(2017, 1, 1, tzinfo=UTC) \
+            + timedelta(days=rnd.randrange(2500))
+        return {
+            'id': str(100000 + number),
+            'username': username,
+            'acct': f'{username}@{domain}' if remote else username,
+            'display_name': f'User {number} :blobcat:',
+            'locked': rnd.random() < 0.05,
+            'bot': rnd.random() < 0.03,
+            'discoverable': rnd.random() < 0.8,
+            'group': False,
+            'created_at': created_at.isoformat(),
+            'note': '<p>' + ' '.join(rnd.choices(WORDS, k=20)) + '</p>',
+            'url': f'https://{domain}/@{username}',
+            'uri': f'https://{domain}/users/{username}',
+            'avatar': f'https://{domain}/avatars/{number}.png',
+            'avatar_static': f'https://{domain}/avatars/{number}.png',
+            'header': f'https://{domain}/headers/{number}.png',
+            'header_static': f'https://{domain}/headers/{number}.png',
+            'followers_count': int(rnd.lognormvariate(4, 2)),
+            'following_count': int(rnd.lognormvariate(4, 1.5)),
+            'statuses_count': int(rnd.lognormvariate(6, 2)),
+            'last_status_at': '2024-05-01',
+            'noindex': rnd.random() < 0.1,
+            'emojis': [{
+                'shortcode': 'blobcat',
+                'url': f'https://{domain}/emoji/blobcat.png',
+                'static_url': f'https://{domain}/emoji/blobcat.png',
+                'visible_in_picker': True,
+            }],
+            'fields': [
+                {'name': 'Web', 'value': f'https://{username}.example',
+                    'verified_at': None},
+            ] if rnd.random() < 0.5 else [],
+        }
+
+    def _media(self, number: int) -> dict:
+        kind = self.random.choice(['image'] * 8 + ['video', 'gifv'])
+        width, height = self.random.choice(
+            [(1280, 720), (1080, 1080), (640, 480), (720, 1280)])
+        meta = {
+            'original': {'width': width, 'height': height,
+                'size': f'{width}x{height}', 'aspect': width / height},
+            'small': {'width': width // 4, 'height': height // 4,
+                'size': f'{width // 4}x{height // 4}',
+                'aspect': width / height},
+            'focus': {'x': round(self.random.uniform(-1, 1), 2),
+                'y': round(self.random.uniform(-1, 1), 2)},
+        }
+        if (kind != 'image'):
+            meta['original'].update(
+                duration=self.random.uniform(1, 120), frame_rate='30/1',
+                bitrate=1_000_000)
+        return {
+            'id': str(number),
+            'type': kind,
+            'url': f'https://{self.domain}/media/{number}.bin',
+            'preview_url': f'https://{self.domain}/media/{number}_s.png',
+            'remote_url': None,
+            'preview_remote_url': None,
+            'text_url': None,
+            'meta': meta,
+            'description': ' '.join(self.random.choices(WORDS, k=12))
+                if self.random.random() < 0.5 else None,
+            'blurhash': 'UBL_:rOpGG-oBUNG,qRj2so|=eE1w^n4S5NH',
+        }
+
+    def status(self, status_id: str, created_at: datetime) -> dict:
+        """Return a status as the Mastodon API serializes it."""
+        rnd = self.random
+        account = self._account(rnd.randrange(self.accounts))
+        remote = '@' in account['acct']
+        domain = account['acct'].split('@')[1] if remote else self.domain
+        words = rnd.choices(WORDS, k=int(rnd.lognormvariate(3, 0.7)) + 1)
+        mentions = []
+        for _ in range(rnd.choice([0] * 7 + [1, 1, 2])):
+            other = self._account(rnd.randrange(self.accounts))
+            mentions.append({
+                'id': other['id'],
+                'username': other['username'],
+                'url': other['url'],
+                'acct': other['acct'],
+            })
+        tags = [
+            {'name': name, 'url': f'https://{self.domain}/tags/{name}'}
+            for name in set(rnd.choices(WORDS, k=rnd.choice([0] * 8 + [1, 3])))
+        ]
+        content = ''.join(
+            f'<span class="h-card"><a href="{m["url"]}">@{m["username"]}'
+            + '</a></span> ' for m in mentions
+        ) + ' '.join(words) + ''.join(
+            f' <a href="{t["url"]}" class="hashtag">#{t["name"]}</a>'
+            for t in tags
+        )
+        card = None
+        if (rnd.random() < 0.1):
+            card = {
+                'url': f'https://news.example/{status_id}',
+                'title': ' '.join(rnd.choices(WORDS, k=6)),
+                'description': ' '.join(rnd.choices(WORDS, k=25)),
+                'type': 'link', 'author_name': '', 'author_url': '',
+                'provider_name': 'News', 'provider_url': '', 'html': '',
+                'width': 400, 'height': 200,
+                'image': 'https://news.example/image.png',
+                'embed_url': '', 'blurhash': 'UBL_:rOp', 'language': 'en',
+                'published_at': None, 'image_description': '',
+            }
+        poll = None
+        if (rnd.random() < 0.02):
+            poll = {
+                'id': status_id,
+                'expires_at': (created_at + timedelta(days=1)).isoformat(),
+                'expired': False,
+                'multiple': rnd.random() < 0.3,
+                'votes_count': rnd.randrange(100),
+                'voters_count': rnd.randrange(100),
+                'options': [
+                    {'title': word, 'votes_count': rnd.randrange(50)}
+                    for word in rnd.sample(WORDS, rnd.randrange(2, 5))
+                ],
+                'emojis': [],
+            }
+        return {
+            'id': status_id,
+            'created_at': created_at.isoformat(),
+            'in_reply_to_id': str(int(status_id) - 1000)
+                if rnd.random() < 0.3 else None,
+            'in_reply_to_account_id': str(100000 + rnd.randrange(
+                self.accounts)) if rnd.random() < 0.3 else None,
+            'sensitive': rnd.random() < 0.05,
+            'spoiler_text': 'cw' if rnd.random() < 0.05 else '',
+            'visibility': 'public',
+            'language': rnd.choice(LANGUAGES),
+            'uri': f'https://{domain}/users/{account["username"]}/statuses/'
+                + status_id,
+            'url': f'https://{domain}/@{account["username"]}/{status_id}',
+            'replies_count': rnd.randrange(5),
+            'reblogs_count': rnd.randrange(10),
+            'favourites_count': rnd.randrange(20),
+            'edited_at': created_at.isoformat()
+                if rnd.random() < 0.03 else None,
+            'content': f'<p>{content}</p>',
+            'reblog': None,
+            'application': None if remote
+                else {'name': 'Web', 'website': None},
+            'account': account,
+            'media_attachments': [
+                self._media(int(status_id) + i)
+                for i in range(rnd.choice([0] * 8 + [1, 4]))
+            ],
+            'mentions': mentions,
+            'tags': tags,
+            'emojis': [{
+                'shortcode': 'blobcat',
+                'url': f'https://{domain}/emoji/blobcat.png',
+                'static_url': f'https://{domain}/emoji/blobcat.png',
+                'visible_in_picker': True,
+            }] if ':blobcat:' in content else [],
+            'card': card,
+            'poll': poll,
+        }
+
+
+class FakeInstance:
+    """The public timeline of a fake instance. Statuses are posted with
+    post, or at random with a mean rate by FakeMastodon. Faults like rate
+    limits, slow or failing responses, stream disconnects and outages are
+    off by default.
+    """
+    def __init__(
+        self,
+        name: str,
+        rate: float = 0,
+        seed: int = 0,
+        max_statuses: int = 100_000,
+        rate_limit: int | None = None,
+        rate_limit_window: float = 300,
+        delay: float = 0,
+        error_rate: float = 0,
+        streaming: bool = True,
+        stream_lifetime: float | None = None,
+    ) -> None:
+        """Arguments:
+        name -- path of the instance on the server
+        rate -- statuses posted per second
+        seed -- seed of the status generator and of the faults
+        max_statuses -- number of newest statuses kept
+        rate_limit -- requests per window before answering with 429, like
+            Mastodon's X-RateLimit headers. Default: unlimited
+        rate_limit_window -- seconds after which the rate limit resets
+        delay -- mean seconds a response is delayed, exponentially
+            distributed
+        error_rate -- share of requests answered with a server error
+        streaming -- whether the public stream is available without token
+        stream_lifetime -- mean seconds until a stream connection is closed,
+            exponentially distributed. Default: never
+        """
+        self.delay = delay
+        # Answer all requests with 503 and close streams, see: FakeMastodon
+        self.down = False
+        self.error_rate = error_rate
+        self.generator = StatusGenerator(f'{name}.example', seed=seed)
+        # Integer IDs and the serialized statuses, oldest first
+        self.ids: list[int] = []
+        self.last_id = 0
+        self.lock = Lock()
+        self.max_statuses = max_statuses
+        self.name = name
+        # Monotonic time of the next post at the current rate
+        self.next_post_at: float | None = None
+        # Monotonic time every status was posted, by ID
+        self.posted_at: dict[str, float] = {}
+        self.random = Random(seed)  # nosec B311
+        self.rate = rate
+        self.rate_limit = rate_limit
+        self.rate_limit_remaining = rate_limit
+        self.rate_limit_reset = time() + rate_limit_window
+        self.rate_limit_window = rate_limit_window
+        # Number of requests by outcome, e. g. 'ok' or 'rate_limited'
+        self.requests: Counter[str] = Counter()
+        # Monotonic time every status was first served, by ID
+        self.served_at: dict[str, float] = {}
+        self.statuses: list[bytes] = []
+        self.stream_lifetime = stream_lifetime
+        self.streaming = streaming
+        self.streams: list[Queue] = []
+
+    def admit(self) -> tuple[int, dict[str, str]]:
+        """Count a request and decide whether it fails. Return the HTTP
+        status and the rate limit headers of the response.
+        """
+        if (self.delay):
+            sleep(self.random.expovariate(1 / self.delay))
+        with self.lock:
+            if (self.down):
+                self.requests['down'] += 1
+                return 503, {}
+            if (self.random.random() < self.error_rate):
+                self.requests['error'] += 1
+                return self.random.choice([500, 502, 503, 504]), {}
+            if (self.rate_limit is None):
+                self.requests['ok'] += 1
+                return 200, {}
+            now = time()
+            if (now >= self.rate_limit_reset):
+                self.rate_limit_remaining = self.rate_limit
+                self.rate_limit_reset = now + self.rate_limit_window
+            headers = {
+                'X-RateLimit-Limit': str(self.rate_limit),
+                'X-RateLimit-Remaining': str(
+                    max(self.rate_limit_remaining - 1, 0)),
+                'X-RateLimit-Reset': datetime.fromtimestamp(
+                    self.rate_limit_reset, tz=UTC).isoformat(),
+            }
+            if (self.rate_limit_remaining <= 0):
+                self.requests['rate_limited'] += 1
+                headers['Retry-After'] = str(
+                    int(self.rate_limit_reset - now) + 1)
+                return 429, headers
+            self.rate_limit_remaining -= 1
+            self.requests['ok'] += 1
+        return 200, headers
+
+    def post(self, n: int = 1) -> None:
+        """Post n new statuses now."""
+        now = datetime.now(tz=UTC)
+        posted_at = monotonic()
+        with self.lock:
+            for _ in range(n):
+                status_id = max(int(datetime_to_id(now)), self.last_id + 1)
+                self.last_id = status_id
+                data = orjson.dumps(
+                    self.generator.status(str(status_id), now))
+                self.ids.append(status_id)
+                self.posted_at[str(status_id)] = posted_at
+                self.statuses.append(data)
+                for stream in self.streams:
+                    stream.put((str(status_id), data))
+            if (len(self.ids) > self.max_statuses):
+                del self.ids[:-self.max_statuses]
+                del self.statuses[:-self.max_statuses]
+
+    def served(self, status_id: str) -> None:
+        self.served_at.setdefault(status_id, monotonic())
+
+    def timeline(
+        self, min_id: str | None, max_id: str | None, since_id: str | None,
+        limit: int = 20
+    ) -> bytes:
+        """Return the statuses of a public timeline request, newest first."""
+        limit = min(limit, 40)
+        with self.lock:
+            start = 0
+            end = len(self.ids)
+            if (max_id):
+                end = bisect_left(self.ids, int(max_id))
+            if (since_id):
+                start = bisect_right(self.ids, int(since_id))
+            if (min_id):
+                # The statuses right after min_id.
+                start = bisect_right(self.ids, int(min_id))
+                end = min(end, start + limit)
+            start = max(start, end - limit)
+            page = self.statuses[start:end]
+            ids = self.ids[start:end]
+        for status_id in ids:
+            self.served(str(status_id))
+        return b'[' + b','.join(reversed(page)) + b']'
+
+
+class _MastodonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeMastodon'
+
+    def _send(
+        self, code: int, body: bytes = b'{}',
+        headers: dict[str, str] | None = None
+    ) -> None:
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, instance: FakeInstance) -> None:
+        if (not instance.streaming):
+            self._send(401, b'{"error":"This method requires an '
+                + b'authenticated user"}')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        stream: Queue = Queue()
+        with instance.lock:
+            instance.streams.append(stream)
+        closes_at = monotonic() + instance.random.expovariate(
+            1 / instance.stream_lifetime) if instance.stream_lifetime \
+            else float('inf')
+
+        def write(data: bytes) -> None:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+        try:
+            write(b':)\n')
+            while (
+                not self.server.stopped.is_set()
+                and not instance.down
+                and monotonic() < closes_at
+            ):
+                try:
+                    status_id, data = stream.get(timeout=1)
+                except Empty:
+                    write(b':thump\n')
+                    continue
+                instance.served(status_id)
+                write(b'event: update\ndata: ' + data + b'\n\n')
+            # End the chunked response, like a server that closes a stream.
+            write(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with instance.lock:
+                instance.streams.remove(stream)
+            self.close_connection = True
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        name, _, path = url.path.strip('/').partition('/')
+        instance = self.server.instances.get(name)
+        if (instance is None):
+            self._send(404)
+            return
+        code, headers = instance.admit()
+        if (code != 200):
+            self._send(code, b'{"error":"Simulated failure"}', headers)
+            return
+        if (path == 'api/v1/timelines/public'):
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self._send(200, instance.timeline(
+                query.get('min_id'), query.get('max_id'),
+                query.get('since_id'), int(query.get('limit', 20))),
+                headers)
+        elif (path == 'api/v1/streaming/public'):
+            self._stream(instance)
+        elif (path == 'api/v1/instance'):
+            # Without a streaming URL, Mastodon.py streams from the base URL.
+            self._send(200, orjson.dumps({
+                'uri': f'{name}.example', 'title': name, 'version': '4.2.0',
+                'urls': {},
+            }), headers)
+        elif (path == 'api/v2/instance'):
+            self._send(200, orjson.dumps({
+                'domain': f'{name}.example', 'title': name,
+                'version': '4.2.0', 'configuration': {'urls': {}},
+            }), headers)
+        else:
+            self._send(404)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class FakeMastodon(ThreadingHTTPServer):
+    """Serve fake instances at http://127.0.0.1:<port>/<name> and post
+    their statuses at their rates.
+    """
+    daemon_threads = True
+
+    def __init__(self, instances: list[FakeInstance]) -> None:
+        super().__init__(('127.0.0.1', 0), _MastodonHandler)
+        self.instances = {instance.name: instance for instance in instances}
+        self.stopped = Event()
+
+    def _post(self, interval: float = 0.05) -> None:
+        """Post statuses of all instances at their rates, as Poisson
+        processes. Run as thread.
+        """
+        while (not self.stopped.is_set()):
+            sleep(interval)
+            now = monotonic()
+            for instance in self.instances.values():
+                if (instance.rate <= 0):
+                    instance.next_post_at = None
+                    continue
+                if (instance.next_post_at is None):
+                    instance.next_post_at = now \
+                        + instance.random.expovariate(instance.rate)
+                n = 0
+                while (instance.next_post_at <= now):
+                    n += 1
+                    instance.next_post_at += \
+                        instance.random.expovariate(instance.rate)
+                if (n):
+                    instance.post(n)
+
+    def handle_error(self, request, client_address) -> None:
+        # Crawlers disconnect at any time.
+        if (not isinstance(sys.exc_info()[1], ConnectionError)):
+            super().handle_error(request, client_address)
+
+    def start(self) -> None:
+        Thread(target=self.serve_forever, daemon=True).start()
+        Thread(target=self._post, daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop posting and end all streams."""
+        self.stopped.set()
+
+    def url(self, instance: FakeInstance) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/{instance.name}'
+
+    def served_at(self) -> dict[tuple[str, str], float]:
+        """Return when every status was first served, by instance URL and
+        ID.
+        """
+        return {
+            (self.url(instance), status_id): served_at
+            for instance in self.instances.values()
+            for status_id, served_at in instance.served_at.items()
+        }
+
+
+class _ElasticHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeElasticsearch'
+
+    def _send(self, code: int, body: bytes = b'{}') -> None:
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        if (self.command != 'HEAD'):
+            self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _bulk(self) -> None:
+        lines = self._body().splitlines()
+        now = monotonic()
+        ids = []
+        items = []
+        # Every action is followed by its document.
+        for line in lines[::2]:
+            op, meta = next(iter(orjson.loads(line).items()))
+            ids.append(meta.get('_id'))
+            items.append(b'{"%s":{"_id":"%s","status":201}}'
+                % (op.encode(), str(meta.get('_id')).encode()))
+        with self.server.lock:
+            for doc_id in ids:
+                self.server.indexed.setdefault(doc_id, now)
+        self._send(200, b'{"errors":false,"took":1,"items":['
+            + b','.join(items) + b']}')
+
+    def do_HEAD(self) -> None:
+        # No index exists.
+        self._send(404)
+
+    def do_GET(self) -> None:
+        self._body()
+        if (self.path.split('?')[0].endswith('/_search')):
+            self._search()
+        else:
+            self._send(404, b'{"found":false}')
+
+    def do_POST(self) -> None:
+        if (self.path.split('?')[0].endswith('/_bulk')):
+            self._bulk()
+            return
+        self._body()
+        if (self.path.split('?')[0].endswith('/_search')):
+            self._search()
+        else:
+            self._send(200, b'{"acknowledged":true}')
+
+    def do_PUT(self) -> None:
+        if (self.path.split('?')[0].endswith('/_bulk')):
+            self._bulk()
+            return
+        self._body()
+        self._send(200, b'{"acknowledged":true}')
+
+    def _search(self) -> None:
+        self._send(200, b'{"took":1,"timed_out":false,'
+            + b'"hits":{"total":{"value":0,"relation":"eq"},"hits":[]}}')
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class FakeElasticsearch(ThreadingHTTPServer):
+    """Answer bulk requests as if all actions succeeded, and searches as if
+    there were no statuses.
+    """
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), _ElasticHandler)
+        # Monotonic time every document first arrived, by its _id
+        self.indexed: dict[str, float] = {}
+        self.lock = Lock()
+
+    @property
+    def host(self) -> str:
+        return 'http://127.0.0.1'
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> None:
+        Thread(target=self.serve_forever, daemon=True).start()
@@ -0,0 +1,438 @@
+"""Simulate crawling many Mastodon instances with MultiCrawler (as
+`crawl-many` does), without network. All instances are served by one local
+stand-in (see fake.py), each with its own posting rate, rate limit, slow or
+failing responses, stream availability and stream disconnects. Some of them
+go down for a while in the middle of the simulation.
+
+Posting rates are drawn from the log-normal distribution of mean weekly
+statuses that `choose-instances` fits to the output of
+`obtain-instance-data`. Real instances post rarely, so the simulated time
+runs --speed times faster: rates are multiplied and poll waits, rate limit
+windows and stream lifetimes are divided by it.
+
+Reported are requests per status, the catch-up time after the outage, the
+memory growth of the crawling process, and coverage and delay from posting
+to indexing by activity quartile, to compare busy and quiet instances.
+
+Usage, from the root of the repository:
+python -m benchmarks.simulate [OPTIONS]
+"""
+
+from datetime import datetime, UTC
+from json import dump
+from math import log
+from multiprocessing import get_context
+from os import dup2, sysconf
+# Pseudo-random instances, not for security.
+from random import Random
+from statistics import linear_regression, median, quantiles
+from threading import Thread
+from time import monotonic, sleep
+import sys
+
+import click
+
+from benchmarks.fake import FakeElasticsearch, FakeInstance, FakeMastodon
+from mastodon_search.crawl.transform import status_id
+
+WEEK = 7 * 24 * 3600
+# Shape, location and scale of the log-normal distribution of mean weekly
+# statuses per instance, used without instance data: a median of 50 with a
+# long tail of instances that are a thousand times as active.
+DEFAULT_WEEKLY_STATUSES = (2.5, 0, 50)
+# Requests per window of Mastodon's default rate limit.
+RATE_LIMIT = 300
+RATE_LIMIT_WINDOW = 300
+# Seconds between two memory samples of the crawling process.
+SAMPLE_INTERVAL = 5
+
+
+def weekly_statuses_fit(file: str | None) -> tuple[float, float, float]:
+    """Return the log-normal fit of mean weekly statuses of instance data,
+    see: Analyzer.fit_distributions
+    """
+    if (file is None):
+        return DEFAULT_WEEKLY_STATUSES
+    from mastodon_search.instance_data.analyze import Analyzer
+    with open(file) as f:
+        analyzer = Analyzer(f)
+    return analyzer.fit_distributions()['mean_weekly_statuses']
+
+
+def fake_instances(
+    n: int, fit: tuple[float, float, float], speed: float,
+    streaming_share: float, error_share: float, seed: int
+) -> list[FakeInstance]:
+    """Return n instances with random rates and faults.
+
+    Arguments:
+    n -- number of instances
+    fit -- shape, location and scale of the weekly statuses per instance
+    speed -- how much faster the simulated time runs
+    streaming_share -- share of instances that allow public streaming
+    error_share -- share of instances that fail some of their requests
+    seed -- seed of the random generator
+    """
+    rnd = Random(seed)  # nosec B311
+    shape, location, scale = fit
+    instances = []
+    for i in range(n):
+        weekly = location + rnd.lognormvariate(log(scale), shape)
+        instances.append(FakeInstance(
+            f'instance{i:04d}',
+            rate=max(weekly, 0) / WEEK * speed,
+            seed=seed + i,
+            rate_limit=RATE_LIMIT,
+            rate_limit_window=RATE_LIMIT_WINDOW / speed,
+            # Most instances respond within 100 ms, some take seconds.
+            delay=min(rnd.lognormvariate(log(0.03), 1), 5),
+            error_rate=rnd.uniform(0.05, 0.5)
+                if rnd.random() < error_share else 0,
+            streaming=rnd.random() < streaming_share,
+            stream_lifetime=rnd.lognormvariate(log(600 / speed), 1),
+        ))
+    return instances
+
+
+def _rss_mib() -> float:
+    """Return the current resident set size of this process in MiB."""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def crawl(
+    urls: list[str], port: int, options: dict, started, results
+) -> None:
+    """Crawl all instances with MultiCrawler and sample the memory usage
+    until the end of the simulation. Run as process.
+    """
+    # Also catches output of modules that bound sys.stderr when imported.
+    log_file = open(options['log'], mode='a')
+    dup2(log_file.fileno(), sys.stdout.fileno())
+    dup2(log_file.fileno(), sys.stderr.fileno())
+    from mastodon_search.crawl.many import MultiCrawler
+    from mastodon_search.crawl.save import _Save
+    from mastodon_search.crawl.schedule import (
+        PollScheduler, PredictivePollScheduler
+    )
+    speed = options['speed']
+    if (options['schedule'] == 'predictive'):
+        scheduler = PredictivePollScheduler(
+            max_wait=3600 / speed, half_life=6 * 3600 / speed,
+            prior_weight=600 / speed, default_rate=speed / 600)
+    else:
+        scheduler = PollScheduler(
+            initial_wait=60 / speed, max_wait=3600 / speed)
+    crawler = MultiCrawler(
+        urls,
+        max_streams=options['max_streams'],
+        start_interval=options['start_interval'],
+        status_interval=60,
+        retry_wait=300 / speed,
+        scheduler=scheduler,
+        save=_Save(flush_count=500, flush_age=5, bulk_workers=2),
+    )
+    Thread(
+        target=crawler.crawl_to_elastic,
+        args=('http://127.0.0.1', '', port, ''),
+        daemon=True
+    ).start()
+    start = monotonic()
+    started.set()
+    samples = []
+    while (monotonic() - start < options['duration']):
+        samples.append((monotonic() - start, _rss_mib()))
+        sleep(SAMPLE_INTERVAL)
+    results.put({'rss': samples, 'poller_requests': crawler.poller.requests})
+
+
+def _percentiles(values: list[float]) -> tuple[float | None, float | None]:
+    """Return the median and the 99th percentile."""
+    if (len(values) < 2):
+        return (values[0], values[0]) if values else (None, None)
+    return (
+        median(values), quantiles(values, n=100, method='inclusive')[98])
+
+
+def _delays(
+    instance: FakeInstance, url: str, indexed: dict[str, float],
+    since: float, until: float
+) -> tuple[int, int, list[float]]:
+    """Return the number of statuses an instance posted in a period, how
+    many of them were fetched, and the delays until the indexed ones were
+    indexed.
+    """
+    posted = 0
+    fetched = 0
+    delays = []
+    for key, posted_at in instance.posted_at.items():
+        if (not since <= posted_at < until):
+            continue
+        posted += 1
+        fetched += key in instance.served_at
+        if ((indexed_at := indexed.get(
+            str(status_id({'id': key}, url)))) is not None):
+            delays.append(indexed_at - posted_at)
+    return posted, fetched, delays
+
+
+def summarize(
+    mastodon: FakeMastodon, elastic: FakeElasticsearch, start: float,
+    options: dict, outage: list[FakeInstance], outage_start: float,
+    outage_end: float, result: dict
+) -> dict:
+    indexed = elastic.indexed
+    instances = list(mastodon.instances.values())
+    rates = {instance.name: instance.rate for instance in instances}
+    since = start + options['warmup']
+    until = start + options['duration'] - options['settle']
+    # Fairness and coverage by activity quartile, quietest first
+    by_rate = sorted(instances, key=lambda instance: rates[instance.name])
+    quartiles = []
+    all_statuses = 0
+    for q in range(4):
+        group = by_rate[q * len(by_rate) // 4:(q + 1) * len(by_rate) // 4]
+        posted = 0
+        fetched = 0
+        delays = []
+        requests = 0
+        statuses = 0
+        for instance in group:
+            url = mastodon.url(instance)
+            n, instance_fetched, instance_delays = _delays(
+                instance, url, indexed, since, until)
+            posted += n
+            fetched += instance_fetched
+            delays.extend(instance_delays)
+            requests += sum(instance.requests.values())
+            statuses += len(_delays(
+                instance, url, indexed, 0, float('inf'))[2])
+        all_statuses += statuses
+        p50, p99 = _percentiles(delays)
+        quartiles.append({
+            'instances': len(group),
+            'statuses_per_second': sum(
+                rates[instance.name] for instance in group),
+            'posted': posted,
+            'fetched': fetched / posted if posted else None,
+            'coverage': len(delays) / posted if posted else None,
+            'delay_p50': p50,
+            'delay_p99': p99,
+            'requests': requests,
+            'requests_per_status': requests / statuses if statuses else None,
+        })
+    # Catch-up of the instances that were down
+    catch_up = []
+    missed = 0
+    for instance in outage:
+        url = mastodon.url(instance)
+        posted, _, delays = _delays(
+            instance, url, indexed, outage_start, outage_end)
+        if (not posted):
+            continue
+        if (len(delays) < posted):
+            missed += 1
+            continue
+        last_indexed = max(
+            indexed[str(status_id({'id': key}, url))]
+            for key, posted_at in instance.posted_at.items()
+            if outage_start <= posted_at < outage_end
+        )
+        catch_up.append(max(last_indexed - outage_end, 0))
+    catch_up_p50, catch_up_p99 = _percentiles(catch_up)
+    # Memory after the warmup
+    samples = [(t, rss) for t, rss in result['rss'] if t >= options['warmup']]
+    slope = linear_regression(*zip(*samples)).slope * 60 \
+        if len(samples) > 1 else None
+    outcomes = {}
+    for instance in instances:
+        for outcome, n in instance.requests.items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + n
+    requests = sum(outcomes.values())
+    return {
+        'statuses': all_statuses,
+        'requests': outcomes,
+        'requests_per_status': requests / all_statuses
+            if all_statuses else None,
+        'catch_up': {
+            'instances': len(outage),
+            'with_statuses': len(catch_up) + missed,
+            'caught_up': len(catch_up),
+            'seconds_p50': catch_up_p50,
+            'seconds_p99': catch_up_p99,
+            'seconds_max': max(catch_up, default=None),
+        },
+        'memory': {
+            'rss_start_mib': samples[0][1] if samples else None,
+            'rss_end_mib': samples[-1][1] if samples else None,
+            'rss_peak_mib': max((rss for _, rss in samples), default=None),
+            'growth_mib_per_minute': slope,
+        },
+        'quartiles': quartiles,
+    }
+
+
+def _print(summary: dict) -> None:
+    def number(value: float | None, digits: int = 2) -> str:
+        return '-' if value is None else f'{value:.{digits}f}'
+
+    requests = ', '.join(
+        f'{n} {outcome}' for outcome, n in sorted(summary['requests'].items()))
+    print(f'Indexed statuses: {summary["statuses"]}')
+    print(f'Requests: {requests}')
+    print('Requests per status: '
+        + number(summary['requests_per_status']))
+    catch_up = summary['catch_up']
+    print(f'Catch-up after outage: {catch_up["caught_up"]} of '
+        +f'{catch_up["with_statuses"]} instances with statuses during the '
+        +f'outage caught up, p50 {number(catch_up["seconds_p50"], 1)} s, '
+        +f'p99 {number(catch_up["seconds_p99"], 1)} s, '
+        +f'max {number(catch_up["seconds_max"], 1)} s')
+    memory = summary['memory']
+    print(f'Memory: {number(memory["rss_start_mib"], 1)} MiB after warmup, '
+        +f'{number(memory["rss_end_mib"], 1)} MiB at the end, '
+        +f'{number(memory["growth_mib_per_minute"])} MiB/min')
+    def share(value: float | None) -> str:
+        return f'{"-":>8}' if value is None else f'{value:8.1%}'
+
+    print(f'{"quartile":8} {"statuses/s":>10} {"posted":>7} {"fetched":>8} '
+        +f'{"indexed":>8} {"p50 s":>7} {"p99 s":>7} {"req/status":>10}')
+    for i, quartile in enumerate(summary['quartiles']):
+        print(f'{("quietest", "quiet", "busy", "busiest")[i]:8} '
+            +f'{quartile["statuses_per_second"]:10.3f} '
+            +f'{quartile["posted"]:7} '
+            +f'{share(quartile["fetched"])} {share(quartile["coverage"])}'
+            +f' {number(quartile["delay_p50"], 1):>7} '
+            +f'{number(quartile["delay_p99"], 1):>7} '
+            +f'{number(quartile["requests_per_status"]):>10}')
+
+
+@click.command()
+@click.option('-n', '--instances', default=1000, show_default=True,
+    help='Number of simulated instances.')
+@click.option('--instance-data', type=click.Path(exists=True, dir_okay=False),
+    help='Output of `obtain-instance-data` to fit the posting rates to. '
+        +'Default: a built-in distribution')
+@click.option('--speed', default=10.0, show_default=True,
+    help='How many times faster the simulated time runs.')
+@click.option('--duration', default=300.0, show_default=True,
+    help='Seconds the simulation runs.')
+@click.option('--warmup', default=30.0, show_default=True,
+    help='Seconds after the start that are left out of the results.')
+@click.option('--settle', default=60.0, show_default=True,
+    help='Seconds at the end without new statuses, so that the crawler can '
+        +'catch up.')
+@click.option('--outage-at', default=90.0, show_default=True,
+    help='Seconds after the start when instances go down.')
+@click.option('--outage-seconds', default=60.0, show_default=True,
+    help='Seconds the instances are down.')
+@click.option('--outage-share', default=0.1, show_default=True,
+    help='Share of instances that go down.')
+@click.option('--streaming-share', default=0.2, show_default=True,
+    help='Share of instances that allow public streaming.')
+@click.option('--error-share', default=0.1, show_default=True,
+    help='Share of instances that fail some of their requests.')
+@click.option('--schedule', default='adaptive', show_default=True,
+    type=click.Choice(['adaptive', 'predictive']),
+    help='How to schedule polls, see: crawl-many')
+@click.option('--max-streams', default=100, show_default=True,
+    help='Maximum number of simultaneously open streaming connections.')
+@click.option('--start-interval', default=0.01, show_default=True,
+    help='Seconds to wait between starting two instances.')
+@click.option('--seed', default=0, show_default=True,
+    help='Seed of the random instances.')
+@click.option('--log', default='simulate.log', show_default=True,
+    type=click.Path(dir_okay=False),
+    help='File the output of the crawler is appended to.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False),
+    help='Save the results to this JSON file.')
+def main(
+    instances, instance_data, speed, duration, warmup, settle, outage_at,
+    outage_seconds, outage_share, streaming_share, error_share, schedule,
+    max_streams, start_interval, seed, log, output
+) -> None:
+    options = {
+        'instances': instances,
+        'speed': speed,
+        'duration': duration,
+        'warmup': warmup,
+        'settle': settle,
+        'outage_at': outage_at,
+        'outage_seconds': outage_seconds,
+        'outage_share': outage_share,
+        'streaming_share': streaming_share,
+        'error_share': error_share,
+        'schedule': schedule,
+        'max_streams': max_streams,
+        'start_interval': start_interval,
+        'seed': seed,
+        'log': log,
+    }
+    fit = weekly_statuses_fit(instance_data)
+    fakes = fake_instances(
+        instances, fit, speed, streaming_share, error_share, seed)
+    rates = {instance.name: instance.rate for instance in fakes}
+    for instance in fakes:
+        instance.rate = 0
+    elastic = FakeElasticsearch()
+    elastic.start()
+    mastodon = FakeMastodon(fakes)
+    mastodon.start()
+    print(f'Simulating {instances} instances posting '
+        +f'{sum(rates.values()):.1f} statuses/s for {duration:.0f} s.',
+        flush=True)
+    context = get_context('spawn')
+    started = context.Event()
+    results = context.Queue()
+    process = context.Process(
+        target=crawl,
+        args=([mastodon.url(i) for i in fakes], elastic.port, options,
+            started, results),
+        daemon=True
+    )
+    process.start()
+    started.wait()
+    start = monotonic()
+    for instance in fakes:
+        instance.rate = rates[instance.name]
+    outage = Random(seed).sample(  # nosec B311
+        fakes, round(instances * outage_share))
+    sleep(max(start + outage_at - monotonic(), 0))
+    outage_start = monotonic()
+    for instance in outage:
+        instance.down = True
+    print(f'{len(outage)} instances down.', flush=True)
+    sleep(max(start + outage_at + outage_seconds - monotonic(), 0))
+    outage_end = monotonic()
+    for instance in outage:
+        instance.down = False
+    print(f'{len(outage)} instances up again.', flush=True)
+    sleep(max(start + duration - settle - monotonic(), 0))
+    for instance in fakes:
+        instance.rate = 0
+    print('Settling.', flush=True)
+    result = results.get()
+    process.terminate()
+    mastodon.stop()
+    # Restore the rates for the results.
+    for instance in fakes:
+        instance.rate = rates[instance.name]
+    summary = summarize(
+        mastodon, elastic, start, options, outage, outage_start, outage_end,
+        result)
+    summary['poller_requests'] = result['poller_requests']
+    _print(summary)
+    if (output):
+        with open(output, mode='w') as f:
+            dump({
+                'created_at': datetime.now(tz=UTC).isoformat(
+                    timespec='seconds'),
+                'options': options,
+                'weekly_statuses_fit': fit,
+                'results': summary,
+            }, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Measure how many statuses per second a single core converts to bulk
+actions, with elasticsearch_dsl documents (before) and directly (after).
+
+Usage, from the root of the repository:
+python -m benchmarks.transform
+"""
+
+from time import perf_counter
+
+from mastodon_search.crawl.examples import CRAWLED_AT, STATUSES
+from mastodon_search.crawl.transform import (
+    status_to_action, status_to_document
+)
+
+
+def _document_action(*args) -> dict:
+    return status_to_document(*args).to_dict(include_meta=True)
+
+
+def statuses_per_second(transform, seconds: float = 3) -> float:
+    n = 0
+    start = perf_counter()
+    while (perf_counter() - start < seconds):
+        for status in STATUSES:
+            transform(
+                status, 'example.com', 'api/v1/timelines/public',
+                CRAWLED_AT
+            )
+        n += len(STATUSES)
+    return n / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    before = statuses_per_second(_document_action)
+    after = statuses_per_second(status_to_action)
+    print(f'status_to_document: {before:10.0f} statuses/s')
+    print(f'status_to_action:   {after:10.0f} statuses/s')
+    print(f'speedup:            {after / before:10.1f}x')
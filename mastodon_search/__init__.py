@@ -1 +1 @@
-__all__ = ['crawl', 'elastic_dsl', 'instance_data']
+__all__ = ['crawl', 'elastic_dsl', 'export', 'instance_data']
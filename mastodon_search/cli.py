@@ -8,6 +8,230 @@ _CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 def main():
     pass
 
+def _save_options(command):
+    """Add the options configuring how statuses are saved to ES and how
+    crawling is monitored.
+    """
+    options = [
+        click.option('--spool-dir', type=click.Path(file_okay=False),
+            help='Directory for a write-ahead spool of statuses not yet '
+                +'saved to ES. Unsaved statuses are saved on the next '
+                +'start.'),
+        click.option('--max-buffer-size', type=click.IntRange(min=1),
+            help='Maximum size in MiB of statuses queued in memory, '
+                +'measured as JSON. When reached, crawling pauses until '
+                +'statuses were saved to ES. Default: unlimited'),
+        click.option('--spill', is_flag=True,
+            help='Write statuses only to the spool instead of pausing when '
+                +'the buffer is full. Requires --spool-dir.'),
+        click.option('--flush-count', default=500,
+            type=click.IntRange(min=1),
+            help='Save to ES when this many statuses are queued. '
+                +'Default: 500'),
+        click.option('--flush-size', default=16,
+            type=click.IntRange(min=1),
+            help='Save to ES when queued statuses take this many MiB. '
+                +'Default: 16'),
+        click.option('--flush-age', default=1800,
+            type=click.FloatRange(min=0),
+            help='Save to ES when the oldest queued status is this many '
+                +'seconds old. Default: 1800'),
+        click.option('--bulk-size', default=500,
+            type=click.IntRange(min=1),
+            help='Initial number of statuses per bulk request. It is '
+                +'adapted to the latency and rejections of ES. Default: 500'),
+        click.option('--bulk-min-size', default=50,
+            type=click.IntRange(min=1),
+            help='Minimum number of statuses per bulk request. Default: 50'),
+        click.option('--bulk-max-size', default=5000,
+            type=click.IntRange(min=1),
+            help='Maximum number of statuses per bulk request. Default: 5000'),
+        click.option('--bulk-target-latency', default=10,
+            type=click.FloatRange(min=0),
+            help='Seconds a bulk request may take before fewer statuses are '
+                +'sent per request. Default: 10'),
+        click.option('--bulk-workers', default=1,
+            type=click.IntRange(min=1),
+            help='Maximum number of concurrent bulk requests. Default: 1'),
+        click.option('--dedup-size', default=0,
+            type=click.IntRange(min=0),
+            help='Skip statuses that were written before. This many recent '
+                +'statuses are remembered exactly, ten times as many in a '
+                +'Bloom filter, which may wrongly skip a new status with a '
+                +'probability of one in a million. 0 disables skipping. '
+                +'Default: 0'),
+        click.option('--dedup-file', type=click.Path(dir_okay=False),
+            help='File to remember written statuses in across restarts. '
+                +'Not with only --archive-dir.'),
+        click.option('--canonical', is_flag=True,
+            help='Store every status once for all instances it is crawled '
+                +'from, keyed by its ActivityPub URI, with the instance, '
+                +'local ID and crawl time of every sighting. Canonical '
+                +'statuses are stored in separate indices.'),
+        click.option('--split-accounts', is_flag=True,
+            help='Store accounts in a separate index instead of in every '
+                +'status. Statuses keep a reference and the attributes '
+                +'needed for filtering. An account is written again only '
+                +'when it changed.'),
+        click.option('--account-cache-size', default=100_000,
+            type=click.IntRange(min=1),
+            help='Number of accounts whose last written version is '
+                +'remembered with --split-accounts. Default: 100000'),
+        click.option('--serializer', default='orjson',
+            type=click.Choice(['orjson', 'json']),
+            help='JSON serializer for requests to ES. orjson is much faster '
+                +'than Python\'s json module. Default: orjson'),
+        click.option('--http-compress', is_flag=True,
+            help='Compress requests to ES with gzip. Saves bandwidth to a '
+                +'remote cluster at the cost of CPU time.'),
+        click.option('--archive-dir', type=click.Path(file_okay=False),
+            help='Also write the raw statuses to zstd compressed JSONL '
+                +'segments in this directory, per instance and hour, to '
+                +'index them later with `ingest`.'),
+        click.option('--archive-segment-size', default=64,
+            type=click.IntRange(min=1),
+            help='Uncompressed size in MiB after which a new archive '
+                +'segment is started. Default: 64'),
+        click.option('--sink', default='elastic',
+            type=click.Choice(['elastic', 'null', 'file', 'stdout']),
+            help='Where to send statuses: to ES, nowhere (to measure '
+                +'crawling on its own), or as JSON lines of bulk actions to '
+                +'--sink-file or stdout. With stdout, reports are printed to '
+                +'stderr. Default: elastic'),
+        click.option('--sink-file', type=click.Path(dir_okay=False),
+            help='File to append statuses to with --sink file.'),
+        click.option('--rollover', is_flag=True,
+            help='Save statuses to the alias of the indices that ES rolls '
+                +'over by size or age instead of to monthly indices. Run '
+                +'setup-indices with --rollover first.'),
+        click.option('--instance-checkpoints', default='elastic',
+            type=click.Choice(['elastic', 'sqlite', 'none']),
+            help='Where to remember the newest saved status of every '
+                +'instance, to resume crawling without searching all '
+                +'statuses in ES: in an ES index, in a local SQLite '
+                +'database, or nowhere. Default: elastic'),
+        click.option('--instance-checkpoints-db', default='checkpoints.db',
+            type=click.Path(dir_okay=False),
+            help='SQLite database for --instance-checkpoints sqlite. '
+                +'Default: checkpoints.db'),
+        click.option('--metrics-port', type=click.IntRange(1, 65535),
+            help='Serve metrics of crawling and saving in the Prometheus '
+                +'text format on this port at /metrics. Default: off'),
+        click.option('--metrics-addr', default='127.0.0.1',
+            help='Address to serve metrics on with --metrics-port, e. g. '
+                +'0.0.0.0 to let Prometheus scrape a pod. '
+                +'Default: 127.0.0.1'),
+        click.option('--profile', multiple=True,
+            type=click.Choice(['stages', 'cprofile', 'tracemalloc']),
+            envvar='MASTODON_SEARCH_PROFILE',
+            help='Time the stages of crawling and saving as metric, or '
+                +'write cProfile statistics or tracemalloc snapshots to '
+                +'--profile-dir periodically. Can be given multiple times, '
+                +'or as space-separated list in the environment variable '
+                +'MASTODON_SEARCH_PROFILE. Default: off'),
+        click.option('--profile-dir', default='profiles',
+            type=click.Path(file_okay=False),
+            envvar='MASTODON_SEARCH_PROFILE_DIR',
+            help='Directory for cProfile and tracemalloc snapshots. '
+                +'Default: profiles'),
+        click.option('--profile-interval', default=600,
+            type=click.FloatRange(min=1),
+            envvar='MASTODON_SEARCH_PROFILE_INTERVAL',
+            help='Seconds between two profiling snapshots. Default: 600'),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+def _save(
+    spool_dir, max_buffer_size, spill, flush_count, flush_size, flush_age,
+    bulk_size, bulk_min_size, bulk_max_size, bulk_target_latency,
+    bulk_workers, dedup_size, dedup_file, canonical, split_accounts,
+    account_cache_size, serializer, http_compress, archive_dir,
+    archive_segment_size, sink, sink_file, rollover, instance_checkpoints,
+    instance_checkpoints_db, metrics_port, metrics_addr, profile, profile_dir,
+    profile_interval, indexing=True
+):
+    """Return the _Save configured by the options of _save_options."""
+    from mastodon_search.crawl.accounts import _AccountCache
+    from mastodon_search.crawl.archive import _Archive
+    from mastodon_search.crawl.checkpoints import (
+        _ElasticCheckpoints, _SqliteCheckpoints
+    )
+    from mastodon_search.crawl.dedup import _DedupCache
+    from mastodon_search.crawl.metrics import start_server
+    from mastodon_search.crawl import profiling
+    from mastodon_search.crawl.save import (
+        _BatchSizer, _JsonLinesSink, _NullSink, _Save, SERIALIZERS
+    )
+    import sys
+    if (spill and not spool_dir):
+        raise click.UsageError('--spill requires --spool-dir.')
+    if (dedup_file and not dedup_size):
+        raise click.UsageError('--dedup-file requires --dedup-size > 0.')
+    if (rollover and canonical):
+        raise click.UsageError('--rollover cannot be used with --canonical.')
+    if (sink == 'file' and not sink_file):
+        raise click.UsageError('--sink file requires --sink-file.')
+    # Other sinks need no ES host.
+    indexing = indexing or sink != 'elastic'
+    if (not indexing and not archive_dir):
+        raise click.UsageError('--host is required unless statuses are '
+            +'archived with --archive-dir.')
+    if (dedup_file and not indexing):
+        # The dedup file is written when statuses were saved.
+        raise click.UsageError('--dedup-file requires --host or another '
+            +'--sink.')
+    # Without indexing, the archive knows the newest statuses.
+    checkpoints = None
+    if (
+        indexing and sink == 'elastic'
+        and instance_checkpoints == 'elastic'
+    ):
+        checkpoints = _ElasticCheckpoints()
+    elif (indexing and instance_checkpoints == 'sqlite'):
+        checkpoints = _SqliteCheckpoints(instance_checkpoints_db)
+    save_sink = None
+    if (sink == 'null'):
+        save_sink = _NullSink()
+    elif (sink == 'file'):
+        save_sink = _JsonLinesSink(open(sink_file, mode='a'))
+    elif (sink == 'stdout'):
+        # Reports are printed to stderr then, see: _Save.report_file
+        save_sink = _JsonLinesSink(sys.stdout)
+    if (metrics_port):
+        start_server(metrics_port, metrics_addr)
+    if (profile):
+        profiling.start(profile, profile_dir, profile_interval)
+    return _Save(
+        spool_dir,
+        max_bytes=max_buffer_size * 2**20 if max_buffer_size else None,
+        spill=spill,
+        flush_count=flush_count,
+        flush_bytes=flush_size * 2**20,
+        flush_age=flush_age,
+        batch_sizer=_BatchSizer(
+            size=bulk_size,
+            min_size=bulk_min_size,
+            max_size=bulk_max_size,
+            target_latency=bulk_target_latency
+        ),
+        bulk_workers=bulk_workers,
+        dedup=_DedupCache(dedup_size, file=dedup_file) if dedup_size
+            else None,
+        canonical=canonical,
+        accounts=_AccountCache(account_cache_size) if split_accounts
+            else None,
+        serializer=SERIALIZERS[serializer](),
+        http_compress=http_compress,
+        archive=_Archive(archive_dir, archive_segment_size * 2**20)
+            if archive_dir else None,
+        indexing=indexing,
+        checkpoints=checkpoints,
+        rollover=rollover,
+        sink=save_sink
+    )
+
 @main.command(
     help='Calculate correlation of some Mastodon instance statistics.',
     short_help='Calculate correlation of Mastodon stats.',
@@ -64,16 +288,338 @@ def obtain_instance_data(input_file, output_file):
         +'usually not publicly allowed.',
     short_help='Stream instance updates to Elasticsearch.'
 )
-@click.option('-H', '--host', required=True,
-    help='ES host, e. g.: https://example.com')
+@click.option('-H', '--host',
+    help='ES host, e. g.: https://example.com. Can be omitted to only '
+        +'archive statuses with --archive-dir, or with another --sink.')
 @click.option('-P', '--password', default='',
     help='ES password to your username')
 @click.option('-p', '--port', default=9200,
     help='Port on which ES listens. Default: 9200')
 @click.option('-u', '--username', default='',
     help='Username for ES authentication')
+@_save_options
 @click.argument('instance')
-def stream_to_es(instance, host, password, port, username):
+def stream_to_es(instance, host, password, port, username, **save_options):
     from mastodon_search.crawl import stream
-    streamer = stream.Streamer(instance)
+    streamer = stream.Streamer(
+        instance, _save(indexing=host is not None, **save_options))
     streamer.stream_updates_to_elastic(host, password, port, username)
+
+@main.command(
+    help='Read an instance list from INSTANCES_FILE (one instance per line, '
+        +'e. g.: data/instances.txt) and save new statuses of all instances '
+        +'to Elasticsearch (ES) from a single process. All instances share '
+        +'one ES connection and one save queue. Like `stream-to-es`, the '
+        +'streaming API is used where possible and crawling via GET requests '
+        +'otherwise. Polling of all instances that are not streamed runs in '
+        +'a single asyncio event loop. The state of every instance is '
+        +'printed periodically.',
+    short_help='Stream many instances\' updates to Elasticsearch.'
+)
+@click.option('-H', '--host',
+    help='ES host, e. g.: https://example.com. Can be omitted to only '
+        +'archive statuses with --archive-dir, or with another --sink.')
+@click.option('-P', '--password', default='',
+    help='ES password to your username')
+@click.option('-p', '--port', default=9200,
+    help='Port on which ES listens. Default: 9200')
+@click.option('-u', '--username', default='',
+    help='Username for ES authentication')
+@click.option('--max-connections', default=100, show_default=True,
+    help='Maximum number of simultaneously open connections for polling '
+        +'instances\' public timelines.')
+@click.option('--schedule', default='adaptive', show_default=True,
+    type=click.Choice(['adaptive', 'predictive']),
+    help='How to schedule polls. adaptive: adapt the wait time to the '
+        +'number of statuses in the last response. predictive: estimate '
+        +'each instance\'s posting rate and poll when a full page of '
+        +'statuses is expected.')
+@click.option('--activity-priors', type=click.File('r'),
+    help='Output of `obtain-instance-data` or `choose-instances` (CSV). '
+        +'Its mean weekly statuses are used as initial posting rates for '
+        +'the predictive schedule.')
+@click.option('--max-streams', default=100, show_default=True,
+    help='Maximum number of simultaneously open streaming connections. '
+        +'Further instances are crawled via GET requests.')
+@click.option('--start-interval', default=1.0, show_default=True,
+    help='Seconds to wait between starting two instances.')
+@click.option('--status-interval', default=600, show_default=True,
+    help='Seconds between two status reports.')
+@_save_options
+@click.argument('instances_file', type=click.File('r'))
+def crawl_many(
+    instances_file, host, password, port, username, max_connections,
+    schedule, activity_priors, max_streams, start_interval, status_interval,
+    **save_options
+):
+    from mastodon_search.crawl import many, schedule as sched
+    if (schedule == 'predictive'):
+        scheduler = sched.PredictivePollScheduler(
+            sched.load_priors(activity_priors) if activity_priors else None)
+    else:
+        scheduler = sched.PollScheduler()
+    crawler = many.MultiCrawler.from_file(
+        instances_file,
+        max_connections=max_connections,
+        scheduler=scheduler,
+        save=_save(indexing=host is not None, **save_options),
+        max_streams=max_streams,
+        start_interval=start_interval,
+        status_interval=status_interval
+    )
+    crawler.crawl_to_elastic(host, password, port, username)
+
+@main.command(
+    help='Crawl the statuses that INSTANCE received between SINCE and UNTIL '
+        +'(default: now) and save them to Elasticsearch (ES). The time '
+        +'window is split into ranges of status IDs that are fetched '
+        +'concurrently. Dates without timezone are UTC. With a checkpoint '
+        +'file, an interrupted backfill resumes where it stopped.',
+    short_help='Crawl past statuses of an instance.'
+)
+@click.option('-H', '--host',
+    help='ES host, e. g.: https://example.com. Can be omitted to only '
+        +'archive statuses with --archive-dir, or with another --sink.')
+@click.option('-P', '--password', default='',
+    help='ES password to your username')
+@click.option('-p', '--port', default=9200,
+    help='Port on which ES listens. Default: 9200')
+@click.option('-u', '--username', default='',
+    help='Username for ES authentication')
+@click.option('--since', type=click.DateTime(), required=True,
+    help='Start of the time window.')
+@click.option('--until', type=click.DateTime(),
+    help='End of the time window. Default: now, or the end of the window '
+        +'of --checkpoint-file when resuming')
+@click.option('--ranges', default=16, show_default=True,
+    help='Number of ID ranges to split the time window into.')
+@click.option('--workers', default=4, show_default=True,
+    help='Number of ranges fetched at the same time.')
+@click.option('--requests-per-second',
+    type=click.FloatRange(min=0, min_open=True),
+    help='Maximum number of requests per second to INSTANCE, shared by all '
+        +'workers. Default: as many as the rate limit of INSTANCE allows')
+@click.option('--checkpoint-file', type=click.Path(dir_okay=False),
+    help='JSON file to save progress to and resume from.')
+@_save_options
+@click.argument('instance')
+def backfill(
+    instance, host, password, port, username, since, until, ranges,
+    workers, requests_per_second, checkpoint_file, **save_options
+):
+    from mastodon_search.crawl import backfill
+    backfiller = backfill.Backfiller(
+        instance,
+        since,
+        until,
+        num_ranges=ranges,
+        max_workers=workers,
+        per_second=requests_per_second,
+        checkpoint_file=checkpoint_file,
+        save=_save(indexing=host is not None, **save_options)
+    )
+    backfiller.backfill_to_elastic(host, password, port, username)
+
+@main.command(
+    help='Save the statuses archived in ARCHIVE_DIR with --archive-dir to '
+        +'Elasticsearch (ES), e. g. to index them again after the mapping '
+        +'changed. Archive segments are spread across worker processes that '
+        +'convert statuses like the crawlers and send concurrent bulk '
+        +'requests. While ingesting, refreshes and replicas of the target '
+        +'indices are disabled. With a checkpoint file, an interrupted '
+        +'ingest resumes with the segments that were not saved yet.',
+    short_help='Save archived statuses to Elasticsearch.'
+)
+@click.option('-H', '--host', required=True,
+    help='ES host, e. g.: https://example.com')
+@click.option('-P', '--password', default='',
+    help='ES password to your username')
+@click.option('-p', '--port', default=9200,
+    help='Port on which ES listens. Default: 9200')
+@click.option('-u', '--username', default='',
+    help='Username for ES authentication')
+@click.option('--processes', default=4, type=click.IntRange(min=1),
+    help='Number of worker processes. Default: 4')
+@click.option('--checkpoint-file', type=click.Path(dir_okay=False),
+    help='JSON file to save progress to and resume from.')
+@click.option('--keep-index-settings', is_flag=True,
+    help='Do not disable refreshes and replicas of the target indices.')
+@click.option('--max-buffer-size', default=64, type=click.IntRange(min=1),
+    help='Maximum size in MiB of statuses queued per process. Default: 64')
+@click.option('--bulk-size', default=500, type=click.IntRange(min=1),
+    help='Initial number of statuses per bulk request. Default: 500')
+@click.option('--bulk-max-size', default=5000, type=click.IntRange(min=1),
+    help='Maximum number of statuses per bulk request. Default: 5000')
+@click.option('--bulk-workers', default=2, type=click.IntRange(min=1),
+    help='Maximum number of concurrent bulk requests per process. '
+        +'Default: 2')
+@click.option('--serializer', default='orjson',
+    type=click.Choice(['orjson', 'json']),
+    help='JSON serializer for requests to ES. Default: orjson')
+@click.option('--http-compress', is_flag=True,
+    help='Compress requests to ES with gzip.')
+@click.option('--canonical', is_flag=True,
+    help='Store statuses like crawling with --canonical.')
+@click.option('--split-accounts', is_flag=True,
+    help='Store accounts like crawling with --split-accounts.')
+@click.option('--rollover', is_flag=True,
+    help='Save statuses to the index that is rolled over, like crawling '
+        +'with --rollover.')
+@click.argument('archive_dir', type=click.Path(exists=True, file_okay=False))
+def ingest(
+    archive_dir, host, password, port, username, processes, checkpoint_file,
+    keep_index_settings, **options
+):
+    from mastodon_search.crawl import ingest
+    if (options['rollover'] and options['canonical']):
+        raise click.UsageError('--rollover cannot be used with --canonical.')
+    ingester = ingest.Ingester(
+        archive_dir,
+        processes=processes,
+        checkpoint_file=checkpoint_file,
+        pause_refresh=not keep_index_settings,
+        **options
+    )
+    ingester.ingest_to_elastic(host, password, port, username)
+
+@main.command(
+    help='Export the statuses crawled between SINCE and UNTIL from '
+        +'Elasticsearch (ES) to Parquet files in OUTPUT_DIR, for analysis '
+        +'without ES. The time window is read from a point in time in '
+        +'slices that are searched concurrently. Objects are flattened to '
+        +'columns of the statuses table, nested fields like tags, mentions '
+        +'and media attachments go to side tables. Without --since, only '
+        +'statuses crawled since the last export to OUTPUT_DIR are '
+        +'exported. Statuses saved to ES later than --lag after they were '
+        +'crawled, e. g. replayed from a spool, are not exported then; '
+        +'export their window again with --since. With --canonical, new '
+        +'sightings of exported statuses are not exported, since they do '
+        +'not change when the status was crawled. Dates without timezone '
+        +'are UTC.',
+    short_help='Export statuses to Parquet files.'
+)
+@click.option('-H', '--host', required=True,
+    help='ES host, e. g.: https://example.com')
+@click.option('-P', '--password', default='',
+    help='ES password to your username')
+@click.option('-p', '--port', default=9200,
+    help='Port on which ES listens. Default: 9200')
+@click.option('-u', '--username', default='',
+    help='Username for ES authentication')
+@click.option('--since', type=click.DateTime(),
+    help='Start of the time window. Default: end of the last export, or '
+        +'the first crawled status')
+@click.option('--until', type=click.DateTime(),
+    help='End of the time window. Default: --lag seconds ago')
+@click.option('--flush-age', default=1800, type=click.FloatRange(min=0),
+    help='The --flush-age of the crawlers, the longest time statuses stay '
+        +'queued before they are saved to ES. Default: 1800')
+@click.option('--lag', type=click.IntRange(min=0),
+    help='Seconds before now that the default time window ends, so that '
+        +'statuses still queued by crawlers are exported next time. Must '
+        +'not be shorter than --flush-age. Default: --flush-age plus 600')
+@click.option('--slices', default=4, type=click.IntRange(min=1),
+    help='Number of slices searched concurrently. Default: 4')
+@click.option('--page-size', default=1000, type=click.IntRange(min=1),
+    help='Number of statuses per search request. Default: 1000')
+@click.option('--canonical', is_flag=True,
+    help='Export the statuses stored with --canonical.')
+@click.argument('output_dir', type=click.Path(file_okay=False))
+def export(
+    output_dir, host, password, port, username, since, until, flush_age,
+    lag, slices, page_size, canonical
+):
+    from datetime import datetime, timedelta, UTC
+    from mastodon_search.export import parquet
+    if (lag is None):
+        lag = flush_age + 600
+    elif (lag < flush_age):
+        raise click.UsageError('--lag must not be shorter than --flush-age, '
+            +'or statuses still queued by crawlers are never exported.')
+    if (until is None):
+        until = datetime.now(tz=UTC) - timedelta(seconds=lag)
+    exporter = parquet.Exporter(
+        output_dir,
+        canonical=canonical,
+        slices=slices,
+        page_size=page_size
+    )
+    exporter.export_from_elastic(
+        host, password, port, username, since, until)
+
+@main.command(
+    help='Install the Elasticsearch (ES) index templates of the status '
+        +'indices, built from the Status mapping, with the given settings. '
+        +'They apply to indices created afterwards. With --rollover, an '
+        +'index lifecycle policy rolls the status index over by size or '
+        +'age, and crawlers started with --rollover save statuses to its '
+        +'alias instead of to monthly indices.',
+    short_help='Install index templates and lifecycle policy.'
+)
+@click.option('-H', '--host', required=True,
+    help='ES host, e. g.: https://example.com')
+@click.option('-P', '--password', default='',
+    help='ES password to your username')
+@click.option('-p', '--port', default=9200,
+    help='Port on which ES listens. Default: 9200')
+@click.option('-u', '--username', default='',
+    help='Username for ES authentication')
+@click.option('--shards', default=1, type=click.IntRange(min=1),
+    help='Number of primary shards per index. Default: 1')
+@click.option('--replicas', default=1, type=click.IntRange(min=0),
+    help='Number of replicas per shard. Default: 1')
+@click.option('--refresh-interval', default='30s',
+    help='How often new statuses become searchable, e. g. 1s or -1 to '
+        +'disable. Longer intervals speed up indexing. Default: 30s')
+@click.option('--best-compression/--default-compression', default=True,
+    help='Compress stored statuses with DEFLATE instead of LZ4, which saves '
+        +'disk space at the cost of slower retrieval. Default: '
+        +'--best-compression')
+@click.option('--require-node-attribute', multiple=True,
+    metavar='ATTRIBUTE=VALUE',
+    help='Only allocate shards to nodes with this attribute, e. g. '
+        +'data=hot. Can be given multiple times.')
+@click.option('--canonical', is_flag=True,
+    help='Also install the template of the indices of --canonical.')
+@click.option('--split-accounts', is_flag=True,
+    help='Also install the template of the index of --split-accounts.')
+@click.option('--rollover', is_flag=True,
+    help='Roll the status index over by size or age instead of using '
+        +'monthly indices.')
+@click.option('--rollover-max-size', default='50gb',
+    help='Primary shard size at which the index is rolled over. '
+        +'Default: 50gb')
+@click.option('--rollover-max-age', default='30d',
+    help='Age at which the index is rolled over. Default: 30d')
+def setup_indices(
+    host, password, port, username, shards, replicas, refresh_interval,
+    best_compression, require_node_attribute, canonical, split_accounts,
+    rollover, rollover_max_size, rollover_max_age
+):
+    from elasticsearch import Elasticsearch
+    from mastodon_search.elastic_dsl import indices
+    require = {}
+    for attribute in require_node_attribute:
+        key, sep, value = attribute.partition('=')
+        if (not sep):
+            raise click.BadParameter(
+                f'{attribute} is not of the form ATTRIBUTE=VALUE.',
+                param_hint='--require-node-attribute')
+        require[key] = value
+    client = Elasticsearch(
+        host + ':' + str(port), basic_auth=(username, password), timeout=60)
+    indices.setup_indices(
+        client,
+        indices.index_settings(
+            shards=shards,
+            replicas=replicas,
+            refresh_interval=refresh_interval,
+            best_compression=best_compression,
+            require=require
+        ),
+        canonical=canonical,
+        accounts=split_accounts,
+        rollover=rollover,
+        max_size=rollover_max_size,
+        max_age=rollover_max_age
+    )
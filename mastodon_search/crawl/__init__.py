@@ -1 +1,5 @@
-__all__ = ['save', 'stream']
+__all__ = [
+    'accounts', 'archive', 'backfill', 'dedup', 'examples', 'ingest', 'many',
+    'metrics', 'poll', 'profiling', 'ratelimit', 'save', 'schedule',
+    'snowflake', 'spool', 'stream', 'transform'
+]
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+from threading import Lock
+from uuid import UUID
+
+
+class _AccountCache:
+    """Remember the content hash of recently written account snapshots, so
+    an account is written again only when it changed. The least recently
+    seen accounts are forgotten and written again when seen next.
+    """
+    def __init__(self, size: int = 100_000) -> None:
+        """Arguments:
+        size -- number of accounts to remember
+        """
+        self.hashes: OrderedDict[UUID, str] = OrderedDict()
+        self.lock = Lock()
+        self.size = size
+        self.unchanged = 0
+        self.updates = 0
+
+    def update(self, account_id: UUID, content_hash: str) -> bool:
+        """Remember the hash of an account. Return whether it changed, i. e.
+        whether the snapshot has to be written.
+        """
+        with self.lock:
+            self.updates += 1
+            if (self.hashes.get(account_id) == content_hash):
+                self.hashes.move_to_end(account_id)
+                self.unchanged += 1
+                return False
+            self.hashes[account_id] = content_hash
+            self.hashes.move_to_end(account_id)
+            if (len(self.hashes) > self.size):
+                self.hashes.popitem(last=False)
+            return True
+
+    def unchanged_rate(self) -> float:
+        return self.unchanged / self.updates if self.updates else 0
@@ -0,0 +1,306 @@
+"""Archive raw statuses as zstd compressed JSON lines, so they can be
+indexed later or again without crawling them again. See: _Archive
+"""
+
+from collections import OrderedDict
+from collections.abc import Iterator
+from datetime import datetime, UTC
+from io import BufferedWriter
+from json import dumps, loads
+from os import makedirs, path, remove, rename, scandir
+from sys import stderr
+from threading import Lock
+from time import monotonic
+from urllib.parse import quote
+
+import orjson
+from zstandard import (
+    FLUSH_BLOCK, FLUSH_FRAME, ZstdCompressor, ZstdDecompressor, ZstdError
+)
+
+from mastodon_search.crawl.snowflake import id_key
+
+# Magic number of the zstd skippable frame that holds a segment's footer.
+# Decompressors skip it, so segments are also readable with `zstd -d`.
+FOOTER_MAGIC = 0x184D2A5A
+FOOTER_VERSION = 1
+PART_SUFFIX = '.part'
+SUFFIX = '.jsonl.zst'
+
+
+def read_footer(file: str) -> dict | None:
+    """Return the footer of a finished segment, or None if it has none."""
+    with open(file, mode='rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        if (size < 12):
+            return None
+        f.seek(size - 4)
+        length = int.from_bytes(f.read(4), 'little')
+        if (length + 12 > size):
+            return None
+        f.seek(size - length - 12)
+        header = f.read(8)
+        if (
+            int.from_bytes(header[:4], 'little') != FOOTER_MAGIC
+            or int.from_bytes(header[4:], 'little') != length + 4
+        ):
+            return None
+        return loads(f.read(length))
+
+
+def read_segment(file: str) -> Iterator[bytes]:
+    """Yield the records of a segment as lines of JSON. A segment that was
+    not finished is read up to its last complete record.
+    """
+    with open(file, mode='rb') as f:
+        reader = ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        rest = b''
+        while True:
+            try:
+                chunk = reader.read(2**20)
+            except ZstdError:
+                # Truncated by a crash.
+                return
+            if (not chunk):
+                return
+            *lines, rest = (rest + chunk).split(b'\n')
+            yield from (line + b'\n' for line in lines)
+
+
+def segments(directory: str) -> list[str]:
+    """Return the finished segments of an archive, ordered by instance and
+    time.
+    """
+    files = []
+    for instance in scandir(directory):
+        if (instance.is_dir()):
+            files.extend(
+                entry.path for entry in scandir(instance.path)
+                if entry.name.endswith(SUFFIX)
+            )
+    return sorted(files)
+
+
+class _Segment:
+    """An open segment file of one instance and hour."""
+    def __init__(
+        self, file: str, instance: str, hour: str, level: int
+    ) -> None:
+        self.bytes = 0
+        self.file = file
+        self.first_crawled_at = None
+        self.hour = hour
+        self.instance = instance
+        self.last_crawled_at = None
+        self.max_id = None
+        self.min_id = None
+        self.raw = open(file + PART_SUFFIX, mode='wb')
+        self.records = 0
+        self.writer = ZstdCompressor(level=level).stream_writer(
+            self.raw, closefd=False)
+
+    def close(self) -> None:
+        """End the compressed data, append the footer and make the segment
+        visible to readers.
+        """
+        self.writer.flush(FLUSH_FRAME)
+        self._write_footer(self.raw)
+        self.raw.close()
+        rename(self.file + PART_SUFFIX, self.file)
+
+    def footer(self) -> dict:
+        return {
+            'version': FOOTER_VERSION,
+            'instance': self.instance,
+            'hour': self.hour,
+            'records': self.records,
+            'bytes': self.bytes,
+            'first_crawled_at': self.first_crawled_at,
+            'last_crawled_at': self.last_crawled_at,
+            'min_id': self.min_id,
+            'max_id': self.max_id,
+        }
+
+    def write(self, line: bytes, status_id: str, crawled_at: str) -> None:
+        self.writer.write(line)
+        self.bytes += len(line)
+        self.records += 1
+        self.first_crawled_at = self.first_crawled_at or crawled_at
+        self.last_crawled_at = crawled_at
+        key = id_key(status_id)
+        if (self.min_id is None or key < id_key(self.min_id)):
+            self.min_id = status_id
+        if (self.max_id is None or key > id_key(self.max_id)):
+            self.max_id = status_id
+
+    def _write_footer(self, f: BufferedWriter) -> None:
+        data = dumps(self.footer()).encode()
+        data += len(data).to_bytes(4, 'little')
+        f.write(FOOTER_MAGIC.to_bytes(4, 'little'))
+        f.write(len(data).to_bytes(4, 'little'))
+        f.write(data)
+
+
+class _Archive:
+    """Write raw statuses to zstd compressed segments of JSON lines. Every
+    instance and hour of crawling gets its own segments, which are rotated by
+    size: <directory>/<instance>/<YYYY-MM-DDTHH>_<number>.jsonl.zst
+    Every line holds the status as received from the instance, and when and
+    how it was crawled. A footer at the end of a segment describes its
+    records, see: read_footer. Segments being written end with '.part' and
+    are finished when a process crashed, on the next start.
+    """
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = 64 * 2**20,
+        level: int = 3,
+        max_open: int = 256,
+        flush_interval: float = 60,
+    ) -> None:
+        """Arguments:
+        directory -- where to store the segments
+        segment_size -- uncompressed bytes after which a new segment is
+            started
+        level -- zstd compression level
+        max_open -- maximum number of open segments. When reached, the
+            least recently written one is finished.
+        flush_interval -- seconds after which compressed data is handed to
+            the OS, so it survives if the process dies
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flushed_at = monotonic()
+        self.level = level
+        self.lock = Lock()
+        self.max_open = max_open
+        self.open: OrderedDict[str, _Segment] = OrderedDict()
+        self.records = 0
+        self.segment_size = segment_size
+        makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _next_file(self, instance_dir: str, hour: str) -> str:
+        numbers = [
+            int(entry.name[len(hour) + 1:].split('.')[0])
+            for entry in scandir(instance_dir)
+            if entry.name.startswith(hour + '_')
+        ]
+        number = max(numbers, default=-1) + 1
+        return path.join(instance_dir, f'{hour}_{number:04d}{SUFFIX}')
+
+    def _open(self, instance: str, hour: str) -> _Segment:
+        instance_dir = path.join(self.directory, quote(instance, safe=''))
+        makedirs(instance_dir, exist_ok=True)
+        segment = _Segment(
+            self._next_file(instance_dir, hour), instance, hour, self.level)
+        self.open[instance] = segment
+        if (len(self.open) > self.max_open):
+            self.open.popitem(last=False)[1].close()
+        return segment
+
+    def _recover(self) -> None:
+        """Finish the segments of a crashed process with their complete
+        records.
+        """
+        for instance in scandir(self.directory):
+            if (not instance.is_dir()):
+                continue
+            for entry in scandir(instance.path):
+                if (not entry.name.endswith(PART_SUFFIX)):
+                    continue
+                file = entry.path.removesuffix(PART_SUFFIX)
+                lines = list(read_segment(entry.path))
+                remove(entry.path)
+                if (not lines):
+                    continue
+                first = loads(lines[0])
+                segment = _Segment(
+                    file, first['instance'],
+                    path.basename(file).split('_')[0], self.level)
+                for line in lines:
+                    record = loads(line)
+                    segment.write(
+                        line, str(record['status'].get('id')),
+                        record['crawled_at'])
+                segment.close()
+                print(f'Recovered {len(lines)} archived statuses of '
+                    +f'{first["instance"]}.', file=stderr, flush=True)
+
+    def close(self) -> None:
+        """Finish all open segments."""
+        with self.lock:
+            while (self.open):
+                self.open.popitem()[1].close()
+
+    def flush(self) -> None:
+        """Hand the compressed data of all open segments to the OS and
+        finish the segments of past hours.
+        """
+        hour = datetime.now(tz=UTC).strftime('%Y-%m-%dT%H')
+        with self.lock:
+            for instance, segment in list(self.open.items()):
+                if (segment.hour < hour):
+                    del self.open[instance]
+                    segment.close()
+                else:
+                    segment.writer.flush(FLUSH_BLOCK)
+                    segment.raw.flush()
+            self.flushed_at = monotonic()
+
+    def get_last_id(self, instance: str) -> str | None:
+        """Return the newest ID of the archived statuses of an instance,
+        or None if there is none.
+        """
+        instance_dir = path.join(self.directory, quote(instance, safe=''))
+        try:
+            files = sorted(
+                entry.path for entry in scandir(instance_dir)
+                if entry.name.endswith(SUFFIX))
+        except FileNotFoundError:
+            return None
+        for file in reversed(files):
+            if ((footer := read_footer(file)) and footer['max_id']):
+                return footer['max_id']
+        return None
+
+    def write(
+        self, status: dict, crawled_from_instance: str, api_method: str,
+        crawled_at: datetime
+    ) -> None:
+        """Archive a status.
+
+        Arguments:
+        see _Save.write_status
+        crawled_at -- when the status was crawled
+        """
+        line = orjson.dumps(
+            {
+                'instance': crawled_from_instance,
+                'api_method': api_method,
+                'crawled_at': crawled_at,
+                'status': status,
+            },
+            default=str,
+            option=orjson.OPT_APPEND_NEWLINE
+        )
+        hour = crawled_at.strftime('%Y-%m-%dT%H')
+        with self.lock:
+            segment = self.open.get(crawled_from_instance)
+            if (
+                segment is not None
+                and (segment.hour != hour
+                    or segment.bytes >= self.segment_size)
+            ):
+                del self.open[crawled_from_instance]
+                segment.close()
+                segment = None
+            if (segment is None):
+                segment = self._open(crawled_from_instance, hour)
+            self.open.move_to_end(crawled_from_instance)
+            segment.write(
+                line, str(status.get('id')), crawled_at.isoformat())
+            self.records += 1
+        if (monotonic() - self.flushed_at >= self.flush_interval):
+            self.flush()
@@ -0,0 +1,234 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from datetime import datetime, UTC
+from json import dump, load
+from os import replace
+from sys import stderr
+from threading import Event, Lock, Thread
+
+from mastodon_search.crawl.crawl import Crawler
+from mastodon_search.crawl.poll import base_url, parse_statuses
+from mastodon_search.crawl.profiling import stage
+from mastodon_search.crawl.ratelimit import LIMITERS
+from mastodon_search.crawl.save import _Save
+from mastodon_search.crawl.snowflake import datetime_to_id
+
+
+class _IdRange:
+    """A range of status IDs to backfill and the progress within it."""
+    def __init__(
+        self, min_id: str, max_id: str, cursor: str | None = None,
+        done: bool = False, statuses: int = 0
+    ) -> None:
+        """Arguments:
+        min_id -- exclusive lower bound of the range
+        max_id -- exclusive upper bound of the range
+        cursor -- ID of the newest status already fetched in this range
+        done -- whether all statuses of this range were fetched
+        statuses -- number of statuses fetched in this range
+        """
+        self.cursor = cursor
+        self.done = done
+        self.max_id = max_id
+        self.min_id = min_id
+        self.statuses = statuses
+
+    def to_dict(self) -> dict:
+        return {
+            'min_id': self.min_id,
+            'max_id': self.max_id,
+            'cursor': self.cursor,
+            'done': self.done,
+            'statuses': self.statuses,
+        }
+
+
+class Backfiller:
+    """Crawl the statuses an instance received in a past time window. The
+    window is split into ranges of snowflake IDs that are fetched
+    concurrently, and progress is checkpointed per range.
+    """
+    API_METHOD = 'api/v1/timelines/public'
+    # Maximum number of statuses the API returns per request.
+    LIMIT = 40
+
+    def __init__(
+        self,
+        instance: str,
+        since: datetime,
+        until: datetime | None = None,
+        num_ranges: int = 16,
+        max_workers: int = 4,
+        per_second: float | None = None,
+        checkpoint_file: str | None = None,
+        checkpoint_interval: int = 60,
+        save: _Save | None = None,
+    ) -> None:
+        """Arguments:
+        instance -- an instance's base URI, e. g.: 'mastodon.social'
+        since -- start of the time window
+        until -- end of the time window. Default: the end of the window of
+            the checkpoint file when resuming, otherwise now
+        num_ranges -- number of ID ranges to split the window into
+        max_workers -- number of ranges fetched at the same time
+        per_second -- maximum number of requests per second to the instance,
+            shared by all workers. Default: as many as its rate limit allows
+        checkpoint_file -- JSON file to save progress to and resume from
+        checkpoint_interval -- seconds between two checkpoints
+        save -- the _Save to write statuses to. Default: a new one
+        """
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        # Set when backfilling ends, which stops the workers and the
+        # checkpoint timer.
+        self.finished = Event()
+        self.instance = instance
+        self.lock = Lock()
+        self.max_workers = max_workers
+        self.save = save if save is not None else _Save()
+        self.since = since if since.tzinfo else since.replace(tzinfo=UTC)
+        self.until = until if until is None or until.tzinfo \
+            else until.replace(tzinfo=UTC)
+        # All workers share the rate limit of the instance.
+        bucket = LIMITERS[self.instance]
+        if (per_second is not None):
+            bucket.max_per_second = per_second
+        self.session = Crawler._session(bucket)
+        ranges = self._load_checkpoint()
+        if (self.until is None):
+            self.until = datetime.now(tz=UTC)
+        self.ranges = ranges or self._partition(num_ranges)
+
+    def _checkpoint_data(self) -> dict:
+        return {
+            'instance': self.instance,
+            'since': self.since.isoformat(),
+            'until': self.until.isoformat(),
+            'ranges': [r.to_dict() for r in self.ranges],
+        }
+
+    def _checkpoint_timer(self) -> None:
+        """Checkpoint periodically. Run as thread."""
+        while (not self.finished.wait(self.checkpoint_interval)):
+            try:
+                self._checkpoint()
+            except Exception as e:
+                # Try again with the next checkpoint.
+                print('Checkpointing failed:', e, file=stderr, flush=True)
+
+    def _checkpoint(self) -> None:
+        """Save statuses to Elasticsearch, then write the progress of all
+        ranges from before saving to the checkpoint file.
+        """
+        with self.lock:
+            data = self._checkpoint_data()
+        self.save.save_queued()
+        fetched = sum(r['statuses'] for r in data['ranges'])
+        done = sum(r['done'] for r in data['ranges'])
+        print(
+            f'{fetched} statuses fetched, {done}/{len(data["ranges"])} '
+            +'ranges done.', file=self.save.report_file, flush=True
+        )
+        if (not self.checkpoint_file):
+            return
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, mode='w') as f:
+            dump(data, f, indent=1)
+        replace(tmp_file, self.checkpoint_file)
+
+    def _fetch_range(self, id_range: _IdRange) -> None:
+        """Fetch all statuses of an ID range, oldest page first."""
+        url = f'{base_url(self.instance)}/{self.API_METHOD}'
+        while (not id_range.done and not self.finished.is_set()):
+            response = self.session.get(url, params={
+                'limit': self.LIMIT,
+                'min_id': id_range.cursor or id_range.min_id,
+                'max_id': id_range.max_id,
+            }, timeout=30)
+            response.raise_for_status()
+            with stage('parse'):
+                statuses = parse_statuses(response.text)
+            for status in statuses:
+                self.save.write_status(status, self.instance, self.API_METHOD)
+            with self.lock:
+                if (statuses):
+                    id_range.cursor = str(statuses[0].get('id'))
+                    id_range.statuses += len(statuses)
+                if (len(statuses) < self.LIMIT):
+                    id_range.done = True
+
+    def _load_checkpoint(self) -> list[_IdRange] | None:
+        """Return the ranges of the checkpoint file if it belongs to the same
+        instance and time window. Without self.until, adopt the end of the
+        checkpoint's window.
+        """
+        if (not self.checkpoint_file):
+            return None
+        try:
+            with open(self.checkpoint_file) as f:
+                data = load(f)
+        except FileNotFoundError:
+            return None
+        if (data['instance'] != self.instance
+            or datetime.fromisoformat(data['since']) != self.since
+            or (
+                self.until is not None
+                and datetime.fromisoformat(data['until']) != self.until
+            )
+        ):
+            print('Checkpoint file belongs to another backfill, ignoring it.',
+                file=stderr, flush=True)
+            return None
+        self.until = datetime.fromisoformat(data['until'])
+        ranges = [_IdRange(**r) for r in data['ranges']]
+        print(f'Resuming from checkpoint, {sum(r.done for r in ranges)}/'
+            +f'{len(ranges)} ranges done.', file=self.save.report_file,
+            flush=True)
+        return ranges
+
+    def _partition(self, num_ranges: int) -> list[_IdRange]:
+        """Split the time window into `num_ranges` ranges of equal duration
+        and convert them to snowflake ID ranges.
+        """
+        step = (self.until - self.since) / num_ranges
+        bounds = [
+            datetime_to_id(self.since + i * step)
+            for i in range(num_ranges + 1)
+        ]
+        # min_id is exclusive, so start each range right before its bound.
+        return [
+            _IdRange(str(int(lower) - 1), upper)
+            for lower, upper in zip(bounds, bounds[1:])
+        ]
+
+    def backfill_to_elastic(
+        self,
+        host: str,
+        password: str,
+        port: int,
+        username: str,
+    ) -> None:
+        """Fetch all ranges that are not done yet and save their statuses to
+        Elasticsearch.
+
+        Arguments:
+        see mastodon_search.cli: backfill
+        """
+        self.save.init_elastic_connection(host, password, port, username)
+        todo = [r for r in self.ranges if not r.done]
+        print(f'Backfilling {self.instance} from {self.since.isoformat()} '
+            +f'to {self.until.isoformat()} in {len(todo)} ranges.',
+            file=self.save.report_file, flush=True)
+        Thread(target=self._checkpoint_timer, daemon=True).start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(self._fetch_range, r) for r in todo]
+                for future in as_completed(futures):
+                    if (e := future.exception()):
+                        # Stop the other ranges, but keep their progress.
+                        self.finished.set()
+                        executor.shutdown(cancel_futures=True)
+                        raise e
+        finally:
+            self.finished.set()
+            self._checkpoint()
@@ -0,0 +1,172 @@
+"""Remember the newest saved status of every instance, so crawlers resume
+without searching all statuses. See: _Checkpoints
+"""
+
+from abc import ABC, abstractmethod
+from datetime import date, datetime, UTC
+from elasticsearch import NotFoundError
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl import connections
+import sqlite3
+from threading import Lock
+
+from mastodon_search.crawl.snowflake import id_key
+from mastodon_search.globals import ACCOUNT_INDEX, CHECKPOINT_INDEX
+
+
+def action_checkpoint(action: dict) -> tuple[str, str, str | None] | None:
+    """Return the instance, ID and creation time of the status a bulk action
+    saves, or None if it saves no status or one without them, e. g. of an
+    account that opted out of indexing.
+    """
+    if (action['_index'] == ACCOUNT_INDEX):
+        return None
+    if (action.get('_op_type') == 'update'):
+        sighting = action['script']['params']['sighting']
+        instance, status_id = sighting['instance'], sighting['id']
+        created_at = action['upsert'].get('created_at')
+    else:
+        source = action['_source']
+        instance = source.get('crawled_from_instance')
+        status_id = source.get('id')
+        if (instance is None or status_id is None):
+            return None
+        created_at = source.get('created_at')
+    if (isinstance(created_at, date)):
+        created_at = created_at.isoformat()
+    return instance, status_id, created_at
+
+
+class _Checkpoints(ABC):
+    """The ID and creation time of the newest saved status of every
+    instance. Saved statuses are added with add, and written to the backend
+    with save. Subclasses implement a backend with _load and _write.
+    """
+    def __init__(self) -> None:
+        # [last_id, created_at] by instance, or None if it has none
+        self.checkpoints: dict[str, list[str | None] | None] = {}
+        self.changed: set[str] = set()
+        self.lock = Lock()
+
+    @abstractmethod
+    def _load(self, instance: str) -> list[str | None] | None:
+        """Return the checkpoint of an instance from the backend, or None if
+        there is none.
+        """
+
+    @abstractmethod
+    def _write(self, checkpoints: dict[str, list[str | None]]) -> None:
+        """Write checkpoints by instance to the backend."""
+
+    def add(self, actions: list[dict]) -> None:
+        """Advance the checkpoints by the statuses of saved bulk actions.
+        Checkpoints never move back, e. g. for backfilled statuses.
+        """
+        with self.lock:
+            for action in actions:
+                if ((checkpoint := action_checkpoint(action)) is None):
+                    continue
+                instance, status_id, created_at = checkpoint
+                if (instance not in self.checkpoints):
+                    self.checkpoints[instance] = self._load(instance)
+                last = self.checkpoints[instance]
+                if (
+                    last is not None
+                    and id_key(status_id) <= id_key(last[0])
+                ):
+                    continue
+                self.checkpoints[instance] = [status_id, created_at]
+                self.changed.add(instance)
+
+    def get_last_id(self, instance: str) -> str | None:
+        """Return the newest saved ID of an instance, or None if there is no
+        checkpoint of it.
+        """
+        with self.lock:
+            if (instance not in self.checkpoints):
+                self.checkpoints[instance] = self._load(instance)
+            checkpoint = self.checkpoints[instance]
+        return checkpoint[0] if checkpoint else None
+
+    def save(self) -> None:
+        """Write the checkpoints that changed since the last save."""
+        with self.lock:
+            changed = {
+                instance: self.checkpoints[instance]
+                for instance in self.changed
+            }
+            self.changed.clear()
+        if (not changed):
+            return
+        try:
+            self._write(changed)
+        except Exception:
+            with self.lock:
+                self.changed.update(changed)
+            raise
+
+
+class _ElasticCheckpoints(_Checkpoints):
+    """Checkpoints as documents of an Elasticsearch index, one per
+    instance. Uses the default connection, see: _Save.init_elastic_connection
+    """
+    def __init__(self, index: str = CHECKPOINT_INDEX) -> None:
+        super().__init__()
+        self.index = index
+
+    def _load(self, instance: str) -> list[str | None] | None:
+        try:
+            source = connections.get_connection().get(
+                index=self.index, id=instance)['_source']
+        except NotFoundError:
+            return None
+        return [source['last_id'], source.get('created_at')]
+
+    def _write(self, checkpoints: dict[str, list[str | None]]) -> None:
+        updated_at = datetime.now(tz=UTC).isoformat()
+        bulk(connections.get_connection(), (
+            {
+                '_id': instance,
+                '_index': self.index,
+                '_source': {
+                    'instance': instance,
+                    'last_id': last_id,
+                    'created_at': created_at,
+                    'updated_at': updated_at,
+                },
+            }
+            for instance, (last_id, created_at) in checkpoints.items()
+        ))
+
+
+class _SqliteCheckpoints(_Checkpoints):
+    """Checkpoints in a local SQLite database."""
+    def __init__(self, file: str) -> None:
+        super().__init__()
+        # Used by crawler threads and the thread saving statuses, always
+        # with self.lock held.
+        self.db = sqlite3.connect(file, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoints ('
+                +'instance TEXT PRIMARY KEY, last_id TEXT NOT NULL, '
+                +'created_at TEXT, updated_at TEXT NOT NULL)')
+
+    def _load(self, instance: str) -> list[str | None] | None:
+        row = self.db.execute(
+            'SELECT last_id, created_at FROM checkpoints WHERE instance = ?',
+            (instance,)
+        ).fetchone()
+        return list(row) if row else None
+
+    def _write(self, checkpoints: dict[str, list[str | None]]) -> None:
+        updated_at = datetime.now(tz=UTC).isoformat()
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)',
+                [
+                    (instance, last_id, created_at, updated_at)
+                    for instance, (last_id, created_at)
+                    in checkpoints.items()
+                ]
+            )
@@ -1,31 +1,67 @@
 from mastodon import Mastodon
-from requests import Session
-from requests_ratelimiter import LimiterAdapter
-from threading import Thread
+from requests import Response, Session
 from time import sleep
+from urllib.parse import urlsplit
 from urllib3 import Retry
 
+from mastodon_search.crawl.metrics import (
+    HTTP_RETRIES, RATE_LIMIT_WAITS, REPORTER
+)
+from mastodon_search.crawl.profiling import stage
+from mastodon_search.crawl.ratelimit import (
+    _LimiterAdapter, _TokenBucket, LIMITERS
+)
 from mastodon_search.crawl.save import _Save
 from mastodon_search.globals import USER_AGENT
 
 
+def adapt_wait_time(
+    wait_time: float, num_statuses: int, max_wait: float
+) -> float:
+    """Return the wait time in seconds until the next timeline request,
+    adjusted to the activity seen in the last response.
+
+    Arguments:
+    wait_time -- the current wait time in seconds
+    num_statuses -- number of statuses in the last response (max. 40)
+    max_wait -- maximum wait time in seconds between two requests
+    """
+    if (num_statuses == 40):
+        if (wait_time > 1):
+            wait_time *= 0.9
+    # Go up quick on small instances
+    elif (num_statuses == 0):
+        wait_time *= 2
+    elif (num_statuses <= 3):
+        wait_time *= 1.5
+    elif (num_statuses <= 10):
+        wait_time *= 1.1
+    # Never go above a set maximum
+    return min(wait_time, max_wait)
+
+
 class Crawler:
     """Leverage Mastodon.py to retrieve data from a Mastodon instance via API
     GET requests.
     """
-    def __init__(self, instance: str, save: _Save) -> None:
+    def __init__(
+        self, instance: str, save: _Save, quiet: bool = False
+    ) -> None:
         """Arguments:
         instance -- an instance's base URI, e. g.: 'pawoo.net'.
         save -- an instance of this module's _Save class
+        quiet -- do not print progress to stdout, e. g. when many instances
+            are crawled in one process
         """
         self.instance = instance
         self.is_running = False
         self.last_seen_created_at = None
+        self.quiet = quiet
         self.mastodon = Mastodon(
-            api_base_url=self.instance, session=self._session()
+            api_base_url=self.instance,
+            session=self._session(LIMITERS[self.instance])
         )
         self.save = save
-        self.timer = Thread(target=self._print_timer, daemon=True)
 
     def _crawl_updates(
         self, initial_wait: int = 60, max_wait: int = 3600,
@@ -45,42 +81,40 @@ class Crawler:
         """
         wait_time = initial_wait
         self.is_running = True
-        if (not self.timer.is_alive()):
-            self.timer = Thread(target=self._print_timer, daemon=True)
-            self.timer.start()
-        print('Last crawled status created at:', flush=True)
+        if (not self.quiet):
+            REPORTER.add(self)
+            print('Last crawled status created at:',
+                file=self.save.report_file, flush=True)
         statuses = None
         while True:
-            statuses = self.mastodon.timeline(
-                timeline='public', limit=40, min_id=min_id)
+            with stage('fetch'):
+                statuses = self.mastodon.timeline(
+                    timeline='public', limit=40, min_id=min_id)
             if (statuses):
                 for status in statuses:
                     self.save.write_status(status, self.instance,
                         'api/v1/timelines/public')
                 min_id = statuses[0].get('id')
                 self.last_seen_created_at = statuses[0].get('created_at')
-            # Adjust wait time between requests to actual activity
-            if (len(statuses) == 40):
-                if(wait_time > 1):
-                    wait_time *= 0.9
-            elif (return_on_up_to_date):
-                self.is_running = False
-                return min_id
-            # Never go above a set maximum
-            elif (wait_time >= max_wait):
-                wait_time = max_wait
-            # Go up quick on small instances
-            elif (len(statuses) == 0):
-                wait_time *= 2
-            elif (len(statuses) <= 3):
-                wait_time *= 1.5
-            elif (len(statuses) <= 10):
-                wait_time *= 1.1
+            if (return_on_up_to_date):
+                if (len(statuses) < 40):
+                    self.is_running = False
+                    return min_id
+                # Catch up without waiting, the session limits the rate.
+                continue
+            wait_time = adapt_wait_time(wait_time, len(statuses), max_wait)
             sleep(wait_time)
 
-    def _session(self) -> Session:
-        """Return a session from the requests module."""
-        retries = Retry(
+    @staticmethod
+    def _session(bucket: _TokenBucket | None = None) -> Session:
+        """Return a session from the requests module.
+
+        Arguments:
+        bucket -- the token bucket limiting the requests to the instance.
+            Default: a new one, allowing one request per second until the
+            instance reports its rate limit
+        """
+        retries = _CountingRetry(
             total=28,
             connect=14,
             read=14,
@@ -96,30 +130,38 @@ class Crawler:
             ],
             respect_retry_after_header=True
         )
-        adapter = LimiterAdapter(
-            burst=1,
-            max_retries=retries,
-            per_second=1
+        adapter = _LimiterAdapter(
+            bucket if bucket is not None else _TokenBucket(),
+            max_retries=retries
         )
         session = Session()
         session.headers['User-Agent'] = USER_AGENT
+        session.hooks['response'].append(_count_rate_limit)
         session.mount('http://', adapter)
         session.mount('https://', adapter)
         return session
 
-    def _print_timer(self) -> None:
-        """Print `created_at` value of the last crawled status periodically.
-        Run as thread to not block anything else.
-        """
-        sleep(60)
-        while True:
-            if (not self.is_running):
-                return
-            if (self.last_seen_created_at):
-                print(
-                    self.last_seen_created_at.isoformat(timespec='seconds'),
-                    flush=True
-                )
-            else:
-                print('None', flush=True)
-            sleep(600)
+
+class _CountingRetry(Retry):
+    """Retry that counts the retried requests by host. urllib3 retries
+    responses with HTTP status 429 that have a Retry-After header, which are
+    counted as rate limit waits, see: metrics
+    """
+    def increment(self, *args, **kwargs) -> Retry:
+        retry = super().increment(*args, **kwargs)
+        pool = kwargs.get('_pool')
+        host = pool.host if pool is not None else ''
+        response = kwargs.get('response')
+        if (response is not None and response.status == 429):
+            RATE_LIMIT_WAITS.labels(host).inc()
+        else:
+            HTTP_RETRIES.labels(host).inc()
+        return retry
+
+
+def _count_rate_limit(response: Response, *args, **kwargs) -> None:
+    """Count responses with HTTP status 429, after which Mastodon.py waits
+    until the rate limit resets. Use as response hook of a session.
+    """
+    if (response.status_code == 429):
+        RATE_LIMIT_WAITS.labels(urlsplit(response.url).hostname).inc()
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from datetime import datetime
+from hashlib import blake2b
+from json import dumps, loads
+from math import ceil, log
+from os import replace
+from sys import stderr
+from threading import Lock
+from time import monotonic
+
+from mastodon_search.crawl.transform import status_id
+
+
+def status_key(status: dict, crawled_from_instance: str) -> bytes:
+    """Return a key that differs for every status and every edit of it."""
+    edited_at = status.get('edited_at')
+    if (isinstance(edited_at, datetime)):
+        edited_at = edited_at.isoformat()
+    return blake2b(
+        status_id(status, crawled_from_instance).bytes
+        + str(edited_at).encode(),
+        digest_size=16
+    ).digest()
+
+
+class _BloomFilter:
+    """Set of keys with a small probability of false positives and a fixed
+    size. Keys must already be hashes, like those of status_key.
+    """
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        """Arguments:
+        capacity -- number of keys until the error rate is reached
+        error_rate -- probability of false positives at capacity
+        """
+        self.num_bits = ceil(-capacity * log(error_rate) / log(2)**2)
+        self.num_hashes = max(round(self.num_bits / capacity * log(2)), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _indexes(self, key: bytes) -> list[int]:
+        # Double hashing, see Kirsch & Mitzenmacher: Less Hashing, Same
+        # Performance: Building a Better Bloom Filter.
+        h1 = int.from_bytes(key[:8], 'little')
+        h2 = int.from_bytes(key[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(
+            self.bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(key))
+
+    def add(self, key: bytes) -> None:
+        for i in self._indexes(key):
+            self.bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+
+class _DedupCache:
+    """Remember recently written statuses to skip duplicates. The most
+    recent keys are kept exactly in an LRU cache. Older keys are kept in two
+    generations of Bloom filters, so memory stays bounded while duplicates
+    are found over a longer time. The state can be saved to a file to
+    survive restarts.
+    """
+    VERSION = 1
+
+    def __init__(
+        self,
+        size: int = 100_000,
+        bloom_size: int | None = None,
+        error_rate: float = 1e-6,
+        file: str | None = None,
+        save_interval: float = 300,
+    ) -> None:
+        """Arguments:
+        size -- number of recent keys kept exactly
+        bloom_size -- number of keys per Bloom filter generation. Default:
+            10 times size
+        error_rate -- probability that a Bloom filter wrongly reports a new
+            status as duplicate, which drops it
+        file -- file to save the state to and load it from
+        save_interval -- minimum seconds between two saves to the file
+        """
+        self.bloom_size = bloom_size or 10 * size
+        self.error_rate = error_rate
+        self.file = file
+        self.hits = 0
+        self.lock = Lock()
+        self.lookups = 0
+        self.recent: OrderedDict[bytes, None] = OrderedDict()
+        self.saved_at = monotonic()
+        self.save_interval = save_interval
+        self.size = size
+        self.current = _BloomFilter(self.bloom_size, error_rate)
+        self.previous = _BloomFilter(self.bloom_size, error_rate)
+        if (file):
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.file, mode='rb') as f:
+                header = loads(f.readline())
+                if (
+                    header['version'] != self.VERSION
+                    or header['bloom_size'] != self.bloom_size
+                    or header['error_rate'] != self.error_rate
+                ):
+                    print('Dedup file has other settings, ignoring it.',
+                        file=stderr, flush=True)
+                    return
+                bits = [f.read(len(self.current.bits)) for _ in range(2)]
+                recent = f.read()
+        except FileNotFoundError:
+            return
+        if (any(len(b) != len(self.current.bits) for b in bits)):
+            print('Dedup file is truncated, ignoring it.',
+                file=stderr, flush=True)
+            return
+        for bloom, b, count in zip(
+            (self.current, self.previous), bits, header['counts']
+        ):
+            bloom.bits = bytearray(b)
+            bloom.count = count
+        for i in range(0, len(recent), 16)[-self.size:]:
+            self.recent[recent[i:i + 16]] = None
+        print(f'Loaded {self.current.count + self.previous.count} '
+            +'remembered statuses from dedup file.', file=stderr, flush=True)
+
+    def __contains__(self, key: bytes) -> bool:
+        """Return whether a key was added before and count the lookup."""
+        with self.lock:
+            self.lookups += 1
+            if (key in self.recent):
+                self.recent.move_to_end(key)
+                self.hits += 1
+                return True
+            if (key in self.current or key in self.previous):
+                self.hits += 1
+                return True
+            return False
+
+    def add(self, key: bytes) -> None:
+        with self.lock:
+            if (key in self.recent):
+                return
+            self.recent[key] = None
+            if (len(self.recent) > self.size):
+                self.recent.popitem(last=False)
+            if (self.current.count >= self.bloom_size):
+                # Forget the oldest generation.
+                self.previous = self.current
+                self.current = _BloomFilter(self.bloom_size, self.error_rate)
+            self.current.add(key)
+
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0
+
+    def save_due(self) -> bool:
+        return bool(self.file) \
+            and monotonic() - self.saved_at >= self.save_interval
+
+    def snapshot(self) -> bytes:
+        """Return the state to save with write."""
+        with self.lock:
+            header = dumps({
+                'version': self.VERSION,
+                'bloom_size': self.bloom_size,
+                'error_rate': self.error_rate,
+                'counts': [self.current.count, self.previous.count],
+            }).encode() + b'\n'
+            return b''.join((
+                header, self.current.bits, self.previous.bits,
+                *self.recent
+            ))
+
+    def write(self, snapshot: bytes) -> None:
+        """Save a snapshot to the file. Only save snapshots whose statuses
+        were all saved, or a status that was not saved would be skipped
+        after a restart.
+        """
+        tmp_file = self.file + '.tmp'
+        with open(tmp_file, mode='wb') as f:
+            f.write(snapshot)
+        replace(tmp_file, self.file)
+        self.saved_at = monotonic()
@@ -0,0 +1,152 @@
+"""Example statuses as Mastodon.py returns them, covering the attributes
+that transform converts, for tests and benchmarks.
+"""
+
+from datetime import datetime, UTC
+
+CRAWLED_AT = datetime(2024, 5, 1, 12, 30, tzinfo=UTC)
+
+
+def example_account(**kwargs) -> dict:
+    account = {
+        'id': 109,
+        'username': 'alice',
+        'acct': 'alice',
+        'display_name': 'Alice',
+        'locked': False,
+        'bot': False,
+        'discoverable': None,
+        'group': False,
+        'created_at': datetime(2022, 11, 5, tzinfo=UTC),
+        'note': '',
+        'url': 'https://example.com/@alice',
+        'uri': 'https://example.com/users/alice',
+        'avatar': 'https://example.com/a.png',
+        'avatar_static': 'https://example.com/a.png',
+        'header': '',
+        'header_static': '',
+        'followers_count': 3,
+        'following_count': 2**40,
+        'statuses_count': 0,
+        'last_status_at': datetime(2024, 4, 30, tzinfo=UTC),
+        'noindex': False,
+        'emojis': [],
+        'fields': [],
+    }
+    account.update(kwargs)
+    return account
+
+
+def example_status(**kwargs) -> dict:
+    status = {
+        'id': '112345678901234567',
+        'uri': 'https://example.com/users/alice/statuses/1',
+        'url': 'https://example.com/@alice/1',
+        'created_at': datetime(2024, 5, 1, 12, 29, tzinfo=UTC),
+        'edited_at': None,
+        'account': example_account(),
+        'content': '<p>Hello</p>',
+        'visibility': 'public',
+        'sensitive': False,
+        'spoiler_text': '',
+        'media_attachments': [],
+        'application': None,
+        'mentions': [],
+        'tags': [],
+        'emojis': [],
+        'reblog': None,
+        'poll': None,
+        'card': None,
+        'language': None,
+        'in_reply_to_id': None,
+        'in_reply_to_account_id': None,
+    }
+    status.update(kwargs)
+    return status
+
+
+STATUSES = [
+    example_status(),
+    example_status(account=example_account(noindex=True)),
+    example_status(
+        account=example_account(
+            acct='bob@remote.example', username='bob', note='<p>Hi</p>',
+            emojis=[{
+                'shortcode': 'wave', 'url': 'https://e.x/w.png',
+                'static_url': 'https://e.x/w.png',
+                'visible_in_picker': False,
+            }],
+            fields=[
+                {'name': 'Web', 'value': 'x', 'verified_at': None},
+                {'name': 'Git', 'value': 'y',
+                    'verified_at': datetime(2023, 1, 1, tzinfo=UTC)},
+            ],
+        ),
+        application={'name': 'Web', 'website': None},
+        card={
+            'url': 'https://news.example/a', 'title': 'A', 'description': '',
+            'type': 'link', 'author_name': '', 'author_url': '',
+            'provider_name': 'News', 'provider_url': '', 'html': '',
+            'width': 400, 'height': 0, 'image': None, 'embed_url': '',
+            'blurhash': None, 'language': 'en', 'published_at': None,
+        },
+        edited_at=datetime(2024, 5, 1, 13, tzinfo=UTC),
+        emojis=[{'shortcode': 'x', 'url': None, 'static_url': None,
+            'visible_in_picker': True}],
+        in_reply_to_account_id=110,
+        in_reply_to_id='112345678901234000',
+        language='en',
+        media_attachments=[
+            {
+                'id': 1, 'type': 'image', 'url': 'https://e.x/1.png',
+                'preview_url': 'https://e.x/1s.png', 'remote_url': None,
+                'description': None, 'blurhash': 'UBL_:rOp',
+                'meta': {
+                    'focus': {'x': -0.5, 'y': 0.0},
+                    'original': {'width': 640, 'height': 480,
+                        'aspect': 1.3333},
+                    'small': {'width': 64, 'height': 48, 'aspect': 1.3333},
+                },
+            },
+            {
+                'id': 2, 'type': 'video', 'url': 'https://e.x/2.mp4',
+                'preview_url': None, 'remote_url': 'https://r.x/2.mp4',
+                'description': 'A video', 'blurhash': None,
+                'meta': {
+                    'audio_bitrate': '44100 Hz', 'audio_channels': 'stereo',
+                    'audio_encode': 'aac', 'focus': None,
+                    'original': {'frame_rate': '30/1', 'duration': 2.5,
+                        'bitrate': 1000000},
+                    'small': {},
+                },
+            },
+            {'id': 3, 'type': 'unknown', 'url': None, 'preview_url': None,
+                'remote_url': None, 'description': None, 'blurhash': None,
+                'meta': None},
+        ],
+        mentions=[{'id': 7, 'username': 'carol', 'acct': 'carol@c.example',
+            'url': 'https://c.example/@carol'}],
+        poll={
+            'id': 5, 'expires_at': None, 'expired': True, 'multiple': False,
+            'votes_count': 0, 'voters_count': None,
+            'options': [{'title': 'Yes', 'votes_count': 0},
+                {'title': 'No', 'votes_count': None}],
+        },
+        reblog={'id': 4, 'url': None},
+        sensitive=True,
+        spoiler_text='CW',
+        tags=[{'name': 'python', 'url': 'https://example.com/tags/python'}],
+    ),
+    example_status(
+        application={'name': '', 'website': None},
+        card={'url': None, 'title': '', 'description': None, 'type': None,
+            'author_name': None, 'author_url': None, 'provider_name': None,
+            'provider_url': None, 'width': None, 'height': None,
+            'image': None, 'embed_url': None, 'blurhash': None,
+            'language': None, 'published_at': None},
+        content='',
+        poll={'id': None, 'expires_at': None, 'expired': None,
+            'multiple': None, 'votes_count': None, 'voters_count': None,
+            'options': []},
+    ),
+]
@@ -0,0 +1,274 @@
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from datetime import datetime
+from elasticsearch import Elasticsearch
+from json import dump, load, loads
+from multiprocessing import get_context
+from os import path, replace
+from sys import stderr
+from time import monotonic, sleep
+
+from mastodon_search.crawl.accounts import _AccountCache
+from mastodon_search.crawl.archive import read_footer, read_segment, segments
+from mastodon_search.crawl.poll import _parse_datetimes
+from mastodon_search.crawl.save import _BatchSizer, _Save, SERIALIZERS
+from mastodon_search.elastic_dsl.indices import init_template
+from mastodon_search.elastic_dsl.mastodon import AccountSnapshot
+from mastodon_search.globals import ACCOUNT_INDEX, INDEX_PREFIX
+
+# The _Save of a worker process, see: _init_worker
+_worker_save = None
+
+
+def _init_worker(
+    host: str, password: str, port: int, username: str, options: dict
+) -> None:
+    """Connect a worker process to Elasticsearch."""
+    global _worker_save
+    _worker_save = _Save(
+        max_bytes=options['max_buffer_size'] * 2**20,
+        batch_sizer=_BatchSizer(
+            size=options['bulk_size'],
+            max_size=options['bulk_max_size']
+        ),
+        bulk_workers=options['bulk_workers'],
+        canonical=options['canonical'],
+        accounts=_AccountCache() if options['split_accounts'] else None,
+        serializer=SERIALIZERS[options['serializer']](),
+        http_compress=options['http_compress'],
+        rollover=options['rollover']
+    )
+    _worker_save.init_elastic_connection(host, password, port, username)
+
+
+def _ingest_segment(file: str) -> int:
+    """Save all statuses of an archive segment to Elasticsearch. Return
+    their number. Raise a RuntimeError if Elasticsearch refused some, so
+    that the segment is not checkpointed. Run in a worker process.
+    """
+    # A worker ingests one segment at a time.
+    refused = _worker_save.sink.refused
+    records = 0
+    for line in read_segment(file):
+        record = loads(line, object_hook=_parse_datetimes)
+        _worker_save.write_status(
+            record['status'], record['instance'], record['api_method'],
+            crawled_at=datetime.fromisoformat(record['crawled_at'])
+        )
+        records += 1
+    # Wait until the statuses being saved by the flush thread are saved,
+    # too, so the segment is only checkpointed when all are saved.
+    while True:
+        _worker_save.save_queued()
+        with _worker_save.lock:
+            if (not _worker_save and not _worker_save.saving):
+                break
+        sleep(0.1)
+    if (refused := _worker_save.sink.refused - refused):
+        raise RuntimeError(f'Elasticsearch refused {refused} statuses.')
+    return records
+
+
+class Ingester:
+    """Save the statuses of an archive written with --archive-dir to
+    Elasticsearch, e. g. to index them again after the mapping changed.
+    Segments are spread across worker processes that each convert statuses
+    like _Save.write_status and send concurrent bulk requests. Progress is
+    checkpointed per segment.
+    """
+    def __init__(
+        self,
+        archive_dir: str,
+        processes: int = 4,
+        checkpoint_file: str | None = None,
+        checkpoint_interval: int = 60,
+        pause_refresh: bool = True,
+        **options,
+    ) -> None:
+        """Arguments:
+        archive_dir -- directory of the archive
+        processes -- number of worker processes
+        checkpoint_file -- JSON file to save progress to and resume from
+        checkpoint_interval -- minimum seconds between two checkpoints
+        pause_refresh -- disable refreshes and replicas of the target
+            indices while ingesting, and restore them afterwards
+        options -- how workers save statuses, see: mastodon_search.cli:
+            ingest
+        """
+        self.archive_dir = path.abspath(archive_dir)
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.options = options
+        self.pause_refresh = pause_refresh
+        self.processes = processes
+        done, self.index_settings = self._load_checkpoint()
+        self.done = set(done)
+
+    def _checkpoint(self) -> None:
+        if (not self.checkpoint_file):
+            return
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, mode='w') as f:
+            dump({
+                'archive_dir': self.archive_dir,
+                'done': sorted(self.done),
+                'index_settings': self.index_settings,
+            }, f, indent=1)
+        replace(tmp_file, self.checkpoint_file)
+
+    def _load_checkpoint(self) -> tuple[list[str], dict | None]:
+        """Return the finished segments of the checkpoint file and the
+        original settings of the target indices.
+        """
+        if (not self.checkpoint_file):
+            return [], None
+        try:
+            with open(self.checkpoint_file) as f:
+                data = load(f)
+        except FileNotFoundError:
+            return [], None
+        if (data['archive_dir'] != self.archive_dir):
+            print('Checkpoint file belongs to another archive, ignoring it.',
+                file=stderr, flush=True)
+            return [], None
+        print(f'Resuming from checkpoint, {len(data["done"])} segments done.',
+            flush=True)
+        return data['done'], data['index_settings']
+
+    def _pause_indices(self, client: Elasticsearch, files: list[str]) -> None:
+        """Create the indices the statuses of the segments are saved to, and
+        disable their refreshes and replicas. Their settings are kept in the
+        checkpoint, so they are restored even after a crash.
+        """
+        indices = self._target_indices(files)
+        if (not indices):
+            return
+        if (ACCOUNT_INDEX in indices):
+            # The workers would install it only after the index exists.
+            init_template(
+                client, ACCOUNT_INDEX, ACCOUNT_INDEX, AccountSnapshot)
+        for index in indices:
+            if (not client.indices.exists(index=index)):
+                client.indices.create(index=index)
+        settings = client.indices.get_settings(
+            index=indices,
+            name=['index.number_of_replicas', 'index.refresh_interval'],
+            flat_settings=True
+        )
+        if (self.index_settings is None):
+            self.index_settings = {}
+        for index, s in settings.items():
+            # Keep the settings of a previous, interrupted run.
+            self.index_settings.setdefault(index, {
+                'index.number_of_replicas':
+                    s['settings'].get('index.number_of_replicas'),
+                'index.refresh_interval':
+                    s['settings'].get('index.refresh_interval'),
+            })
+        self._checkpoint()
+        client.indices.put_settings(index=indices, settings={
+            'index.number_of_replicas': 0,
+            'index.refresh_interval': '-1',
+        })
+
+    def _restore_indices(self, client: Elasticsearch) -> None:
+        for index, settings in self.index_settings.items():
+            # None resets a setting to its default.
+            client.indices.put_settings(index=index, settings=settings)
+        client.indices.refresh(index=list(self.index_settings))
+        self.index_settings = None
+        self._checkpoint()
+
+    def _target_indices(self, files: list[str]) -> list[str]:
+        """Return the indices that statuses of the segments are saved to,
+        as far as they are known beforehand. Canonical statuses are saved by
+        the month they were created, which may be long before they were
+        crawled, and statuses saved with rollover to indices created while
+        ingesting, so their indices are not returned.
+        """
+        indices = set()
+        monthly = not self.options['canonical'] \
+            and not self.options['rollover']
+        for file in files if monthly else []:
+            if (not (footer := read_footer(file)) or not footer['records']):
+                continue
+            for key in ('first_crawled_at', 'last_crawled_at'):
+                indices.add(datetime.fromisoformat(footer[key])
+                    .strftime(f'{INDEX_PREFIX}_%Y_%m'))
+        if (self.options['split_accounts']):
+            indices.add(ACCOUNT_INDEX)
+        return sorted(indices)
+
+    def ingest_to_elastic(
+        self,
+        host: str,
+        password: str,
+        port: int,
+        username: str,
+    ) -> None:
+        """Save all segments that are not done yet to Elasticsearch.
+
+        Arguments:
+        see mastodon_search.cli: ingest
+        """
+        todo = [
+            file for file in segments(self.archive_dir)
+            if path.relpath(file, self.archive_dir) not in self.done
+        ]
+        print(f'Ingesting {len(todo)} segments with {self.processes} '
+            +'processes.', flush=True)
+        client = Elasticsearch(
+            host + ':' + str(port), basic_auth=(username, password),
+            timeout=60)
+        if (
+            self.options['rollover']
+            and not client.indices.exists_alias(name=INDEX_PREFIX)
+        ):
+            # Checked before the workers start, which would exit.
+            raise ValueError(f'There is no alias {INDEX_PREFIX} to roll '
+                +'over, run setup-indices with --rollover first.')
+        if (self.pause_refresh and todo):
+            self._pause_indices(client, todo)
+        checkpointed_at = monotonic()
+        failed = 0
+        start = monotonic()
+        statuses = 0
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.processes,
+                # Do not share the connections of this process.
+                mp_context=get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(host, password, port, username, self.options)
+            ) as executor:
+                futures = {
+                    executor.submit(_ingest_segment, file): file
+                    for file in todo
+                }
+                for i, future in enumerate(as_completed(futures), start=1):
+                    file = futures[future]
+                    try:
+                        statuses += future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f'Ingesting {file} failed:', e,
+                            file=stderr, flush=True)
+                        continue
+                    self.done.add(path.relpath(file, self.archive_dir))
+                    if (
+                        monotonic() - checkpointed_at
+                        >= self.checkpoint_interval
+                    ):
+                        self._checkpoint()
+                        checkpointed_at = monotonic()
+                        rate = statuses / (monotonic() - start)
+                        print(f'{i}/{len(todo)} segments, {statuses} '
+                            +f'statuses, {rate:.0f} statuses/s.', flush=True)
+        finally:
+            if (self.index_settings is not None):
+                self._restore_indices(client)
+            self._checkpoint()
+        print(f'Ingested {statuses} statuses from '
+            +f'{len(todo) - failed} segments.', flush=True)
+        if (failed):
+            print(f'{failed} segments failed, run again to retry them.',
+                file=stderr, flush=True)
@@ -0,0 +1,170 @@
+from collections import Counter
+from datetime import datetime, UTC
+from sys import stderr
+from threading import BoundedSemaphore, Lock, Thread
+from time import sleep
+from typing import TextIO
+
+from mastodon_search.crawl.poll import AsyncPoller
+from mastodon_search.crawl.save import _Save
+from mastodon_search.crawl.schedule import PollScheduler
+from mastodon_search.crawl.stream import Streamer
+
+
+class MultiCrawler:
+    """Crawl many Mastodon instances in one process. All instances share one
+    Elasticsearch connection and one _Save queue. Instances are streamed in
+    their own thread if possible. All other instances are polled by a single
+    AsyncPoller.
+    """
+    def __init__(
+        self,
+        instances: list[str],
+        max_connections: int = 100,
+        max_streams: int = 100,
+        start_interval: float = 1,
+        status_interval: int = 600,
+        retry_wait: int = 300,
+        scheduler: PollScheduler | None = None,
+        save: _Save | None = None,
+    ) -> None:
+        """Arguments:
+        instances -- instances' base URIs, e. g.: ['mastodon.social']
+        max_connections -- maximum number of simultaneously open connections
+            of the poller
+        max_streams -- maximum number of simultaneously open streaming
+            connections. Other instances are crawled via GET requests.
+        start_interval -- seconds to wait between starting two instances so
+            that startup requests are spread out
+        status_interval -- seconds between two status reports
+        retry_wait -- seconds to wait before restarting a failed instance
+        scheduler -- decides when the poller polls which instance, see:
+            AsyncPoller
+        save -- the _Save to write statuses to. Default: a new one
+        """
+        self.instances = instances
+        self.lock = Lock()
+        self.retry_wait = retry_wait
+        self.save = save if save is not None else _Save()
+        self.poller = AsyncPoller(
+            self.save, scheduler, max_connections=max_connections)
+        self.start_interval = start_interval
+        self.status_interval = status_interval
+        self.stream_slots = BoundedSemaphore(max_streams)
+        self.streamers: dict[str, Streamer | None] = {
+            instance: None for instance in instances
+        }
+        self.restarts: Counter[str] = Counter()
+
+    @classmethod
+    def from_file(cls, file: TextIO, **kwargs) -> 'MultiCrawler':
+        """Create a MultiCrawler from an instance list with one instance per
+        line, like `data/instances.txt`. Empty lines and duplicates are
+        skipped.
+        """
+        instances = []
+        for line in file:
+            instance = line.strip()
+            if (instance and instance not in instances):
+                instances.append(instance)
+        return cls(instances, **kwargs)
+
+    def _crawl_instance(self, instance: str) -> None:
+        """Stream one instance as long as possible, then hand it over to the
+        poller. Restart it after a waiting time if anything fails. Run as
+        thread.
+        """
+        while True:
+            try:
+                last_id = self.save.get_last_id(instance)
+                if (not self.stream_slots.acquire(blocking=False)):
+                    self.poller.add(instance, last_id)
+                    return
+                try:
+                    streamer = Streamer(instance, self.save, quiet=True)
+                    with self.lock:
+                        self.streamers[instance] = streamer
+                    streamer.last_seen_id = last_id
+                    streamer.stream()
+                finally:
+                    self.stream_slots.release()
+                self.poller.add(instance, streamer.last_seen_id)
+                return
+            except Exception as e:
+                print(f'Crawling {instance} failed:', e,
+                    file=stderr, flush=True)
+            with self.lock:
+                if (self.streamers[instance] is not None):
+                    self.streamers[instance].state = 'failed'
+                self.restarts[instance] += 1
+            sleep(self.retry_wait)
+
+    def _print_status(self) -> None:
+        """Print the state and the `created_at` value of the last crawled
+        status of every instance periodically. Run as thread.
+        """
+        while True:
+            sleep(self.status_interval)
+            lines = []
+            states = Counter()
+            with self.lock:
+                for instance, streamer in self.streamers.items():
+                    if (polled := self.poller.instances.get(instance)):
+                        state = polled.state
+                        last = polled.last_seen_created_at
+                    elif (streamer is None):
+                        state = 'waiting'
+                        last = None
+                    else:
+                        state = streamer.state
+                        last = max(
+                            (
+                                d for d in (
+                                    streamer.last_seen_created_at,
+                                    streamer.crawler.last_seen_created_at
+                                ) if d
+                            ),
+                            default=None
+                        )
+                    states[state] += 1
+                    lines.append(
+                        f'{instance}\t{state}\t'
+                        + (last.isoformat(timespec='seconds') if last
+                           else 'None')
+                        + f'\t{self.restarts[instance]}'
+                    )
+            print(
+                datetime.now(tz=UTC).isoformat(timespec='seconds'),
+                self.save.buffer_status() + ',',
+                ', '.join(
+                    f'{n} {state}' for state, n in sorted(states.items())),
+                file=self.save.report_file, flush=True
+            )
+            print('instance\tstate\tlast status created at\trestarts',
+                *lines, sep='\n', file=self.save.report_file, flush=True)
+
+    def crawl_to_elastic(
+        self,
+        host: str,
+        password: str,
+        port: int,
+        username: str,
+    ) -> None:
+        """Connect to Elasticsearch once, then start crawling all instances.
+
+        Arguments:
+        see mastodon_search.cli: crawl_many
+        """
+        self.save.init_elastic_connection(host, password, port, username)
+        self.poller.start()
+        Thread(target=self._print_status, daemon=True).start()
+        print(f'Crawling {len(self.instances)} instances.',
+            file=self.save.report_file, flush=True)
+        for instance in self.instances:
+            Thread(
+                target=self._crawl_instance, args=(instance,), daemon=True
+            ).start()
+            sleep(self.start_interval)
+        # Streaming threads hand over to the poller, which runs forever.
+        while True:
+            sleep(3600)
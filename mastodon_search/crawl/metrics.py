@@ -0,0 +1,112 @@
+"""Metrics of a crawling process in the Prometheus text format, and the
+periodic progress report on stdout. Metrics are always collected, as that
+is cheap, but only served when start_server is called, e. g. with the
+--metrics-port option of the crawl commands.
+"""
+
+from prometheus_client import (
+    Counter, Gauge, Histogram, start_http_server, Summary
+)
+from threading import Lock, Thread
+from time import sleep
+from typing import Callable
+
+PREFIX = 'mastodon_search'
+
+STATUSES = Counter(
+    f'{PREFIX}_statuses', 'Statuses received, including duplicates',
+    ['instance', 'api_method'])
+LAG = Gauge(
+    f'{PREFIX}_lag_seconds',
+    'Seconds between creating and crawling the last received status',
+    ['instance'])
+BUFFER_STATUSES = Gauge(
+    f'{PREFIX}_buffer_statuses',
+    'Statuses queued or being saved, including those spilled to disk')
+BUFFER_BYTES = Gauge(
+    f'{PREFIX}_buffer_bytes', 'Size of the statuses queued or being saved')
+BULK_DURATION = Histogram(
+    f'{PREFIX}_bulk_duration_seconds', 'Duration of bulk requests',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf')))
+BULK_ERRORS = Counter(
+    f'{PREFIX}_bulk_errors',
+    'Bulk requests that failed, or whose statuses were partly rejected',
+    ['reason'])
+HTTP_RETRIES = Counter(
+    f'{PREFIX}_http_retries', 'Requests to instances that are retried',
+    ['instance'])
+RATE_LIMIT_WAITS = Counter(
+    f'{PREFIX}_rate_limit_waits',
+    'Requests rejected by instances with HTTP status 429, after which '
+    + 'crawling waits', ['instance'])
+STREAM_RECONNECTS = Counter(
+    f'{PREFIX}_stream_reconnects', 'Reconnects to the streaming API',
+    ['instance'])
+STAGE_SECONDS = Summary(
+    f'{PREFIX}_stage_seconds',
+    'Time spent in stages of crawling and saving, if profiled, see: '
+    + 'profiling', ['stage'])
+
+
+def start_server(port: int, addr: str = '127.0.0.1') -> None:
+    """Serve the metrics over HTTP from a background thread.
+
+    Arguments:
+    port -- the port to listen on
+    addr -- the address to listen on. Default: localhost only
+    """
+    start_http_server(port, addr)
+
+
+def watch_buffer(
+    statuses: Callable[[], float], size: Callable[[], float]
+) -> None:
+    """Report the buffer of the _Save of this process with the given
+    functions, which are called on every scrape.
+    """
+    BUFFER_STATUSES.set_function(statuses)
+    BUFFER_BYTES.set_function(size)
+
+
+class _Reporter:
+    """Print the `created_at` value of the last crawled status and the
+    buffer of every running crawler periodically. One thread prints for all
+    crawlers of the process, see: REPORTER
+    """
+    def __init__(self, delay: float = 60, interval: float = 600) -> None:
+        """Arguments:
+        delay -- seconds until the first report
+        interval -- seconds between two reports
+        """
+        self.crawlers = []
+        self.delay = delay
+        self.interval = interval
+        self.lock = Lock()
+        self.thread = None
+
+    def add(self, crawler) -> None:
+        """Report on a Crawler or Streamer while its is_running is set."""
+        with self.lock:
+            if (crawler not in self.crawlers):
+                self.crawlers.append(crawler)
+            if (self.thread is None):
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self) -> None:
+        sleep(self.delay)
+        while True:
+            with self.lock:
+                crawlers = [c for c in self.crawlers if c.is_running]
+            for crawler in crawlers:
+                last = crawler.last_seen_created_at
+                print(
+                    last.isoformat(timespec='seconds') if last else 'None',
+                    crawler.save.buffer_status(), sep='\t',
+                    file=crawler.save.report_file, flush=True
+                )
+            sleep(self.interval)
+
+
+# The reporter of this process.
+REPORTER = _Reporter()
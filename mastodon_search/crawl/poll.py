@@ -0,0 +1,271 @@
+import asyncio
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from datetime import datetime
+from json import loads
+from sys import stderr
+from threading import Event, Thread
+from time import time
+
+from mastodon_search.crawl.metrics import HTTP_RETRIES, RATE_LIMIT_WAITS
+from mastodon_search.crawl.profiling import stage
+from mastodon_search.crawl.ratelimit import LIMITERS
+from mastodon_search.crawl.save import _Save
+from mastodon_search.crawl.schedule import PollScheduler
+from mastodon_search.globals import USER_AGENT
+
+
+# Keys of Mastodon entities whose values are dates or datetimes.
+DATETIME_KEYS = frozenset((
+    'created_at', 'edited_at', 'expires_at',
+    'last_status_at', 'published_at', 'verified_at'
+))
+
+
+def _parse_datetimes(obj: dict) -> dict:
+    """JSON object hook to parse datetime strings like Mastodon.py does."""
+    for key in DATETIME_KEYS.intersection(obj):
+        if (isinstance(value := obj[key], str)):
+            try:
+                obj[key] = datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    return obj
+
+
+def base_url(instance: str) -> str:
+    """Return the base URL of an instance. Instances are usually given
+    without scheme, like for Mastodon.py.
+    """
+    return instance if '://' in instance else 'https://' + instance
+
+
+def parse_statuses(text: str) -> list[dict]:
+    """Parse a JSON list of statuses as returned by the Mastodon API.
+    Mastodon.py's typed entities are too slow to create for thousands of
+    instances, but plain dicts with parsed datetimes look the same to _Save.
+    """
+    return loads(text, object_hook=_parse_datetimes)
+
+
+class _PolledInstance:
+    """Polling state of a single instance."""
+    def __init__(
+        self, instance: str, min_id: str | None, wait_time: float
+    ) -> None:
+        self.errors = 0
+        self.instance = instance
+        self.last_seen_created_at = None
+        self.last_seen_id = min_id
+        self.state = 'polling'
+        self.wait_time = wait_time
+
+
+class AsyncPoller:
+    """Poll the public timelines of many Mastodon instances from a single
+    asyncio event loop. All requests share one pooled HTTP client with
+    keep-alive connections, so a waiting instance does not tie up a thread.
+    A PollScheduler decides when each instance is polled next.
+    """
+    API_METHOD = 'api/v1/timelines/public'
+    # Maximum number of statuses the API returns per request.
+    LIMIT = 40
+    # Retry these HTTP status codes, like Crawler._session does.
+    RETRY_STATUS = {
+        400, 403, 404, 429,
+        500, 502, 503, 504,
+        520, 521, 522, 523, 524, 525, 526, 527, 530
+    }
+
+    def __init__(
+        self,
+        save: _Save,
+        scheduler: PollScheduler | None = None,
+        max_connections: int = 100,
+        keepalive_timeout: float = 60,
+        request_timeout: float = 30,
+        max_retry_wait: float = 2**15,
+    ) -> None:
+        """Arguments:
+        save -- the _Save to write statuses to
+        scheduler -- decides when to poll which instance. Default: a
+            PollScheduler adapting wait times like Crawler._crawl_updates
+        max_connections -- maximum number of simultaneously open connections
+        keepalive_timeout -- seconds to keep idle connections open
+        request_timeout -- timeout in seconds of a single request
+        max_retry_wait -- maximum wait time in seconds after failed requests
+        """
+        self.instances: dict[str, _PolledInstance] = {}
+        self.keepalive_timeout = keepalive_timeout
+        self.loop = None
+        self.max_connections = max_connections
+        self.max_retry_wait = max_retry_wait
+        self.request_timeout = request_timeout
+        self.requests = 0
+        self.save = save
+        self.scheduler = scheduler if scheduler is not None \
+            else PollScheduler()
+        self.session = None
+        self.started = Event()
+        self.tasks = set()
+        self.wakeup = None
+
+    def add(self, instance: str, min_id: str | None = None) -> None:
+        """Start polling an instance. Can be called from any thread once the
+        poller is started.
+
+        Arguments:
+        instance -- an instance's base URI, e. g.: 'mastodon.social'
+        min_id -- ID of the last seen status of this instance
+        """
+        self.started.wait()
+        self.loop.call_soon_threadsafe(self._start_instance, instance, min_id)
+
+    def start(self) -> None:
+        """Run the event loop in a background thread."""
+        Thread(target=asyncio.run, args=(self._main(),), daemon=True).start()
+        self.started.wait()
+
+    def _schedule(self, instance: str, due: float) -> None:
+        self.scheduler.push(instance, due)
+        self.wakeup.set()
+
+    def _start_instance(self, instance: str, min_id: str | None) -> None:
+        if (instance in self.instances):
+            # Already scheduled.
+            return
+        self.instances[instance] = _PolledInstance(
+            instance, min_id, self.scheduler.initial_wait)
+        self._schedule(instance, time())
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        """Reschedule an instance if anything unexpected failed."""
+        self.tasks.discard(task)
+        if (task.cancelled() or not (e := task.exception())):
+            return
+        polled = self.instances[task.get_name()]
+        polled.state = 'failed'
+        print(f'Polling {polled.instance} failed:', e, file=stderr, flush=True)
+        self._schedule(polled.instance, time() + self.scheduler.max_wait)
+
+    async def _dispatch(self) -> None:
+        """Poll every instance when it is due, earliest first."""
+        slots = asyncio.Semaphore(self.max_connections)
+        while True:
+            self.wakeup.clear()
+            due = self.scheduler.next_due()
+            if (due is None or due > time()):
+                timeout = None if due is None else due - time()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except TimeoutError:
+                    pass
+                continue
+            if (self.save.is_blocking()):
+                # Slow down until queued statuses were saved.
+                await asyncio.sleep(1)
+                continue
+            instance = self.scheduler.pop()
+            await slots.acquire()
+            task = asyncio.create_task(
+                self._poll(self.instances[instance], slots), name=instance)
+            # Keep a reference so the task is not garbage collected.
+            self.tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+    async def _fetch(self, polled: _PolledInstance) -> list[dict]:
+        """Request the statuses following the last seen one."""
+        params = {'limit': self.LIMIT}
+        if (polled.last_seen_id):
+            params['min_id'] = str(polled.last_seen_id)
+        self.requests += 1
+        limiter = LIMITERS[polled.instance]
+        try:
+            response = await self.session.get(
+                f'{base_url(polled.instance)}/{self.API_METHOD}',
+                params=params)
+        except BaseException:
+            limiter.release()
+            raise
+        async with response:
+            limiter.update(response.headers)
+            if (response.status in self.RETRY_STATUS):
+                raise _RetryableError(
+                    response.status, response.headers.get('Retry-After'))
+            response.raise_for_status()
+            text = await response.text()
+        with stage('parse'):
+            return parse_statuses(text)
+
+    async def _main(self) -> None:
+        connector = TCPConnector(
+            keepalive_timeout=self.keepalive_timeout,
+            limit=self.max_connections,
+            ttl_dns_cache=3600
+        )
+        async with ClientSession(
+            connector=connector,
+            headers={'User-Agent': USER_AGENT},
+            timeout=ClientTimeout(total=self.request_timeout)
+        ) as session:
+            self.session = session
+            self.loop = asyncio.get_running_loop()
+            self.wakeup = asyncio.Event()
+            self.started.set()
+            # Run until the process ends.
+            await self._dispatch()
+
+    async def _poll(
+        self, polled: _PolledInstance, slots: asyncio.Semaphore
+    ) -> None:
+        """Poll the public timeline of one instance once and schedule the
+        next poll.
+        """
+        try:
+            # Crawlers of the same instance share its rate limit.
+            if ((wait := LIMITERS[polled.instance].take()) > 0):
+                self._schedule(polled.instance, time() + wait)
+                return
+            statuses = await self._fetch(polled)
+        except (ClientError, TimeoutError, ValueError) as e:
+            polled.errors += 1
+            polled.state = 'failing'
+            retry_wait = min(2**polled.errors, self.max_retry_wait)
+            if (isinstance(e, _RetryableError) and e.retry_after):
+                retry_wait = max(retry_wait, e.retry_after)
+            if (isinstance(e, _RetryableError) and e.status == 429):
+                RATE_LIMIT_WAITS.labels(polled.instance).inc()
+            else:
+                HTTP_RETRIES.labels(polled.instance).inc()
+            print(f'Polling {polled.instance} failed:', e,
+                file=stderr, flush=True)
+            self._schedule(polled.instance, time() + retry_wait)
+            return
+        finally:
+            slots.release()
+        now = time()
+        polled.errors = 0
+        polled.state = 'polling'
+        if (statuses):
+            # _Save may block, so do not write from the event loop.
+            await asyncio.to_thread(
+                self._write_statuses, polled.instance, statuses)
+            polled.last_seen_id = statuses[0].get('id')
+            polled.last_seen_created_at = statuses[0].get('created_at')
+        polled.wait_time = self.scheduler.wait_time(
+            polled.instance, polled.wait_time, statuses, now)
+        self._schedule(polled.instance, now + polled.wait_time)
+
+    def _write_statuses(self, instance: str, statuses: list[dict]) -> None:
+        for status in statuses:
+            self.save.write_status(status, instance, self.API_METHOD)
+
+
+class _RetryableError(ClientError):
+    def __init__(self, status: int, retry_after: str | None) -> None:
+        super().__init__(f'HTTP status {status}')
+        self.status = status
+        try:
+            self.retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            # Retry-After can also be an HTTP date. Use the default backoff.
+            self.retry_after = None
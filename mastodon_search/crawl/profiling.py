@@ -0,0 +1,131 @@
+"""Profiling of a crawling process, switched on with the --profile options of
+the crawl commands or the MASTODON_SEARCH_PROFILE environment variable.
+
+stages -- time the stages of crawling and saving statuses, served as the
+    metric mastodon_search_stage_seconds (see: metrics). When off, timing a
+    stage costs about as much as an empty `with` statement.
+cprofile -- profile all threads with cProfile (before Python 3.12, only
+    those started afterwards) and write the accumulated statistics to a
+    directory periodically. Read them with `python -m pstats <file>`. Makes
+    crawling considerably slower.
+tracemalloc -- trace memory allocations and write snapshots to a directory
+    periodically. Read them with tracemalloc.Snapshot.load.
+"""
+
+from contextlib import AbstractContextManager, nullcontext
+from cProfile import Profile
+from datetime import datetime, UTC
+from os import makedirs, path
+from pstats import Stats
+from sys import stderr, version_info
+from threading import Lock, Thread, setprofile as setprofile_threads
+from time import sleep
+import tracemalloc
+
+from mastodon_search.crawl.metrics import STAGE_SECONDS
+
+MODES = ['stages', 'cprofile', 'tracemalloc']
+# Number of frames stored per traced allocation.
+TRACEMALLOC_FRAMES = 10
+
+_NOT_TIMED = nullcontext()
+_stages_enabled = False
+
+
+def stage(name: str) -> AbstractContextManager:
+    """Return a context manager timing a stage, if stages are profiled.
+
+    Arguments:
+    name -- the stage, e. g. 'transform'
+    """
+    if (not _stages_enabled):
+        return _NOT_TIMED
+    return STAGE_SECONDS.labels(name).time()
+
+
+def start(modes: list[str], directory: str, interval: float) -> None:
+    """Start profiling this process.
+
+    Arguments:
+    modes -- what to profile, see: MODES
+    directory -- where to write cProfile and tracemalloc snapshots
+    interval -- seconds between two snapshots
+    """
+    global _stages_enabled
+    _stages_enabled = 'stages' in modes
+    snapshots = _Snapshots(directory, interval)
+    if ('cprofile' in modes):
+        snapshots.start_cprofile()
+    if ('tracemalloc' in modes):
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        snapshots.tracemalloc = True
+    if (snapshots.profiles or snapshots.tracemalloc):
+        makedirs(directory, exist_ok=True)
+        Thread(target=snapshots.run, daemon=True).start()
+
+
+class _ProfileStats:
+    """Statistics of a running cProfile.Profile, which pstats.Stats can load
+    without stopping the profile.
+    """
+    def __init__(self, profile: Profile) -> None:
+        profile.snapshot_stats()
+        self.stats = profile.stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class _Snapshots:
+    """Write cProfile and tracemalloc snapshots periodically."""
+    def __init__(self, directory: str, interval: float) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.lock = Lock()
+        # Before Python 3.12, cProfile profiles a single thread, so every
+        # thread gets a profile. Since, one profile sees all threads.
+        self.profiles = []
+        self.tracemalloc = False
+
+    def _profile_thread(self, *args) -> None:
+        """Profile the calling thread from now on. Set as profile function
+        of new threads, which it replaces on the first call.
+        """
+        profile = Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start_cprofile(self) -> None:
+        if (version_info < (3, 12)):
+            setprofile_threads(self._profile_thread)
+        self._profile_thread()
+
+    def run(self) -> None:
+        """Write snapshots every self.interval seconds. Run as thread."""
+        while True:
+            sleep(self.interval)
+            try:
+                self.write()
+            except Exception as e:
+                print('Writing profiling snapshots failed:', e,
+                    file=stderr, flush=True)
+
+    def write(self) -> None:
+        """Write a snapshot of every enabled kind, named by the time."""
+        name = datetime.now(tz=UTC).strftime('%Y-%m-%dT%H%M%S')
+        with self.lock:
+            profiles = list(self.profiles)
+        # pstats cannot load profiles without calls, e. g. of new threads.
+        snapshots = [
+            snapshot for profile in profiles
+            if (snapshot := _ProfileStats(profile)).stats
+        ]
+        if (snapshots):
+            stats = Stats(snapshots[0])
+            stats.add(*snapshots[1:])
+            stats.dump_stats(
+                path.join(self.directory, f'cprofile-{name}.pstats'))
+        if (self.tracemalloc):
+            tracemalloc.take_snapshot().dump(
+                path.join(self.directory, f'tracemalloc-{name}.snapshot'))
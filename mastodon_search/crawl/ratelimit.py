@@ -0,0 +1,185 @@
+"""Rate limits of requests to instances. Mastodon reports how many requests
+remain in the current window of its rate limit with every response, see:
+https://docs.joinmastodon.org/api/rate-limits/
+"""
+
+from datetime import datetime, UTC
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from time import monotonic, sleep
+from typing import Mapping
+
+
+class _TokenBucket:
+    """Requests allowed to one instance. Until the instance reports its rate
+    limit, the bucket holds up to `burst` tokens and refills at
+    `per_second`. Then, it holds the requests remaining in the instance's
+    window, which may be sent at once, and refills when the window resets.
+    """
+    def __init__(
+        self, per_second: float = 1, burst: int = 1,
+        max_per_second: float | None = None
+    ) -> None:
+        """Arguments:
+        per_second -- requests per second until the rate limit is known
+        burst -- maximum number of requests at once until then
+        max_per_second -- maximum number of requests per second, even if the
+            rate limit allows more. Default: unlimited
+        """
+        self.burst = burst
+        # Requests per window, once reported by the instance.
+        self.limit = None
+        self.lock = Lock()
+        self.max_per_second = max_per_second
+        # Earliest time of the next request by max_per_second.
+        self.next_at = monotonic()
+        # Tokens taken for requests without a response yet.
+        self.pending = 0
+        self.per_second = per_second
+        # When the current window of the rate limit ends, if known.
+        self.reset_at = None
+        # Negative when requests wait for tokens.
+        self.tokens = burst
+        self.updated_at = monotonic()
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens since the last update. Call with self.lock held."""
+        if (self.limit is None):
+            self.tokens = min(
+                self.tokens + (now - self.updated_at) * self.per_second,
+                self.burst)
+        elif (self.reset_at is not None and now >= self.reset_at):
+            # Requests waiting for the reset spend the new window's tokens.
+            self.tokens = self.limit + min(self.tokens, 0)
+            self.reset_at = None
+        self.updated_at = now
+
+    def _wait(self, now: float) -> float:
+        """Return the seconds until the next request may be sent. Call with
+        self.lock held.
+        """
+        wait = 0
+        if (self.tokens < 1):
+            if (self.limit is not None and self.reset_at is not None):
+                wait = self.reset_at - now
+            else:
+                # The window reset, but no response reported the new one.
+                wait = (1 - self.tokens) / self.per_second
+        if (self.max_per_second):
+            wait = max(wait, self.next_at - now)
+        return wait
+
+    def _take(self, now: float, wait: float) -> None:
+        """Take a token for a request sent after `wait` seconds. Call with
+        self.lock held.
+        """
+        self.pending += 1
+        self.tokens -= 1
+        if (self.max_per_second):
+            self.next_at = now + wait + 1 / self.max_per_second
+
+    def reserve(self) -> float:
+        """Take a token and return the seconds to wait before sending the
+        request.
+        """
+        with self.lock:
+            now = monotonic()
+            self._refill(now)
+            wait = self._wait(now)
+            self._take(now, wait)
+            return wait
+
+    def take(self) -> float:
+        """Take a token and return 0 if a request may be sent now. Otherwise,
+        return the seconds until it may be sent, without taking a token.
+        """
+        with self.lock:
+            now = monotonic()
+            self._refill(now)
+            wait = self._wait(now)
+            if (wait <= 0):
+                self._take(now, 0)
+            return wait
+
+    def release(self) -> None:
+        """Mark the request of a taken token as done, with or without a
+        response.
+        """
+        with self.lock:
+            self.pending = max(self.pending - 1, 0)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Release the token of the request and adjust the tokens to the
+        rate limit reported in the headers of its response, if any.
+        """
+        self.release()
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = datetime.fromisoformat(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        if (reset.tzinfo is None):
+            reset = reset.replace(tzinfo=UTC)
+        reset_in = (reset - datetime.now(tz=UTC)).total_seconds()
+        with self.lock:
+            now = monotonic()
+            self.limit = limit
+            self.reset_at = now + max(reset_in, 0)
+            # The remaining requests do not count those still pending yet.
+            self.tokens = remaining - self.pending
+            self.updated_at = now
+
+
+class LimiterRegistry:
+    """Token buckets of all instances crawled by a process, created on first
+    use, so that all crawlers of an instance share its rate limit. See:
+    LIMITERS
+    """
+    def __init__(
+        self, per_second: float = 1, burst: int = 1,
+        max_per_second: float | None = None
+    ) -> None:
+        """Arguments:
+        see _TokenBucket
+        """
+        self.buckets: dict[str, _TokenBucket] = {}
+        self.burst = burst
+        self.lock = Lock()
+        self.max_per_second = max_per_second
+        self.per_second = per_second
+
+    def __getitem__(self, instance: str) -> _TokenBucket:
+        with self.lock:
+            if (instance not in self.buckets):
+                self.buckets[instance] = _TokenBucket(
+                    self.per_second, self.burst, self.max_per_second)
+            return self.buckets[instance]
+
+
+class _LimiterAdapter(HTTPAdapter):
+    """Transport adapter for requests that waits for a token bucket before
+    every request and updates it from every response.
+    """
+    def __init__(self, bucket: _TokenBucket, **kwargs) -> None:
+        """Arguments:
+        bucket -- the token bucket of the instance
+        kwargs -- see requests.adapters.HTTPAdapter
+        """
+        super().__init__(**kwargs)
+        self.bucket = bucket
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        sleep(self.bucket.reserve())
+        try:
+            response = super().send(request, **kwargs)
+        except BaseException:
+            self.bucket.release()
+            raise
+        self.bucket.update(response.headers)
+        return response
+
+
+# The rate limits of all instances crawled by this process.
+LIMITERS = LimiterRegistry()
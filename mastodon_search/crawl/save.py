@@ -1,81 +1,599 @@
+from abc import ABC, abstractmethod
 from collections import deque
-from collections.abc import Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+)
 from datetime import datetime, UTC
 from elasticsearch import (
-    AuthenticationException, ConnectionError, NotFoundError
+    AuthenticationException, ConnectionError, Elasticsearch, NotFoundError
 )
 from elasticsearch.helpers import streaming_bulk
-from elasticsearch_dsl import connections, Index
-from threading import Lock, Thread
-from time import sleep
-from uuid import NAMESPACE_URL, uuid5
+from elasticsearch.serializer import (
+    JsonSerializer, OrjsonSerializer, Serializer
+)
+from elasticsearch_dsl import connections, Index, Q
+from itertools import count
+from json import loads
+import sys
+from sys import stderr
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep
+from typing import TextIO
+
+from mastodon_search.crawl.accounts import _AccountCache
+from mastodon_search.crawl.archive import _Archive
+from mastodon_search.crawl.checkpoints import _Checkpoints
+from mastodon_search.crawl.dedup import _DedupCache, status_key
+from mastodon_search.crawl.metrics import (
+    BULK_DURATION, BULK_ERRORS, LAG, STATUSES, watch_buffer
+)
+from mastodon_search.crawl.profiling import stage
+from mastodon_search.crawl.spool import _Spool, dumps_action
+from mastodon_search.crawl.transform import (
+    account_to_action, split_account, status_to_action,
+    status_to_canonical_action
+)
+from mastodon_search.elastic_dsl.indices import init_template
+from mastodon_search.elastic_dsl.mastodon import (
+    AccountSnapshot, CanonicalStatus
+)
+from mastodon_search.globals import (
+    ACCOUNT_INDEX, CANONICAL_INDEX_PREFIX, INDEX_PREFIX
+)
+
+# JSON serializers for the Elasticsearch client by name, see: _Save
+SERIALIZERS = {'json': JsonSerializer, 'orjson': OrjsonSerializer}
+
+
+class _BatchSizer:
+    """Adapt the number of statuses per bulk request to the load of
+    Elasticsearch: increase it additively while requests are fast, halve it
+    when requests are slow or rejected with HTTP status 429.
+    """
+    def __init__(
+        self, size: int = 500, min_size: int = 50, max_size: int = 5000,
+        target_latency: float = 10, max_backoff: float = 60
+    ) -> None:
+        """Arguments:
+        size -- initial number of statuses per bulk request
+        min_size -- minimum number of statuses per bulk request, also the
+            step by which the size increases
+        max_size -- maximum number of statuses per bulk request
+        target_latency -- seconds a bulk request may take before the size
+            is decreased
+        max_backoff -- maximum seconds to wait after a rejected request
+        """
+        self.backoff = 0
+        self.max_backoff = max_backoff
+        self.max_size = max_size
+        self.min_size = min_size
+        self.size = min(max(size, min_size), max_size)
+        self.target_latency = target_latency
+
+    def update(self, latency: float, rejected: bool) -> None:
+        """Adapt the size to the last bulk request.
 
-from mastodon_search.globals import INDEX_PREFIX
-from mastodon_search.elastic_dsl.mastodon import Status
+        Arguments:
+        latency -- seconds the request took
+        rejected -- whether Elasticsearch rejected statuses with status 429
+        """
+        if (rejected):
+            self.backoff = min(max(2 * self.backoff, 1), self.max_backoff)
+        else:
+            self.backoff = 0
+        if (rejected or latency > self.target_latency):
+            self.size = max(self.size // 2, self.min_size)
+        else:
+            self.size = min(self.size + self.min_size, self.max_size)
+
+
+class _Sink(ABC):
+    """Where _Save sends its batches of bulk actions."""
+    @abstractmethod
+    def send(self, actions: list[dict]) -> int:
+        """Send actions. Return the number of leading actions that were
+        saved or dropped; the others were rejected by an overloaded sink
+        and are sent again.
+        """
 
 
-class _Save(deque[Status]):
+class _ElasticSink(_Sink):
+    """Save actions to Elasticsearch with bulk requests."""
+    def __init__(self, client: Elasticsearch) -> None:
+        self.client = client
+        self.lock = Lock()
+        # Number of statuses refused for other reasons than overload.
+        self.refused = 0
+
+    def send(self, actions: list[dict]) -> int:
+        """Send actions in one bulk request. Statuses that Elasticsearch
+        refuses for other reasons than overload are reported, counted in
+        self.refused and dropped.
+        """
+        refused = 0
+        retry_from = len(actions)
+        for i, (ok, item) in enumerate(streaming_bulk(
+            client=self.client,
+            actions=actions,
+            chunk_size=len(actions),
+            raise_on_error=False,
+            raise_on_exception=False,
+            request_timeout=300
+        )):
+            if (ok):
+                continue
+            info = next(iter(item.values()))
+            if (info.get('status') == 429):
+                retry_from = min(retry_from, i)
+            elif ('exception' in info):
+                # The whole request failed.
+                raise info['exception']
+            else:
+                print(f'Elasticsearch refused status {info.get("_id")}:',
+                    info.get('error'), file=stderr, flush=True)
+                refused += 1
+        if (refused):
+            BULK_ERRORS.labels('refused').inc()
+            with self.lock:
+                self.refused += refused
+        return retry_from
+
+
+class _NullSink(_Sink):
+    """Drop all actions, e. g. to measure crawling without Elasticsearch."""
+    def __init__(self) -> None:
+        self.actions = 0
+
+    def __str__(self) -> str:
+        return 'nowhere'
+
+    def send(self, actions: list[dict]) -> int:
+        self.actions += len(actions)
+        return len(actions)
+
+
+class _JsonLinesSink(_Sink):
+    """Write actions as JSON lines, e. g. to a file or to stdout, to pipe
+    them into other tools.
+    """
+    def __init__(self, file: TextIO) -> None:
+        """Arguments:
+        file -- a text file opened for writing. It is not closed.
+        """
+        self.file = file
+        # Concurrent bulk workers must not interleave their lines.
+        self.lock = Lock()
+
+    def __str__(self) -> str:
+        return self.file.name
+
+    def send(self, actions: list[dict]) -> int:
+        lines = ''.join(dumps_action(action) for action in actions)
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+        return len(actions)
+
+
+class _Save(deque[dict]):
     """Provide methods to store ActivityPub data to Elasticsearch.
     Implement deque to be able to temporarily store statuses.
     """
-    # How many statuses are saved to Elasticsearch at once.
+    # Default number of queued statuses that triggers saving.
     CHUNK_SIZE = 500
-    # Save to Elasticsearch after this number of minutes, even if there are
-    # less statuses than CHUNK_SIZE.
+    # Default size of queued statuses as JSON that triggers saving.
+    FLUSH_BYTES = 16 * 2**20
+    # Save to Elasticsearch after this number of minutes by default, even if
+    # there are less statuses than CHUNK_SIZE.
     MAX_MINUTES_TO_FLUSH = 30
-    INT_MAX = 2**31 - 1
-    INT_MIN = -2**31
-    NAMESPACE_FA = uuid5(NAMESPACE_URL, 'fediverse_analysis')
-    NAMESPACE_MASTODON = uuid5(NAMESPACE_FA, 'Mastodon')
+    # Without spool and max_bytes, measure the size of every this many-th
+    # action as JSON and estimate the others, see: _encode
+    SIZE_SAMPLE = 100
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        spool_dir: str | None = None,
+        max_bytes: int | None = None,
+        spill: bool = False,
+        flush_count: int = CHUNK_SIZE,
+        flush_bytes: int = FLUSH_BYTES,
+        flush_age: float = MAX_MINUTES_TO_FLUSH * 60,
+        batch_sizer: _BatchSizer | None = None,
+        bulk_workers: int = 1,
+        dedup: _DedupCache | None = None,
+        canonical: bool = False,
+        accounts: _AccountCache | None = None,
+        serializer: Serializer | None = None,
+        http_compress: bool = False,
+        archive: _Archive | None = None,
+        indexing: bool = True,
+        checkpoints: _Checkpoints | None = None,
+        rollover: bool = False,
+        sink: _Sink | None = None,
+    ) -> None:
+        """Arguments:
+        spool_dir -- directory for a write-ahead spool of queued statuses.
+            Statuses that were not saved when the process ended are saved on
+            the next start. Default: queue in memory only
+        max_bytes -- maximum size of queued statuses as serialized JSON.
+            When reached, write_status blocks until statuses were saved.
+            Default: unlimited
+        spill -- when the queue is full, write statuses only to the spool
+            instead of blocking, and load them back once there is space.
+            Requires spool_dir
+        flush_count -- save when this many statuses are queued
+        flush_bytes -- save when queued statuses take this many bytes as JSON
+        flush_age -- save when the oldest queued status was queued this many
+            seconds ago
+        batch_sizer -- decides how many statuses are sent per bulk request.
+            Default: a _BatchSizer with default arguments
+        bulk_workers -- maximum number of concurrent bulk requests
+        dedup -- skip statuses that were written before. Its state is saved
+            together with queued statuses. Default: write all statuses
+        canonical -- store every status once for all instances it is crawled
+            from, keyed by its ActivityPub URI, with a sighting per instance.
+            See: transform.status_to_canonical_action
+        accounts -- store accounts in a separate index instead of in every
+            status, writing an account only when this cache finds it changed.
+            See: transform.split_account. Default: store accounts in statuses
+        serializer -- JSON serializer of the Elasticsearch client, e. g.
+            SERIALIZERS['json'](). Default: orjson, which is much faster than
+            the json module
+        http_compress -- gzip requests to Elasticsearch, which saves
+            bandwidth to a remote cluster at the cost of CPU time
+        archive -- also write the raw statuses to this archive
+        indexing -- save statuses to Elasticsearch. Without, statuses are
+            only archived, and init_elastic_connection does not connect.
+        checkpoints -- remember the newest saved status of every instance,
+            so get_last_id need not search all statuses. Default: search
+        rollover -- save statuses to the write alias of the indices that are
+            rolled over by Elasticsearch instead of to monthly indices, see:
+            elastic_dsl.indices.setup_indices
+        sink -- where to send batches of statuses instead of Elasticsearch,
+            e. g. a _NullSink. init_elastic_connection then does not
+            connect. Default: Elasticsearch
+        """
+        if (not indexing and archive is None):
+            raise ValueError('Statuses must be indexed or archived.')
+        if (spill and not spool_dir):
+            raise ValueError('Spilling statuses requires a spool directory.')
+        if (rollover and canonical):
+            raise ValueError('Canonical statuses cannot be rolled over.')
+        self.accounts = accounts
+        self.archive = archive
+        self.batch_sizer = batch_sizer if batch_sizer is not None \
+            else _BatchSizer()
+        self.bulk_executor = ThreadPoolExecutor(
+            max_workers=bulk_workers, thread_name_prefix='bulk')
+        self.bulk_workers = bulk_workers
+        self.canonical = canonical
+        self.checkpoints = checkpoints
+        self.dedup = dedup
         self.elastic = None
+        self.flush_age = flush_age
+        self.flush_bytes = flush_bytes
+        self.flush_count = flush_count
+        self.http_compress = http_compress
+        self.indexing = indexing
         self.lock = Lock()
+        # Mean size of the measured actions as JSON, see: _encode
+        self.mean_size = None
+        # Counts the actions to measure every SIZE_SAMPLE-th.
+        self.measure_counter = count()
         self.flush_thread = Thread(
             target=self.flush, daemon=True)
+        self.flush_wanted = Condition(self.lock)
+        self.max_bytes = max_bytes
+        self.not_full = Condition(self.lock)
+        # Monotonic time the oldest queued status was queued at.
+        self.oldest_at = None
+        self.peak_bytes = 0
+        self.rollover = rollover
+        # Size of the statuses in the queue and of those being saved.
+        self.queued_bytes = 0
+        self.save_lock = Lock()
+        self.saving = 0
+        self.saving_bytes = 0
+        self.serializer = serializer if serializer is not None \
+            else OrjsonSerializer()
+        self.sink = sink
+        # Size of every queued status, in the order of the queue.
+        self.sizes: deque[int] = deque()
+        self.spill = spill
+        # Number of statuses that are only in the spool.
+        self.spilled = 0
+        self.spool = None
+        # Dedup keys of the statuses being written, see: write_status
+        self.writing: set[bytes] = set()
+        if (spool_dir):
+            self.spool = _Spool(spool_dir)
+            self.spilled = self.spool.unread
+            with self.lock:
+                self._refill()
+            if (len(self.spool)):
+                print(f'Replayed {len(self.spool)} unsaved statuses from '
+                    +'spool.', file=self.report_file, flush=True)
 
-    def check_int(self, num: int) -> str:
-        if (num <= self.INT_MAX and num >= self.INT_MIN):
-            return num
-        else:
-            return None
+    @property
+    def report_file(self) -> TextIO:
+        """Return the file to print progress reports to: stderr when the
+        sink writes statuses to stdout, so they can be piped into other
+        tools, otherwise stdout.
+        """
+        if (
+            isinstance(self.sink, _JsonLinesSink)
+            and self.sink.file is sys.stdout
+        ):
+            return stderr
+        return sys.stdout
 
-    def check_str(self, value: object) -> str:
-        return (str(value) if value else None)
+    def _bulk(self, actions: list[dict]) -> int:
+        """Send statuses to the sink in one request and adapt the batch size.
+        Return the number of leading statuses that need not be sent again.
+        """
+        start = monotonic()
+        with stage('bulk'):
+            retry_from = self.sink.send(actions)
+        duration = monotonic() - start
+        BULK_DURATION.observe(duration)
+        if (retry_from < len(actions)):
+            BULK_ERRORS.labels('rejected').inc()
+        self.batch_sizer.update(
+            duration, rejected=retry_from < len(actions))
+        return retry_from
 
-    def flush(self) -> None:
-        """Pop statuses from self and save to Elasticsearch periodically."""
-        flush_minutes = 0
-        while True:
-            sleep(60)
+    def _bulk_batch(self, actions: list[dict]) -> int:
+        """Send a batch of statuses, sending statuses rejected by an
+        overloaded Elasticsearch again until all are saved. Return the
+        number of statuses. Run in self.bulk_executor.
+        """
+        saved = 0
+        while (saved < len(actions)):
+            saved += self._bulk(actions[saved:])
+            if (saved < len(actions)):
+                # Give Elasticsearch time to recover.
+                sleep(self.batch_sizer.backoff)
+        return saved
+
+    def _encode(
+        self, actions: list[dict]
+    ) -> tuple[list[str] | None, list[int]]:
+        """Return the actions as lines of JSON and their sizes. The lines
+        are only needed for the spool, and exact sizes only to limit the
+        queue to max_bytes. Otherwise, the sink's encoding is the only one:
+        every SIZE_SAMPLE-th action is measured, and the others are
+        estimated by the mean size of the measured ones.
+        """
+        if (self.spool is not None or self.max_bytes is not None):
+            lines = [dumps_action(action) for action in actions]
+            return lines, [len(line) for line in lines]
+        sizes = []
+        for action in actions:
             if (
-                len(self) < self.CHUNK_SIZE
-                and flush_minutes < self.MAX_MINUTES_TO_FLUSH
+                next(self.measure_counter) % self.SIZE_SAMPLE == 0
+                or self.mean_size is None
             ):
-                flush_minutes += 1
-                continue
-            flush_minutes = 0
-            if (len(self) == 0):
-                continue
+                size = len(dumps_action(action))
+                # Concurrent updates may get lost, which only delays the
+                # estimate.
+                self.mean_size = size if self.mean_size is None \
+                    else self.mean_size + (size - self.mean_size) / 16
+                sizes.append(size)
+            else:
+                sizes.append(round(self.mean_size))
+        return None, sizes
+
+    def _enqueue(self, action: dict, size: int) -> None:
+        """Append an action to the queue. Call with self.lock held."""
+        self.append(action)
+        self.sizes.append(size)
+        self.queued_bytes += size
+        self.peak_bytes = max(
+            self.peak_bytes, self.queued_bytes + self.saving_bytes)
+        if (self.oldest_at is None):
+            self.oldest_at = monotonic()
+            # Start the flush_age timer.
+            self.flush_wanted.notify()
+        elif (
+            len(self) == self.flush_count
+            or self.queued_bytes >= self.flush_bytes
+        ):
+            self.flush_wanted.notify()
+
+    def _flush_due(self) -> bool:
+        """Return whether a flush trigger is reached. Call with self.lock
+        held.
+        """
+        if (self.spilled or self.is_full()):
+            return True
+        if (not self):
+            return False
+        return (
+            len(self) >= self.flush_count
+            or self.queued_bytes >= self.flush_bytes
+            or monotonic() - self.oldest_at >= self.flush_age
+        )
+
+    def _refill(self) -> None:
+        """Load spilled statuses from the spool into the queue while there
+        is space. Call with self.lock held.
+        """
+        while (self.spilled and not self.is_full()):
+            line = self.spool.read()
+            self._enqueue(loads(line), len(line))
+            self.spilled -= 1
+
+    def _requeue(
+        self, actions: list[dict], sizes: list[int], oldest_at: float
+    ) -> None:
+        """Put statuses that could not be saved back to the front of the
+        queue. Call with self.lock held.
+        """
+        self.extendleft(reversed(actions))
+        self.sizes.extendleft(reversed(sizes))
+        self.queued_bytes += self.saving_bytes
+        self.saving = 0
+        self.saving_bytes = 0
+        self.oldest_at = oldest_at
+
+    def _saved(self, n: int, size: int) -> None:
+        """Mark the `n` oldest statuses being saved as saved. Call with
+        self.lock held.
+        """
+        if (self.spool is not None):
+            self.spool.ack(n)
+        self.saving -= n
+        self.saving_bytes -= size
+        self._refill()
+        self.not_full.notify_all()
+
+    def _take(self) -> tuple[list[dict], list[int]]:
+        """Remove all statuses from the queue to save them. Return them and
+        their sizes. Call with self.lock held.
+        """
+        actions = list(self)
+        sizes = list(self.sizes)
+        self.clear()
+        self.sizes.clear()
+        self.oldest_at = None
+        self.saving = len(actions)
+        self.saving_bytes = self.queued_bytes
+        self.queued_bytes = 0
+        return actions, sizes
+
+    def _to_actions(
+        self, status: dict, crawled_from_instance: str, api_method: str,
+        crawled_at: datetime
+    ) -> list[dict]:
+        """Return the bulk actions saving a status and, with split accounts,
+        its account if it changed. See write_status for the arguments.
+        """
+        to_action = status_to_canonical_action if self.canonical \
+            else status_to_action
+        action = to_action(
+            status, crawled_from_instance, api_method, crawled_at)
+        if (self.rollover):
+            action['_index'] = INDEX_PREFIX
+        actions = [action]
+        if (
+            self.accounts is not None
+            and (account := split_account(
+                action['upsert'] if self.canonical else action['_source']))
+        ):
+            account_action = account_to_action(
+                account, crawled_from_instance, crawled_at)
+            if (self.accounts.update(
+                account_action['_id'],
+                account_action['_source']['content_hash']
+            )):
+                actions.append(account_action)
+        return actions
+
+    def buffer_status(self) -> str:
+        """Return the number and size of queued statuses for reports."""
+        mib = 2**20
+        if (not self.indexing):
+            return f'{self.archive.records} statuses archived'
+        status = (
+            f'{len(self) + self.saving} statuses queued '
+            + f'({(self.queued_bytes + self.saving_bytes) / mib:.1f}'
+        )
+        if (self.max_bytes):
+            status += f'/{self.max_bytes / mib:.1f}'
+        status += f' MiB, peak {self.peak_bytes / mib:.1f} MiB)'
+        if (self.spill):
+            status += f', {self.spilled} spilled to disk'
+        status += f', bulk size {self.batch_sizer.size}'
+        if (self.dedup is not None):
+            status += f', {self.dedup.hit_rate():.1%} duplicates'
+        if (self.accounts is not None):
+            status += (f', {self.accounts.unchanged_rate():.1%} accounts '
+                +'unchanged')
+        if (self.archive is not None):
+            status += f', {self.archive.records} archived'
+        return status
+
+    def fill_level(self) -> float:
+        """Return the fraction of max_bytes in use, or 0 if unlimited."""
+        if (not self.max_bytes):
+            return 0
+        return (self.queued_bytes + self.saving_bytes) / self.max_bytes
+
+    def is_blocking(self) -> bool:
+        """Return whether write_status blocks because the queue is full."""
+        return not self.spill and self.is_full()
+
+    def is_full(self) -> bool:
+        return (
+            self.max_bytes is not None
+            and self.queued_bytes + self.saving_bytes >= self.max_bytes
+        )
+
+    def flush(self) -> None:
+        """Save queued statuses to Elasticsearch whenever a flush trigger is
+        reached, see: __init__. Run as thread.
+        """
+        while True:
             with self.lock:
-                deque(
-                    streaming_bulk(
-                        client=self.elastic,
-                        actions=self.generate_statuses(),
-                        request_timeout=300
-                    ),
-                    maxlen=0
-                )
-
-    def generate_statuses(self) -> Iterator[Status]:
-        while (self):
-            yield self.popleft()
+                while (not self._flush_due()):
+                    timeout = None if self.oldest_at is None else max(
+                        self.oldest_at + self.flush_age - monotonic(), 0)
+                    self.flush_wanted.wait(timeout)
+            try:
+                with stage('flush'):
+                    self.save_queued()
+            except Exception as e:
+                print('Saving statuses to Elasticsearch failed:', e,
+                    file=stderr, flush=True)
+                # Do not retry immediately while the queue is full.
+                sleep(60)
+
+    def _get_last_canonical_id(self, instance: str) -> str | None:
+        """Return the local id of the latest sighting from a given instance,
+        see: get_last_id
+        """
+        sighting = Q('term', sightings__instance=instance)
+        try:
+            status = Index(f'{CANONICAL_INDEX_PREFIX}*')\
+                    .search()\
+                    .query('nested', path='sightings', query=sighting)\
+                    .sort({'sightings.crawled_at': {
+                        'order': 'desc',
+                        'nested': {
+                            'path': 'sightings',
+                            'filter': sighting.to_dict()
+                        },
+                    }})\
+                    .source(['sightings'])\
+                    .params(size=1)\
+                    .execute()\
+                    .hits
+        except NotFoundError:
+            return None
+        if (not status):
+            return None
+        sightings = [
+            s for s in status[0]['sightings'] if s['instance'] == instance]
+        return max(sightings, key=lambda s: s['crawled_at'])['id']
 
     def get_last_id(self, instance: str) -> str | None:
         """Return latest id of all statuses that were crawled from a given
-        instance, or None if there is no status yet. Use wildcard to search
-        every month's index and also a possible global index.
+        instance, or None if there is no status yet. Use the instance's
+        checkpoint if there is one. Otherwise, use wildcard to search every
+        month's index and also a possible global index.
         """
+        if (not self.indexing):
+            return self.archive.get_last_id(instance)
+        if (
+            self.checkpoints is not None
+            and (last_id := self.checkpoints.get_last_id(instance))
+        ):
+            return last_id
+        if (self.elastic is None and self.sink is not None):
+            # Statuses are sent to another sink, which cannot be searched.
+            return None
+        if (self.canonical):
+            return self._get_last_canonical_id(instance)
         try:
             status = Index(f'{INDEX_PREFIX}*')\
                     .search()\
@@ -98,22 +616,43 @@ class _Save(deque[Status]):
         password: str,
         port: int,
         username: str,
+        background: bool = True,
     ) -> None:
         """Set and check Elasticsearch connection.
 
         Arguments:
         see mastodon_search.cli: stream_to_es
+        background -- start the thread that saves queued statuses when a
+            flush trigger is reached. Without, call save_queued.
         """
+        watch_buffer(
+            lambda: len(self) + self.saving + self.spilled,
+            lambda: self.queued_bytes + self.saving_bytes)
+        if (not self.indexing):
+            print('Not saving to Elasticsearch, only archiving statuses.',
+                flush=True)
+            return
+        if (self.sink is not None):
+            print('Not saving to Elasticsearch, sending statuses to '
+                +f'{self.sink}.', file=self.report_file, flush=True)
+            if (background):
+                self.flush_thread.start()
+            return
         elastic_host = host + ':' + str(port)
         try:
             self.elastic = connections.create_connection(
                 hosts=elastic_host,
                 basic_auth=(username, password),
+                # Keep a connection for every concurrent bulk request.
+                connections_per_node=max(self.bulk_workers, 10),
+                http_compress=self.http_compress,
+                serializer=self.serializer,
                 timeout=60
             )
         except ValueError:
             print('URL must include scheme and host, e. g. https://localhost')
             exit(1)
+        self.sink = _ElasticSink(self.elastic)
 
         retries = 0
         index = Index(datetime.now().strftime(f'{INDEX_PREFIX}_%Y_%m'))
@@ -136,10 +675,105 @@ class _Save(deque[Status]):
                 break
             else:
                 break
-        self.flush_thread.start()
+        if (self.canonical):
+            init_template(
+                self.elastic, CANONICAL_INDEX_PREFIX,
+                f'{CANONICAL_INDEX_PREFIX}_*', CanonicalStatus)
+        if (self.accounts is not None):
+            init_template(
+                self.elastic, ACCOUNT_INDEX, ACCOUNT_INDEX, AccountSnapshot)
+        if (
+            self.rollover
+            and not self.elastic.indices.exists_alias(name=INDEX_PREFIX)
+        ):
+            print(f'There is no alias {INDEX_PREFIX} to roll over, run '
+                +'setup-indices with --rollover first.',
+                file=stderr, flush=True)
+            exit(1)
+        if (background):
+            self.flush_thread.start()
+
+    def save_queued(self) -> None:
+        """Save all queued statuses to the sink now, in batches sized by
+        self.batch_sizer and sent by up to self.bulk_workers concurrent bulk
+        requests. The queue is not locked while saving, so statuses can be
+        written meanwhile. Archived statuses are handed to the OS.
+        """
+        if (self.archive is not None):
+            self.archive.flush()
+        if (len(self) == 0 and not self.spilled):
+            return
+        with self.save_lock:
+            with self.lock:
+                oldest_at = self.oldest_at
+                actions, sizes = self._take()
+                # Keys are added when statuses are queued, so the snapshot
+                # contains the statuses being saved, and those spooled.
+                dedup_snapshot = self.dedup.snapshot() \
+                    if (self.dedup is not None and self.dedup.save_due()) \
+                    else None
+            # Start index of every batch being sent, by its future.
+            pending: dict[Future, int] = {}
+            # End index of every saved batch, by its start index.
+            done: dict[int, int] = {}
+            error = None
+            saved = 0
+            start = 0
+            while (start < len(actions) or pending):
+                while (
+                    error is None
+                    and start < len(actions)
+                    and len(pending) < self.bulk_workers
+                ):
+                    end = start + self.batch_sizer.size
+                    pending[self.bulk_executor.submit(
+                        self._bulk_batch, actions[start:end])] = start
+                    start = min(end, len(actions))
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch_start = pending.pop(future)
+                    if (e := future.exception()):
+                        BULK_ERRORS.labels('failed').inc()
+                        # Stop sending, but wait for the pending batches.
+                        error = error or e
+                        start = len(actions)
+                    else:
+                        done[batch_start] = batch_start + future.result()
+                # Batches finish in any order, but the spool must be
+                # acknowledged in the order of the queue.
+                while (saved in done):
+                    end = done.pop(saved)
+                    with self.lock:
+                        self._saved(end - saved, sum(sizes[saved:end]))
+                    if (self.checkpoints is not None):
+                        try:
+                            self.checkpoints.add(actions[saved:end])
+                        except Exception as e:
+                            # The statuses are saved, so go on. Crawlers
+                            # resume from older checkpoints at worst.
+                            print('Adding checkpoints failed:', e,
+                                file=stderr, flush=True)
+                    saved = end
+            if (self.checkpoints is not None):
+                try:
+                    self.checkpoints.save()
+                except Exception as e:
+                    # They are saved with the next statuses.
+                    print('Saving checkpoints failed:', e,
+                        file=stderr, flush=True)
+            if (error is not None):
+                with self.lock:
+                    # Keep the statuses to try again later. Batches saved
+                    # after the failed one are sent again, which overwrites
+                    # their documents.
+                    self._requeue(actions[saved:], sizes[saved:], oldest_at)
+                raise error
+            if (dedup_snapshot is not None):
+                self.dedup.write(dedup_snapshot)
 
     def write_status(
-        self, status: dict, crawled_from_instance: str, api_method: str
+        self, status: dict, crawled_from_instance: str, api_method: str,
+        crawled_at: datetime | None = None
     ) -> None:
         """Write an ActivityPub status to an Elasticsearch instance.
         Arguments:
@@ -147,155 +781,64 @@ class _Save(deque[Status]):
         crawled_from_instance -- Which fediverse instance this status was
             crawled from
         api_method -- The API method/path, e. g. 'api/v1/streaming/public'
+        crawled_at -- when the status was crawled. Default: now
         """
-        # Put status data into the ES DSL document.
-        time = datetime.now(tz=UTC)
-        status_uuid = uuid5(
-            self.NAMESPACE_MASTODON,
-            crawled_from_instance + '/' + str(status.get('id'))
-        )
-        acc = status.get('account')
-        if acc.get('noindex') is True:
-            dsl_status = Status(
-                meta={
-                    'id': status_uuid,
-                    'index': time.strftime(f'{INDEX_PREFIX}_%Y_%m')
-                },
-                crawled_at=time
-            )
-            dsl_status.set_account(
-                noindex=acc.get('noindex')
-            )
-        else:
-            if (acc.get('acct') == acc.get('username')):
-                instance = crawled_from_instance
-                is_local = True
-            else:
-                instance = acc.get('acct').split('@', maxsplit=1)[1]
-                is_local = False
-            dsl_status = Status(
-                meta={
-                    'id': status_uuid,
-                    'index': time.strftime(f'{INDEX_PREFIX}_%Y_%m')
-                },
-                api_url=('https://' + crawled_from_instance
-                           + '/api/v1/statuses/' + str(status.get('id'))),
-                content=status.get('content'),
-                crawled_at=time,
-                crawled_from_api_url=(
-                    'https://' + crawled_from_instance + '/' + api_method),
-                crawled_from_instance=crawled_from_instance,
-                created_at=status.get('created_at'),
-                edited_at=status.get('edited_at'),
-                id=str(status.get('id')),
-                in_reply_to_id=self.check_str(status.get('in_reply_to_id')),
-                in_reply_to_account_id=self.check_str(
-                    status.get('in_reply_to_account_id')),
-                instance=instance,
-                is_local=is_local,
-                language=status.get('language'),
-                sensitive=status.get('sensitive'),
-                spoiler_text=self.check_str(status.get('spoiler_text')),
-                uri=status.get('uri'),
-                url=status.get('url'),
-                visibility=status.get('visibility')
-            )
-            dsl_status.set_account(
-                acct=acc.get('acct'),
-                avatar=acc.get('avatar'),
-                avatar_static=acc.get('avatar_static'),
-                bot=acc.get('bot'),
-                created_at=acc.get('created_at'),
-                discoverable=acc.get('discoverable'),
-                display_name=acc.get('display_name'),
-                emojis=acc.get('emojis'),
-                fields=acc.get('fields'),
-                followers_count=self.check_int(acc.get('followers_count')),
-                following_count=self.check_int(acc.get('following_count')),
-                group=acc.get('group'),
-                handle=(acc.get('username') + '@' + instance),
-                header=acc.get('header'),
-                header_static=acc.get('header_static'),
-                id=str(acc.get('id')),
-                last_status_at=acc.get('last_status_at'),
-                locked=acc.get('locked'),
-                noindex=acc.get('noindex'),
-                note=self.check_str(acc.get('note')),
-                statuses_count=self.check_int(acc.get('statuses_count')),
-                uri=acc.get('uri'),
-                url=acc.get('url'),
-                username=acc.get('username')
-            )
-            if (app := status.get('application')):
-                dsl_status.set_application(
-                    name=app.get('name'),
-                    website=app.get('website'))
-            if (card := status.get('card')):
-                dsl_status.set_card(
-                    author_name=self.check_str(card.get('author_name')),
-                    author_url=self.check_str(card.get('author_url')),
-                    blurhash=self.check_str(card.get('blurhash')),
-                    description=self.check_str(card.get('description')),
-                    embed_url=self.check_str(card.get('embed_url')),
-                    height=card.get('height'),
-                    image=card.get('image'),
-                    image_description=self.check_str(
-                        card.get('image_description')),
-                    language=self.check_str(card.get('language')),
-                    provider_name=self.check_str(card.get('provider_name')),
-                    provider_url=self.check_str(card.get('provider_url')),
-                    published_at=card.get('published_at'),
-                    title=self.check_str(card.get('title')),
-                    type=card.get('type'),
-                    url=self.check_str(card.get('url')),
-                    width=card.get('width')
-                )
-            if (poll := status.get('poll')):
-                dsl_status.set_poll(
-                    expires_at=poll.get('expires_at'),
-                    expired=poll.get('expired'),
-                    id=str(poll.get('id')),
-                    multiple=poll.get('multiple'),
-                    options=poll.get('options'),
-                    voters_count=poll.get('voters_count'),
-                    votes_count=poll.get('votes_count')
-                )
-            if (reblog := status.get('reblog')):
-                dsl_status.set_reblog(
-                    id=str(reblog.get('id')),
-                    url=reblog.get('url')
-                )
-            for emoji in status.get('emojis'):
-                dsl_status.add_emoji(
-                    shortcode=emoji.get('shortcode'),
-                    static_url=emoji.get('static_url'),
-                    url=emoji.get('url'),
-                    visible_in_picker=emoji.get('visible_in_picker')
-                )
-            for ma in status.get('media_attachments'):
-                dsl_status.add_media_attachment(
-                    blurhash=self.check_str(ma.get('blurhash')),
-                    description=self.check_str(ma.get('description')),
-                    id=str(ma.get('id')),
-                    raw_meta=ma.get('meta'),
-                    preview_url=self.check_str(ma.get('preview_url')),
-                    remote_url=self.check_str(ma.get('remote_url')),
-                    type=ma.get('type'),
-                    url=ma.get('url')
-                )
-            for mention in status.get('mentions'):
-                dsl_status.add_mention(
-                    acct=mention.get('acct'),
-                    id=str(mention.get('id')),
-                    url=mention.get('url'),
-                    username=mention.get('username')
-                )
-            for tag in status.get('tags'):
-                dsl_status.add_tag(
-                    name=tag.get('name'),
-                    url=tag.get('url')
-                )
-
-        # Save status.
-        with self.lock:
-            self.append(dsl_status.to_dict(include_meta=True))
+        crawled_at = crawled_at or datetime.now(tz=UTC)
+        STATUSES.labels(crawled_from_instance, api_method).inc()
+        if (isinstance(created_at := status.get('created_at'), datetime)):
+            LAG.labels(crawled_from_instance).set(
+                (crawled_at - created_at).total_seconds())
+        key = None
+        if (self.dedup is not None):
+            with stage('dedup'):
+                key = status_key(status, crawled_from_instance)
+                # Check and claim the key at once, or the stream and the gap
+                # filler may both write a status they receive at the same
+                # time. It is added to self.dedup only when the status is
+                # queued, see: save_queued
+                with self.lock:
+                    if (key in self.writing or key in self.dedup):
+                        return
+                    self.writing.add(key)
+        try:
+            if (self.archive is not None):
+                with stage('archive'):
+                    self.archive.write(
+                        status, crawled_from_instance, api_method, crawled_at)
+            if (not self.indexing):
+                if (key is not None):
+                    with self.lock:
+                        self.dedup.add(key)
+                        self.writing.discard(key)
+                return
+            with stage('transform'):
+                actions = self._to_actions(
+                    status, crawled_from_instance, api_method, crawled_at)
+            with stage('encode'):
+                lines, sizes = self._encode(actions)
+        except BaseException:
+            if (key is not None):
+                with self.lock:
+                    self.writing.discard(key)
+            raise
+        with stage('enqueue'), self.lock:
+            # Block crawling until there is space in the queue again.
+            while (self.is_blocking()):
+                self.flush_wanted.notify()
+                self.not_full.wait()
+            if (key is not None):
+                self.dedup.add(key)
+                self.writing.discard(key)
+            # Once per status, so that the account action of a status that
+            # filled the queue is queued, too, unless spilling.
+            spill = self.spill and (self.spilled or self.is_full())
+            for i, (action, size) in enumerate(zip(actions, sizes)):
+                if (self.spool is not None):
+                    self.spool.append(lines[i], unread=spill)
+                if (spill):
+                    # Keep the action only in the spool for now, see:
+                    # _refill
+                    self.spilled += 1
+                    self.flush_wanted.notify()
+                else:
+                    self._enqueue(action, size)
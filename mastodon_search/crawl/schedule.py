@@ -0,0 +1,184 @@
+from heapq import heappop, heappush
+from itertools import count
+from typing import TextIO
+
+from mastodon_search.crawl.crawl import adapt_wait_time
+from mastodon_search.crawl.snowflake import status_timestamp
+
+
+class PollScheduler:
+    """Keep a priority queue of instances keyed by the time their next poll
+    is due. The wait time between two polls of an instance is adapted to
+    the number of statuses in the last response, see
+    mastodon_search.crawl.crawl: adapt_wait_time.
+    """
+    def __init__(self, initial_wait: float = 60, max_wait: float = 3600):
+        """Arguments:
+        initial_wait -- wait time in seconds between the first two requests
+        max_wait -- maximum wait time in seconds between two requests
+        """
+        self.counter = count()
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        self.queue: list[tuple[float, int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def next_due(self) -> float | None:
+        """Return the time the next poll is due, or None if the queue is
+        empty.
+        """
+        return self.queue[0][0] if self.queue else None
+
+    def pop(self) -> str:
+        """Remove and return the instance that is due next."""
+        return heappop(self.queue)[2]
+
+    def push(self, instance: str, due: float) -> None:
+        """Schedule polling an instance at the Unix timestamp `due`."""
+        # The counter keeps instances with the same due time in FIFO order.
+        heappush(self.queue, (due, next(self.counter), instance))
+
+    def wait_time(
+        self, instance: str, wait_time: float, statuses: list[dict],
+        now: float
+    ) -> float:
+        """Return the wait time in seconds until the next poll of an
+        instance.
+
+        Arguments:
+        instance -- the polled instance
+        wait_time -- the wait time before this poll
+        statuses -- the statuses of this poll
+        now -- the Unix timestamp of this poll
+        """
+        return adapt_wait_time(wait_time, len(statuses), self.max_wait)
+
+
+class _RateEstimate:
+    """Gamma distributed estimate of the rate of a Poisson process, i. e. of
+    new statuses per second on an instance.
+    """
+    def __init__(self, rate: float, weight: float) -> None:
+        """Arguments:
+        rate -- prior rate in statuses per second
+        weight -- how many seconds of observation the prior is worth
+        """
+        self.alpha = rate * weight
+        self.beta = weight
+        self.last_poll = None
+
+    @property
+    def rate(self) -> float:
+        return self.alpha / self.beta
+
+    def observe(
+        self, num_statuses: float, seconds: float, half_life: float
+    ) -> None:
+        """Add an observation, forgetting older ones exponentially so the
+        estimate follows daily activity cycles.
+        """
+        seconds = max(seconds, 1)
+        decay = 0.5 ** (seconds / half_life)
+        self.alpha = self.alpha * decay + num_statuses
+        self.beta = self.beta * decay + seconds
+
+
+class PredictivePollScheduler(PollScheduler):
+    """Schedule polls by each instance's estimated posting rate, so that a
+    poll is expected to return one full page of statuses. The rate is
+    estimated from the timestamps in snowflake IDs (or `created_at`) and
+    from the time between polls, starting from an optional prior.
+    """
+    def __init__(
+        self,
+        priors: dict[str, float] | None = None,
+        page_size: int = 40,
+        min_wait: float = 1,
+        max_wait: float = 3600,
+        half_life: float = 6 * 3600,
+        prior_weight: float = 600,
+        default_rate: float = 1 / 600,
+    ) -> None:
+        """Arguments:
+        priors -- prior statuses per second by instance, see: load_priors
+        page_size -- number of statuses the API returns per request
+        min_wait -- minimum wait time in seconds between two requests
+        max_wait -- maximum wait time in seconds between two requests
+        half_life -- seconds after which an observation counts half
+        prior_weight -- how many seconds of observation a prior is worth
+        default_rate -- prior statuses per second of instances without prior
+        """
+        super().__init__(initial_wait=min_wait, max_wait=max_wait)
+        self.default_rate = default_rate
+        self.estimates: dict[str, _RateEstimate] = {}
+        self.half_life = half_life
+        self.min_wait = min_wait
+        self.page_size = page_size
+        self.prior_weight = prior_weight
+        self.priors = priors or {}
+
+    def rate(self, instance: str) -> float:
+        """Return the estimated statuses per second of an instance."""
+        return self._estimate(instance).rate
+
+    def wait_time(
+        self, instance: str, wait_time: float, statuses: list[dict],
+        now: float
+    ) -> float:
+        estimate = self._estimate(instance)
+        timestamps = [
+            t for t in map(status_timestamp, statuses) if t is not None
+        ]
+        if (len(statuses) >= self.page_size):
+            # The page is truncated, only the span of the page is known.
+            if (len(timestamps) >= 2):
+                estimate.observe(
+                    len(timestamps) - 1,
+                    max(timestamps) - min(timestamps),
+                    self.half_life
+                )
+        elif (estimate.last_poll is not None):
+            # All statuses since the last poll were returned.
+            estimate.observe(
+                len(statuses), now - estimate.last_poll, self.half_life)
+        elif (timestamps):
+            estimate.observe(
+                len(timestamps), now - min(timestamps), self.half_life)
+        estimate.last_poll = now
+        # Catch up immediately if there are more statuses.
+        if (len(statuses) >= self.page_size):
+            return self.min_wait
+        if (estimate.rate <= 0):
+            return self.max_wait
+        return min(max(self.page_size / estimate.rate, self.min_wait),
+            self.max_wait)
+
+    def _estimate(self, instance: str) -> _RateEstimate:
+        if (instance not in self.estimates):
+            self.estimates[instance] = _RateEstimate(
+                self.priors.get(instance, self.default_rate),
+                self.prior_weight
+            )
+        return self.estimates[instance]
+
+
+def load_priors(file: TextIO) -> dict[str, float]:
+    """Read mean weekly statuses per instance and return them as statuses
+    per second, for use as priors of PredictivePollScheduler.
+
+    Arguments:
+    file -- either the output of the `obtain-instance-data` command or the
+        CSV file written by `choose-instances`
+    """
+    if (file.name.endswith('.csv')):
+        from pandas import read_csv
+        weekly = read_csv(file, index_col=0)['mean_weekly_statuses']
+    else:
+        from mastodon_search.instance_data.analyze import Analyzer
+        weekly = Analyzer(file).df['mean_weekly_statuses']
+    return {
+        instance: max(float(statuses), 0) / (7 * 24 * 3600)
+        for instance, statuses in weekly.items()
+    }
@@ -0,0 +1,57 @@
+"""Convert between Mastodon status IDs and timestamps.
+Since Mastodon 2.0, status IDs are "snowflakes": the upper 48 bits are the
+milliseconds since the Unix epoch, the lower 16 bits make IDs unique.
+See: https://github.com/mastodon/mastodon/blob/main/lib/mastodon/snowflake.rb
+"""
+
+from datetime import datetime, UTC
+
+SEQUENCE_BITS = 16
+# Older Mastodon versions and other fediverse software use sequential IDs.
+# Treat IDs that would be older than this as non-snowflakes.
+MIN_TIMESTAMP_MS = int(datetime(2016, 1, 1, tzinfo=UTC).timestamp() * 1000)
+
+
+def datetime_to_id(dt: datetime) -> str:
+    """Return the smallest snowflake ID of statuses created at `dt`."""
+    return str(int(dt.timestamp() * 1000) << SEQUENCE_BITS)
+
+
+def id_key(id: str) -> tuple[int, str]:
+    """Return a key that orders numeric IDs of different length
+    numerically, e. g. to compare status IDs of an instance.
+    """
+    return len(id), id
+
+
+def id_to_timestamp(id: str | int) -> float | None:
+    """Return the Unix timestamp in seconds encoded in a snowflake ID, or
+    None if the ID is not a snowflake.
+    """
+    try:
+        ms = int(id) >> SEQUENCE_BITS
+    except (TypeError, ValueError):
+        return None
+    if (ms < MIN_TIMESTAMP_MS):
+        return None
+    return ms / 1000
+
+
+def id_to_datetime(id: str | int) -> datetime | None:
+    """Return the datetime encoded in a snowflake ID, or None if the ID is
+    not a snowflake.
+    """
+    if ((timestamp := id_to_timestamp(id)) is None):
+        return None
+    return datetime.fromtimestamp(timestamp, tz=UTC)
+
+
+def status_timestamp(status: dict) -> float | None:
+    """Return the Unix timestamp of a status from its snowflake ID, or from
+    `created_at` if the ID is not a snowflake.
+    """
+    if ((timestamp := id_to_timestamp(status.get('id'))) is not None):
+        return timestamp
+    if (isinstance(created_at := status.get('created_at'), datetime)):
+        return created_at.timestamp()
+    return None
@@ -0,0 +1,201 @@
+from collections import deque
+from collections.abc import Iterator
+from datetime import date
+from json import dumps, loads
+from os import fsync, makedirs, path, remove, replace, scandir
+from threading import Lock
+from uuid import UUID
+
+import orjson
+
+
+def _json_default(obj: object) -> str:
+    if (isinstance(obj, date)):
+        return obj.isoformat()
+    if (isinstance(obj, UUID)):
+        return str(obj)
+    raise TypeError(f'Cannot serialize {type(obj).__name__} to JSON.')
+
+
+def dumps_action(action: dict) -> str:
+    """Serialize a bulk action to a line of JSON with orjson, which is much
+    faster than the json module.
+    """
+    return orjson.dumps(
+        action, default=_json_default, option=orjson.OPT_APPEND_NEWLINE
+    ).decode()
+
+
+class _Spool:
+    """Append-only write-ahead log of bulk actions on local disk. Records are
+    written as JSON lines to numbered segment files that are rotated by size.
+    Saved records are acknowledged in the order they were appended, segments
+    with only acknowledged records are deleted. Unacknowledged records are
+    replayed on startup. Records that are not held in memory are unread and
+    read back once, in order, from a cursor.
+    """
+    ACK_FILE = 'ack.json'
+    SUFFIX = '.jsonl'
+
+    def __init__(
+        self, directory: str, segment_size: int = 64 * 2**20,
+        sync: bool = False
+    ) -> None:
+        """Arguments:
+        directory -- where to store the segment files
+        segment_size -- bytes after which a new segment is started
+        sync -- fsync every record, so records survive a crash of the host,
+            not only of the process
+        """
+        self.directory = directory
+        self.lock = Lock()
+        self.segment_size = segment_size
+        self.sync = sync
+        # [number, records] of every segment, oldest first
+        self.segments: deque[list[int]] = deque()
+        # Acknowledged records of the oldest segment
+        self.acked = 0
+        # Segment and byte offset of the oldest unread record
+        self.cursor = (0, 0)
+        # Segment file being read and its number, see: read
+        self.reader = None
+        self.reader_segment = None
+        makedirs(directory, exist_ok=True)
+        self._load()
+        # Unacknowledged records of the last run are not in memory.
+        self.unread = len(self)
+        if (self.segments):
+            self.cursor = (self.segments[0][0], self._offset(
+                self.segments[0][0], self.acked))
+        # Always append to a new segment, the last one may end with a
+        # partially written record.
+        self._rotate()
+
+    def __len__(self) -> int:
+        """Return the number of unacknowledged records."""
+        return sum(records for _, records in self.segments) - self.acked
+
+    def _offset(self, segment: int, records: int) -> int:
+        """Return the byte offset of a record in a segment."""
+        offset = 0
+        with open(self._path(segment), mode='rb') as f:
+            for _ in range(records):
+                offset += len(f.readline())
+        return offset
+
+    def _path(self, segment: int) -> str:
+        return path.join(self.directory, f'{segment:012d}{self.SUFFIX}')
+
+    def _load(self) -> None:
+        """Find all segments and count their records."""
+        ack = {'segment': -1, 'records': 0}
+        try:
+            with open(path.join(self.directory, self.ACK_FILE)) as f:
+                ack = loads(f.read())
+        except FileNotFoundError:
+            pass
+        numbers = sorted(
+            int(entry.name.removesuffix(self.SUFFIX))
+            for entry in scandir(self.directory)
+            if entry.name.endswith(self.SUFFIX)
+        )
+        for number in numbers:
+            if (number < ack['segment']):
+                # Fully acknowledged, but not deleted yet.
+                remove(self._path(number))
+                continue
+            with open(self._path(number), mode='rb') as f:
+                # Only count complete lines.
+                records = sum(chunk.count(b'\n') for chunk in f)
+            self.segments.append([number, records])
+        if (self.segments and self.segments[0][0] == ack['segment']):
+            self.acked = ack['records']
+
+    def _rotate(self) -> None:
+        if (hasattr(self, 'file')):
+            self.file.close()
+        number = self.segments[-1][0] + 1 if self.segments else 0
+        self.segments.append([number, 0])
+        self.file = open(self._path(number), mode='a', encoding='utf-8')
+        self.size = 0
+
+    def _save_ack(self) -> None:
+        ack_file = path.join(self.directory, self.ACK_FILE)
+        with open(ack_file + '.tmp', mode='w') as f:
+            f.write(dumps({
+                'segment': self.segments[0][0],
+                'records': self.acked,
+            }))
+        replace(ack_file + '.tmp', ack_file)
+
+    def ack(self, n: int) -> None:
+        """Acknowledge the `n` oldest unacknowledged records as saved."""
+        with self.lock:
+            self.acked += n
+            # Delete fully acknowledged segments, except the current one.
+            while (
+                len(self.segments) > 1
+                and self.acked >= self.segments[0][1]
+            ):
+                number, records = self.segments.popleft()
+                self.acked -= records
+                remove(self._path(number))
+            self._save_ack()
+
+    def append(self, line: str, unread: bool = False) -> None:
+        """Append a bulk action serialized by dumps_action.
+
+        Arguments:
+        line -- the action as line of JSON
+        unread -- the action is not held in memory, but read back later,
+            see: read. Only followed by unread records until all are read.
+        """
+        with self.lock:
+            if (unread):
+                if (not self.unread):
+                    self.cursor = (self.segments[-1][0], self.file.tell())
+                self.unread += 1
+            self.file.write(line)
+            # Hand the record to the OS, so it survives if the process dies.
+            self.file.flush()
+            if (self.sync):
+                fsync(self.file.fileno())
+            self.segments[-1][1] += 1
+            self.size += len(line)
+            if (self.size >= self.segment_size):
+                self._rotate()
+
+    def read(self) -> str:
+        """Return the oldest unread record and move the cursor past it.
+        There must be one.
+        """
+        with self.lock:
+            number, offset = self.cursor
+            while True:
+                if (self.reader_segment != number):
+                    if (self.reader is not None):
+                        self.reader.close()
+                    self.reader = open(self._path(number), mode='rb')
+                    self.reader.seek(offset)
+                    self.reader_segment = number
+                line = self.reader.readline()
+                if (line.endswith(b'\n')):
+                    break
+                # The end of the segment, or a partially written record
+                # before a crash.
+                number, offset = number + 1, 0
+            self.cursor = (number, offset + len(line))
+            self.unread -= 1
+            return line.decode()
+
+    def replay(self) -> Iterator[str]:
+        """Yield all unacknowledged records as lines of JSON, oldest first."""
+        skip = self.acked
+        for number, records in list(self.segments):
+            with open(self._path(number), encoding='utf-8') as f:
+                for i, line in enumerate(f):
+                    if (i >= records):
+                        break
+                    if (i >= skip):
+                        yield line
+            skip = 0
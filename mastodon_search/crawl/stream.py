@@ -1,73 +1,105 @@
 from mastodon import (
     Mastodon, MastodonNetworkError, MastodonVersionError, StreamListener
 )
+from collections import deque
 from sys import stderr
-from threading import Thread
+from threading import Event, Lock, Thread
 from time import sleep
 
 from mastodon_search.crawl.crawl import Crawler
+from mastodon_search.crawl.metrics import REPORTER, STREAM_RECONNECTS
+from mastodon_search.crawl.profiling import stage
 from mastodon_search.crawl.save import _Save
 
 
+class _Connection:
+    """A stream connection, shared with the gap filler fetching the
+    statuses missed before it.
+    """
+    def __init__(self) -> None:
+        # ID of the first status streamed.
+        self.first_id = None
+        # Set when the stream is connected or has ended.
+        self.ready = Event()
+
+
 class Streamer:
     """Leverage Mastodon.py to retrieve data from a Mastodon instance via the
     streaming API.
     """
-    def __init__(self, instance: str) -> None:
+    def __init__(
+        self, instance: str, save: _Save = None, quiet: bool = False
+    ) -> None:
         """Arguments:
         instance -- an instance's base URI, e. g.: 'mastodon.social'.
+        save -- a _Save to write statuses to. Pass one to share it between
+            multiple streamers, otherwise a new one is created.
+        quiet -- do not print progress to stdout, e. g. when many instances
+            are crawled in one process
         """
+        # The current stream connection.
+        self.connection = _Connection()
         # This indicates if the stream ran in *this* cycle.
         self.did_stream_work = False
+        # Seconds the gap filler waits for the stream to connect.
+        self.gap_timeout = 60
         self.instance = instance
         self.is_running = True
         self.last_seen_created_at = None
         self.last_seen_id = None
+        self.lock = Lock()
         self.mastodon = Mastodon(api_base_url=self.instance)
         # Give up streaming after this number of consecutive failed attempts.
         self.max_retries = 5
-        self.save = _Save()
-        self.timer = Thread(target=self._print_timer, daemon=True)
-        self.crawler = Crawler(self.instance, self.save)
+        self.quiet = quiet
+        self.recent_ids = _RecentIds()
+        self.save = save if save is not None else _Save()
+        # What this streamer is currently doing, for status reports.
+        self.state = 'starting'
+        self.crawler = Crawler(self.instance, self.save, quiet)
 
-    def _intermediate_crawl(self) -> None:
-        """Fetch statuses, starting from the last seen one, until we are up
-        to date.
+    def _fill_gap(self, min_id: str | None, connection: _Connection) -> None:
+        """Fetch the statuses between `min_id` and the first status of a
+        (re)connected stream while streaming. Run as thread.
         """
-        self.is_running = False
-        if (self.last_seen_id):
-            print('Fetching missed statuses.', flush=True)
+        if (self.quiet):
+            pass
+        elif (min_id):
+            print('Fetching missed statuses.', file=self.save.report_file,
+                flush=True)
         else:
             print(
                 'Could not find any previous statuses. Crawling some.',
-                flush=True
+                file=self.save.report_file, flush=True
             )
-        self.last_seen_id = self.crawler._crawl_updates(
-            initial_wait=10,
-            min_id=self.last_seen_id,
-            return_on_up_to_date=True
-        )
-        self.is_running = True
-        if not self.timer.is_alive():
-            self.timer = Thread(target=self._print_timer, daemon=True)
-            self.timer.start()
-
-    def _print_timer(self) -> None:
-        """Print `created_at` value of the last crawled status periodically.
-        Run as thread to not block anything else.
-        """
-        sleep(60)
+        waited = False
         while True:
-            if (not self.is_running):
+            max_id = connection.first_id
+            with stage('fetch'):
+                statuses = self.crawler.mastodon.timeline(
+                    timeline='public', limit=40, min_id=min_id,
+                    max_id=max_id)
+            for status in statuses:
+                self._write_status(status, 'api/v1/timelines/public')
+            if (statuses):
+                min_id = statuses[0].get('id')
+                with self.lock:
+                    # Until the stream delivers, the gap is the newest state.
+                    if (
+                        self.connection is connection
+                        and connection.first_id is None
+                    ):
+                        self.last_seen_id = min_id
+                        self.last_seen_created_at = \
+                            statuses[0].get('created_at')
+            if (len(statuses) == 40):
+                continue
+            if (max_id is not None or waited):
                 return
-            if (self.last_seen_created_at):
-                print(
-                    self.last_seen_created_at.isoformat(timespec='seconds'),
-                    flush=True
-                )
-            else:
-                print('None', flush=True)
-            sleep(600)
+            # Up to date, but statuses posted before the stream connected are
+            # not streamed. Fetch once more when it is connected.
+            connection.ready.wait(self.gap_timeout)
+            waited = True
 
     def stream_updates_to_elastic(
         self,
@@ -84,14 +116,57 @@ class Streamer:
         see mastodon_search.cli: stream_to_es
         """
         self.save.init_elastic_connection(host, password, port, username)
-        stream_listener = _UpdateStreamListener(self.instance, self.save, self)
+        self.run()
+
+    def run(self) -> None:
+        """Stream new statuses while crawling missed ones, falling back to
+        crawling. The Elasticsearch connection of `self.save` must already
+        be initialized.
+        """
         self.last_seen_id = self.save.get_last_id(self.instance)
-        self._intermediate_crawl()
+        self.stream()
+        self.crawl()
+
+    def crawl(self) -> None:
+        """Crawl new statuses via GET requests forever, starting from the
+        last seen one.
+        """
+        self.is_running = False
+        self.state = 'crawling'
+        self.crawler._crawl_updates(min_id=self.last_seen_id)
+
+    def stream(self) -> None:
+        """Stream new statuses. On every (re)connect, fetch the statuses
+        missed since the last seen one concurrently. Return when streaming
+        does not work (anymore).
+        """
+        stream_listener = _UpdateStreamListener(self.instance, self)
+        # Gap fillers of previous connections may still be running.
+        gap_fillers = []
         retries = 0
+        self.is_running = True
+        if (not self.quiet):
+            REPORTER.add(self)
         while True:
+            if (gap_fillers):
+                STREAM_RECONNECTS.labels(self.instance).inc()
+                # Without streamed statuses, the last seen status is only
+                # known when the gap filler is done. Otherwise, it finishes
+                # its gap while the next one is filled.
+                if (self.connection.first_id is None):
+                    gap_fillers[-1].join()
+                gap_fillers = [t for t in gap_fillers if t.is_alive()]
             self.did_stream_work = False
-            print('Streaming statuses. Last streamed status created at:',
-                flush=True)
+            self.connection = _Connection()
+            self.state = 'streaming'
+            gap_filler = Thread(
+                target=self._fill_gap,
+                args=(self.last_seen_id, self.connection), daemon=True)
+            gap_filler.start()
+            gap_fillers.append(gap_filler)
+            if (not self.quiet):
+                print('Streaming statuses. Last streamed status created at:',
+                    file=self.save.report_file, flush=True)
             try:
                 self.mastodon.stream_public(stream_listener)
             except MastodonVersionError:
@@ -102,19 +177,23 @@ class Streamer:
                 # Server closes connection, we reconnect.
                 # Sadly, there are multiple causes that trigger this error.
                 if (str(e) == 'Server ceased communication.'):
-                    print(e)
+                    if (not self.quiet):
+                        print(e, file=self.save.report_file)
                 else:
                     print(
-                        'During streaming an error occured:', e,
-                        file=stderr, flush=True
+                        f'During streaming {self.instance} an error occured:',
+                        e, file=stderr, flush=True
                     )
                     break
             except Exception as e:
                 print(
-                    'During streaming an error occured:', e,
+                    f'During streaming {self.instance} an error occured:', e,
                     file=stderr, flush=True
                 )
                 break
+            finally:
+                # Do not let the gap filler wait for a stream that ended.
+                self.connection.ready.set()
             sleep(3)
             if (self.did_stream_work):
                 retries = 0
@@ -123,25 +202,57 @@ class Streamer:
                 # Too many consecutive failed attempts. Give up streaming.
                 if (retries >= self.max_retries):
                     break
-            self._intermediate_crawl()
-        print('Falling back to crawling.', file=stderr, flush=True)
-        self.is_running = False
-        self.crawler._crawl_updates(min_id=self.last_seen_id)
+        for gap_filler in gap_fillers:
+            gap_filler.join()
+        print(f'Falling back to crawling {self.instance}.',
+            file=stderr, flush=True)
+
+    def _write_status(self, status: dict, api_method: str) -> None:
+        """Write a status unless it was written recently, which happens where
+        the stream and gap filling overlap.
+        """
+        if (self.recent_ids.add(str(status.get('id')))):
+            self.save.write_status(status, self.instance, api_method)
+
+
+class _RecentIds:
+    """Remember the most recently added status IDs."""
+    def __init__(self, maxlen: int = 10000) -> None:
+        self.ids = set()
+        self.lock = Lock()
+        self.maxlen = maxlen
+        self.order = deque()
+
+    def add(self, id: str) -> bool:
+        """Add an ID. Return False if it was already added recently."""
+        with self.lock:
+            if (id in self.ids):
+                return False
+            self.ids.add(id)
+            self.order.append(id)
+            if (len(self.order) > self.maxlen):
+                self.ids.discard(self.order.popleft())
+            return True
 
 
 class _UpdateStreamListener(StreamListener):
     """Provide own methods for when something happens with a connected
     stream.
     """
-    def __init__(self, instance: str, save: _Save, streamer: Streamer) -> None:
+    def __init__(self, instance: str, streamer: Streamer) -> None:
         self.instance = instance
-        self.save = save
         self.streamer = streamer
 
+    def handle_heartbeat(self) -> None:
+        self.streamer.connection.ready.set()
+
     def on_update(self, status) -> None:
-        self.streamer.last_seen_id = status['id']
-        self.streamer.last_seen_created_at = status['created_at']
-        self.save.write_status(status, self.instance,
-            'api/v1/streaming/public')
+        with self.streamer.lock:
+            if (self.streamer.connection.first_id is None):
+                self.streamer.connection.first_id = status['id']
+            self.streamer.last_seen_id = status['id']
+            self.streamer.last_seen_created_at = status['created_at']
+        self.streamer.connection.ready.set()
+        self.streamer._write_status(status, 'api/v1/streaming/public')
         if (not self.streamer.did_stream_work):
             self.streamer.did_stream_work = True
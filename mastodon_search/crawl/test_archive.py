@@ -0,0 +1,81 @@
+from datetime import datetime, UTC
+from json import loads
+from os import listdir
+
+from mastodon_search.crawl.archive import (
+    _Archive, read_footer, read_segment, segments
+)
+from mastodon_search.crawl.poll import _parse_datetimes
+from mastodon_search.crawl.examples import STATUSES
+from mastodon_search.crawl.transform import status_to_action
+
+CRAWLED_AT = datetime(2024, 5, 1, 12, 30, tzinfo=UTC)
+
+
+def _status(i: int) -> dict:
+    return {
+        'id': str(i),
+        'created_at': datetime(2024, 5, 1, 12, 29, tzinfo=UTC),
+        'content': 'x' * 100,
+    }
+
+
+def test_segments(tmp_path):
+    archive = _Archive(str(tmp_path), segment_size=2000)
+    for i in range(95, 105):
+        archive.write(_status(i), 'example.com', 'api/v1/streaming',
+            CRAWLED_AT)
+    archive.write(_status(1), 'example.com', 'api/v1/streaming',
+        datetime(2024, 5, 1, 13, tzinfo=UTC))
+    archive.close()
+
+    files = segments(str(tmp_path))
+    assert [f.rsplit('/', 1)[1] for f in files] == [
+        '2024-05-01T12_0000.jsonl.zst', '2024-05-01T12_0001.jsonl.zst',
+        '2024-05-01T13_0000.jsonl.zst'
+    ]
+    records = [loads(line) for f in files for line in read_segment(f)]
+    assert [r['status']['id'] for r in records] == \
+        [str(i) for i in range(95, 105)] + ['1']
+    assert records[0]['crawled_at'] == CRAWLED_AT.isoformat()
+    assert records[0]['status']['created_at'] == '2024-05-01T12:29:00+00:00'
+    footer = read_footer(files[0])
+    assert footer['records'] == 8
+    # IDs are ordered like numbers.
+    assert (footer['min_id'], footer['max_id']) == ('95', '102')
+    assert archive.get_last_id('example.com') == '1'
+
+
+def test_recover(tmp_path):
+    archive = _Archive(str(tmp_path))
+    # Segments of past hours are finished when flushing.
+    crawled_at = datetime.now(tz=UTC)
+    for i in range(3):
+        archive.write(_status(i), 'example.com', 'api/v1/streaming',
+            crawled_at)
+    archive.flush()
+    # The process dies without finishing the segment.
+    file = crawled_at.strftime('%Y-%m-%dT%H_0000.jsonl.zst')
+    assert listdir(tmp_path / 'example.com') == [file + '.part']
+    archive = _Archive(str(tmp_path))
+    assert listdir(tmp_path / 'example.com') == [file]
+    assert archive.get_last_id('example.com') == '2'
+
+
+def test_same_action_after_archiving(tmp_path):
+    archive = _Archive(str(tmp_path))
+    for status in STATUSES:
+        archive.write(status, 'example.com', 'api/v1/streaming', CRAWLED_AT)
+    archive.close()
+    # Read like the ingest command.
+    records = [
+        loads(line, object_hook=_parse_datetimes)
+        for line in read_segment(segments(str(tmp_path))[0])
+    ]
+    for status, record in zip(STATUSES, records, strict=True):
+        crawled_at = datetime.fromisoformat(record['crawled_at'])
+        assert status_to_action(
+            record['status'], record['instance'], record['api_method'],
+            crawled_at
+        ) == status_to_action(
+            status, 'example.com', 'api/v1/streaming', CRAWLED_AT)
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, UTC
+from json import load
+from pytest import raises
+
+from mastodon_search.crawl.backfill import Backfiller
+from mastodon_search.crawl.save import _NullSink, _Save
+
+
+def test_resume_without_until(tmp_path):
+    file = str(tmp_path / 'backfill.json')
+    since = datetime.now(tz=UTC) - timedelta(hours=1)
+    backfiller = Backfiller(
+        'example.com', since, num_ranges=4, checkpoint_file=file,
+        save=_Save(sink=_NullSink()))
+    backfiller.ranges[0].done = True
+    backfiller._checkpoint()
+
+    # The window ends where it ended before, not at the new now.
+    resumed = Backfiller(
+        'example.com', since, num_ranges=4, checkpoint_file=file,
+        save=_Save(sink=_NullSink()))
+    assert resumed.until == backfiller.until
+    assert [r.done for r in resumed.ranges] == [True, False, False, False]
+    other = Backfiller(
+        'example.com', since, datetime.now(tz=UTC), num_ranges=4,
+        checkpoint_file=file, save=_Save(sink=_NullSink()))
+    assert not any(r.done for r in other.ranges)
+
+
+def test_stop_on_failure(tmp_path):
+    file = str(tmp_path / 'backfill.json')
+    backfiller = Backfiller(
+        'example.com', datetime.now(tz=UTC) - timedelta(hours=1),
+        num_ranges=4, max_workers=1, checkpoint_file=file,
+        save=_Save(sink=_NullSink()))
+    ranges = backfiller.ranges
+
+    def fetch_range(id_range):
+        if (id_range is ranges[1]):
+            raise ConnectionError('instance is down')
+        # Like _fetch_range, stop when backfilling ends.
+        if (id_range is ranges[0] or not backfiller.finished.wait(5)):
+            id_range.done = True
+
+    backfiller._fetch_range = fetch_range
+    with raises(ConnectionError):
+        backfiller.backfill_to_elastic('', '', 0, '')
+    # The other ranges are stopped, the finished one is checkpointed.
+    with open(file) as f:
+        assert [r['done'] for r in load(f)['ranges']] \
+            == [True, False, False, False]
@@ -0,0 +1,53 @@
+from mastodon_search.crawl.checkpoints import _SqliteCheckpoints
+from mastodon_search.crawl.save import _NullSink, _Save
+from mastodon_search.crawl.test_save import _status
+from mastodon_search.crawl.examples import CRAWLED_AT, STATUSES
+from mastodon_search.crawl.transform import (
+    account_to_action, status_to_action, status_to_canonical_action
+)
+
+
+def _action(status_id: str, instance: str = 'example.com') -> dict:
+    return status_to_action(
+        {**STATUSES[0], 'id': status_id}, instance,
+        'api/v1/timelines/public', CRAWLED_AT)
+
+
+def test_sqlite_checkpoints(tmp_path):
+    file = str(tmp_path / 'checkpoints.db')
+    checkpoints = _SqliteCheckpoints(file)
+    assert checkpoints.get_last_id('example.com') is None
+    checkpoints.add([
+        _action('99'),
+        _action('102'),
+        # Backfilled, older status.
+        _action('100'),
+        _action('7', instance='other.example'),
+        account_to_action(STATUSES[0]['account'], 'example.com', CRAWLED_AT),
+        status_to_canonical_action(
+            {**STATUSES[0], 'id': '8'}, 'other.example',
+            'api/v1/timelines/public', CRAWLED_AT),
+    ])
+    checkpoints.save()
+    checkpoints = _SqliteCheckpoints(file)
+    assert checkpoints.get_last_id('example.com') == '102'
+    assert checkpoints.get_last_id('other.example') == '8'
+    checkpoints.add([_action('101')])
+    checkpoints.save()
+    assert _SqliteCheckpoints(file).get_last_id('example.com') == '102'
+    assert checkpoints.checkpoints['example.com'][1] \
+        == STATUSES[0]['created_at'].isoformat()
+
+
+def test_noindex_statuses(tmp_path):
+    checkpoints = _SqliteCheckpoints(str(tmp_path / 'checkpoints.db'))
+    save = _Save(
+        str(tmp_path / 'spool'), checkpoints=checkpoints, sink=_NullSink())
+    for i in range(5):
+        status = _status(i)
+        if (i == 3):
+            status['account'] = {**status['account'], 'noindex': True}
+        save.write_status(status, 'example.com', 'api/v1/streaming')
+    save.save_queued()
+    assert not save and save.saving == 0 and len(save.spool) == 0
+    assert checkpoints.get_last_id('example.com') == '4'
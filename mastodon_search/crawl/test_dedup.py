@@ -0,0 +1,37 @@
+from datetime import datetime, UTC
+
+from mastodon_search.crawl.dedup import _BloomFilter, _DedupCache, status_key
+
+
+def test_duplicates_and_edits(tmp_path):
+    file = str(tmp_path / 'dedup.bin')
+    cache = _DedupCache(size=2, bloom_size=10, file=file)
+    status = {'id': '1', 'edited_at': None}
+    key = status_key(status, 'example.com')
+    assert key not in cache
+    cache.add(key)
+    assert key in cache
+    assert status_key(status, 'other.example') not in cache
+    status['edited_at'] = datetime(2024, 1, 1, tzinfo=UTC)
+    assert status_key(status, 'example.com') not in cache
+    # Keys dropped from the LRU cache are still in the Bloom filter.
+    for i in range(2, 5):
+        cache.add(status_key({'id': str(i)}, 'example.com'))
+    assert key not in cache.recent and key in cache
+    assert cache.hit_rate() == 2 / 5
+
+    cache.write(cache.snapshot())
+    cache = _DedupCache(size=2, bloom_size=10, file=file)
+    assert key in cache
+    assert len(cache.recent) == 2
+
+
+def test_bloom_filter_error_rate():
+    bloom = _BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(status_key({'id': str(i)}, 'example.com'))
+    false_positives = sum(
+        status_key({'id': str(i)}, 'example.com') in bloom
+        for i in range(1000, 11000)
+    )
+    assert false_positives < 200
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, UTC
+from prometheus_client import generate_latest, REGISTRY
+
+from mastodon_search.crawl.save import _NullSink, _Save
+from mastodon_search.crawl.test_save import _status
+
+
+def _sample(name: str, **labels) -> float | None:
+    return REGISTRY.get_sample_value(f'mastodon_search_{name}', labels)
+
+
+def test_save_metrics():
+    instance = 'metrics.example'
+    api_method = 'api/v1/streaming'
+    bulks = _sample('bulk_duration_seconds_count') or 0
+    save = _Save(sink=_NullSink())
+    save.init_elastic_connection('', '', 0, '', background=False)
+    crawled_at = datetime.now(tz=UTC)
+    for i in range(3):
+        save.write_status(
+            {**_status(i), 'created_at': crawled_at - timedelta(minutes=i)},
+            instance, api_method, crawled_at)
+    assert _sample(
+        'statuses_total', instance=instance, api_method=api_method) == 3
+    assert _sample('lag_seconds', instance=instance) == 120
+    assert _sample('buffer_statuses') == 3
+    save.save_queued()
+    assert _sample('buffer_statuses') == 0
+    assert _sample('bulk_duration_seconds_count') == bulks + 1
+    assert b'mastodon_search_bulk_errors' in generate_latest()
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, UTC
+
+from mastodon_search.crawl.ratelimit import _TokenBucket, LimiterRegistry
+
+
+def _headers(limit: int, remaining: int, reset_in: float) -> dict:
+    reset = datetime.now(tz=UTC) + timedelta(seconds=reset_in)
+    return {
+        'X-RateLimit-Limit': str(limit),
+        'X-RateLimit-Remaining': str(remaining),
+        'X-RateLimit-Reset': reset.isoformat().replace('+00:00', 'Z'),
+    }
+
+
+def test_token_bucket():
+    # One request per second until the rate limit is known.
+    bucket = _TokenBucket(per_second=1, burst=1)
+    assert bucket.reserve() == 0
+    assert 0.9 < bucket.reserve() <= 1
+    assert 1.9 < bucket.take() <= 2
+    bucket.update({'Content-Type': 'application/json'})
+    assert bucket.limit is None
+
+    # Burst while the window has requests left.
+    bucket.update(_headers(300, 3, 60))
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    # Wait until the window resets when they are spent.
+    assert 59 < bucket.take() <= 60
+    assert 59 < bucket.reserve() <= 60
+    bucket.reset_at -= 60
+    assert bucket.take() == 0
+    # The new window's tokens minus the waiting and the new request.
+    assert bucket.tokens == 298
+
+    bucket = _TokenBucket(max_per_second=2)
+    bucket.update(_headers(300, 300, 60))
+    assert bucket.reserve() == 0
+    assert 0.4 < bucket.reserve() <= 0.5
+
+
+def test_pending_reservation():
+    bucket = _TokenBucket()
+    bucket.update(_headers(300, 3, 60))
+    # Two requests are sent, and the first one's response arrives.
+    assert [bucket.reserve() for _ in range(2)] == [0, 0]
+    bucket.update(_headers(300, 2, 60))
+    # The server does not count the second request yet.
+    assert bucket.tokens == 1
+    assert bucket.reserve() == 0
+    assert 59 < bucket.take() <= 60
+    # A request without a response frees nothing on the server.
+    bucket.release()
+    bucket.update(_headers(300, 1, 60))
+    assert bucket.pending == 0
+    assert bucket.tokens == 1
+
+
+def test_registry():
+    limiters = LimiterRegistry()
+    assert limiters['a.example'] is limiters['a.example']
+    assert limiters['a.example'] is not limiters['b.example']
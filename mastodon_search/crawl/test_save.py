@@ -0,0 +1,137 @@
+from io import StringIO
+from json import loads
+from threading import Thread
+from time import sleep
+
+from mastodon_search.crawl.accounts import _AccountCache
+from mastodon_search.crawl.dedup import _DedupCache
+from mastodon_search.crawl.save import (
+    _BatchSizer, _JsonLinesSink, _NullSink, _Save
+)
+from mastodon_search.crawl.spool import dumps_action
+
+
+def _status(i: int) -> dict:
+    return {
+        'id': str(i),
+        'account': {
+            'id': '1', 'acct': 'alice', 'username': 'alice',
+            'emojis': [], 'fields': [], 'followers_count': 0,
+            'following_count': 0, 'statuses_count': 1,
+        },
+        'content': 'x' * 1000,
+        'emojis': [],
+        'media_attachments': [],
+        'mentions': [],
+        'tags': [],
+    }
+
+
+def test_spill_when_full(tmp_path):
+    save = _Save(str(tmp_path), max_bytes=5000, spill=True)
+    for i in range(10):
+        save.write_status(_status(i), 'example.com', 'api/v1/streaming')
+    assert save.is_full() and not save.is_blocking()
+    assert 0 < len(save) < 10
+    assert len(save) + save.spilled == 10
+    assert save.peak_bytes < 5000 + 2000
+
+    # Queued and spilled statuses are replayed in order after a restart.
+    save = _Save(str(tmp_path), max_bytes=5000, spill=True)
+    assert len(save) + save.spilled == 10
+    assert save[0]['_source']['id'] == '0'
+
+
+def test_full_with_accounts():
+    # The status fills the queue, its account action is queued anyway.
+    sink = _NullSink()
+    save = _Save(max_bytes=1, accounts=_AccountCache(), sink=sink)
+    status = _status(0)
+    status['account']['uri'] = 'https://example.com/users/alice'
+    save.write_status(status, 'example.com', 'api/v1/streaming')
+    assert len(save) == 2 and not save.spilled
+    save.save_queued()
+    assert sink.actions == 2 and not save
+
+
+def test_flush_triggers():
+    save = _Save(flush_count=3, flush_age=3600)
+    for i in range(2):
+        save.write_status(_status(i), 'example.com', 'api/v1/streaming')
+    assert not save._flush_due()
+    save.write_status(_status(2), 'example.com', 'api/v1/streaming')
+    assert save._flush_due()
+
+    save = _Save(flush_count=3, flush_age=0)
+    assert not save._flush_due()
+    save.write_status(_status(0), 'example.com', 'api/v1/streaming')
+    assert save._flush_due()
+
+
+def test_concurrent_duplicates():
+    save = _Save(dedup=_DedupCache(size=10))
+    to_actions = save._to_actions
+
+    def slow_to_actions(*args):
+        # Let the other thread check the status meanwhile.
+        sleep(0.1)
+        return to_actions(*args)
+
+    save._to_actions = slow_to_actions
+    threads = [
+        Thread(target=save.write_status,
+            args=(_status(0), 'example.com', 'api/v1/streaming'))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(save) == 1 and not save.writing
+
+
+def test_estimated_sizes():
+    # Without spool and max_bytes, most sizes are estimated.
+    save = _Save()
+    for i in range(10):
+        save.write_status(_status(i), 'example.com', 'api/v1/streaming')
+    size = len(dumps_action(save[0]))
+    assert abs(save.queued_bytes - 10 * size) < 10
+
+
+def test_batch_sizer():
+    sizer = _BatchSizer(size=500, min_size=50, max_size=600)
+    sizer.update(latency=1, rejected=False)
+    sizer.update(latency=1, rejected=False)
+    sizer.update(latency=1, rejected=False)
+    assert sizer.size == 600
+    sizer.update(latency=1, rejected=True)
+    assert sizer.size == 300 and sizer.backoff == 1
+    sizer.update(latency=60, rejected=False)
+    assert sizer.size == 150 and sizer.backoff == 0
+
+
+def test_sinks(tmp_path):
+    file = StringIO()
+    # Spilled statuses are saved, too. Concurrent batches finish in any
+    # order.
+    save = _Save(
+        str(tmp_path), max_bytes=5000, spill=True,
+        batch_sizer=_BatchSizer(size=2, min_size=2), bulk_workers=3,
+        sink=_JsonLinesSink(file))
+    for i in range(10):
+        save.write_status(_status(i), 'example.com', 'api/v1/streaming')
+    while (save or save.spilled):
+        save.save_queued()
+    assert sorted(
+        int(loads(line)['_source']['id'])
+        for line in file.getvalue().splitlines()
+    ) == list(range(10))
+    assert save.get_last_id('example.com') is None
+
+    sink = _NullSink()
+    save = _Save(sink=sink)
+    for i in range(3):
+        save.write_status(_status(i), 'example.com', 'api/v1/streaming')
+    save.save_queued()
+    assert sink.actions == 3 and not save
@@ -0,0 +1,72 @@
+from datetime import datetime, UTC
+
+from mastodon_search.crawl.crawl import adapt_wait_time
+from mastodon_search.crawl.schedule import (
+    PollScheduler, PredictivePollScheduler
+)
+from mastodon_search.crawl.snowflake import (
+    datetime_to_id, id_to_datetime, id_to_timestamp
+)
+
+
+def _statuses(start: float, interval: float, n: int) -> list[dict]:
+    """Return n statuses, newest first, posted every `interval` seconds."""
+    return [
+        {'id': datetime_to_id(
+            datetime.fromtimestamp(start + i * interval, tz=UTC))}
+        for i in reversed(range(n))
+    ]
+
+
+def test_snowflake_roundtrip():
+    dt = datetime(2024, 5, 17, 12, 30, 15, 123000, tzinfo=UTC)
+    assert id_to_datetime(datetime_to_id(dt)) == dt
+    assert id_to_timestamp('112456789012345678') is not None
+    # Sequential IDs of old instances are no snowflakes.
+    assert id_to_timestamp('123456') is None
+    assert id_to_timestamp(None) is None
+
+
+def test_adapt_wait_time_capped():
+    # Just below the maximum, a step up must not overshoot it.
+    assert adapt_wait_time(50, 0, 60) == 60
+    assert adapt_wait_time(50, 2, 60) == 60
+    assert adapt_wait_time(59, 5, 60) == 60
+    assert adapt_wait_time(30, 0, 60) == 60
+    assert adapt_wait_time(20, 0, 60) == 40
+    assert adapt_wait_time(60, 40, 60) == 54
+
+
+def test_queue_order():
+    scheduler = PollScheduler()
+    scheduler.push('b.example', 20)
+    scheduler.push('a.example', 10)
+    scheduler.push('c.example', 20)
+    assert scheduler.next_due() == 10
+    assert [scheduler.pop() for _ in range(3)] == \
+        ['a.example', 'b.example', 'c.example']
+    assert scheduler.next_due() is None
+
+
+def test_predictive_wait_time():
+    now = 1_700_000_000
+    scheduler = PredictivePollScheduler(
+        priors={'busy.example': 1}, max_wait=3600)
+    # The prior alone expects a full page after 40 seconds.
+    assert scheduler.rate('busy.example') == 1
+    # A full page means there are more statuses: poll again at once.
+    wait = scheduler.wait_time(
+        'quiet.example', 60, _statuses(now - 400, 10, 40), now)
+    assert wait == scheduler.min_wait
+    rate = scheduler.rate('quiet.example')
+    assert 1 / 600 < rate < 0.1
+    # Few statuses since the last poll lower the rate.
+    wait = scheduler.wait_time(
+        'quiet.example', wait, _statuses(now + 300, 100, 3), now + 600)
+    assert scheduler.rate('quiet.example') < rate
+    assert 40 / rate < wait <= 3600
+    # No statuses at all drive the wait time towards the maximum.
+    for i in range(1, 20):
+        wait = scheduler.wait_time(
+            'quiet.example', wait, [], now + 600 + i * 3600)
+    assert wait == 3600
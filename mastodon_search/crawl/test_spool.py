@@ -0,0 +1,57 @@
+from datetime import datetime, UTC
+from json import loads
+from os import listdir
+
+from mastodon_search.crawl.spool import _Spool, dumps_action
+
+
+def _action(i: int) -> dict:
+    return {
+        '_id': str(i),
+        '_source': {'crawled_at': datetime(2024, 1, 1, i, tzinfo=UTC)},
+    }
+
+
+def test_replay_unacknowledged(tmp_path):
+    spool = _Spool(str(tmp_path), segment_size=100)
+    for i in range(10):
+        spool.append(dumps_action(_action(i)))
+    assert len(spool) == 10
+    spool.ack(4)
+    assert len(spool) == 6
+    # Simulate the process dying while writing a record.
+    spool.file.write('{"_id": "10", "_sou')
+    spool.file.flush()
+
+    spool = _Spool(str(tmp_path), segment_size=100)
+    assert [loads(a)['_id'] for a in spool.replay()] == \
+        [str(i) for i in range(4, 10)]
+    assert loads(next(spool.replay()))['_source']['crawled_at'] == \
+        '2024-01-01T04:00:00+00:00'
+    spool.append(dumps_action(_action(11)))
+    spool.ack(7)
+    assert len(spool) == 0
+    # Only the current segment and the acknowledgement file are left.
+    assert len(listdir(tmp_path)) == 2
+    spool = _Spool(str(tmp_path), segment_size=100)
+    assert list(spool.replay()) == []
+
+
+def test_read_unread(tmp_path):
+    spool = _Spool(str(tmp_path), segment_size=100)
+    spool.append(dumps_action(_action(0)))
+    for i in range(1, 6):
+        spool.append(dumps_action(_action(i)), unread=True)
+    assert spool.unread == 5
+    # Across segments, from where the unread records start.
+    assert [loads(spool.read())['_id'] for _ in range(3)] == ['1', '2', '3']
+    spool.ack(2)
+
+    # After a restart, all unacknowledged records are unread.
+    spool = _Spool(str(tmp_path), segment_size=100)
+    assert spool.unread == 4
+    assert [loads(spool.read())['_id'] for _ in range(4)] == \
+        ['2', '3', '4', '5']
+    spool.append(dumps_action(_action(6)))
+    spool.append(dumps_action(_action(7)), unread=True)
+    assert loads(spool.read())['_id'] == '7' and not spool.unread
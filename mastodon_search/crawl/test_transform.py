@@ -0,0 +1,106 @@
+from datetime import datetime, UTC
+from json import dumps, loads
+
+from mastodon_search.crawl.examples import (
+    CRAWLED_AT, STATUSES, example_account, example_status
+)
+from mastodon_search.crawl.save import SERIALIZERS
+from mastodon_search.crawl.spool import dumps_action
+from mastodon_search.crawl.transform import (
+    EDITABLE_KEYS, STATUS_ACCOUNT_KEYS, account_to_action, split_account,
+    status_to_action, status_to_canonical_action, status_to_document
+)
+
+def test_same_as_document():
+    for status in STATUSES:
+        action = status_to_action(
+            status, 'example.com', 'api/v1/timelines/public', CRAWLED_AT)
+        expected = status_to_document(
+            status, 'example.com', 'api/v1/timelines/public', CRAWLED_AT
+        ).to_dict(include_meta=True)
+        assert action == expected
+        # Also the same key order and value types.
+        assert dumps_action(action) == dumps_action(expected)
+        assert dumps(action['_source'], default=repr) == \
+            dumps(expected['_source'], default=repr)
+
+
+def test_canonical_action():
+    status = example_status(edited_at=datetime(2024, 5, 1, 13, tzinfo=UTC))
+    actions = [
+        status_to_canonical_action(
+            example_status(id=local_id, edited_at=status['edited_at']),
+            instance, 'api/v1/timelines/public', CRAWLED_AT)
+        for local_id, instance in (
+            (status['id'], 'example.com'), ('42', 'other.example'))
+    ]
+    # Same document for every instance that knows the status.
+    assert actions[0]['_id'] == actions[1]['_id']
+    assert actions[0]['_index'] == actions[1]['_index']
+    assert actions[0]['_op_type'] == 'update'
+    source = status_to_action(
+        status, 'example.com', 'api/v1/timelines/public', CRAWLED_AT
+    )['_source']
+    sighting = {
+        'crawled_at': CRAWLED_AT, 'id': status['id'],
+        'instance': 'example.com'
+    }
+    assert actions[0]['upsert'] == {**source, 'sightings': [sighting]}
+    params = actions[1]['script']['params']
+    assert params['sighting'] == {
+        'crawled_at': CRAWLED_AT, 'id': '42', 'instance': 'other.example'}
+    assert params['edit'].keys() == set(EDITABLE_KEYS)
+    assert params['edit']['content'] == status['content']
+    # Unedited statuses are the same on every instance.
+    assert 'edit' not in status_to_canonical_action(
+        example_status(), 'example.com', 'api/v1/timelines/public', CRAWLED_AT
+    )['script']['params']
+
+
+def test_split_account():
+    def split(status: dict, instance: str) -> tuple[dict, dict]:
+        source = status_to_action(
+            status, instance, 'api/v1/timelines/public', CRAWLED_AT
+        )['_source']
+        account = split_account(source)
+        return source, account_to_action(account, instance, CRAWLED_AT)
+
+    source, account_action = split(example_status(), 'example.com')
+    assert set(source['account']) <= {*STATUS_ACCOUNT_KEYS, 'snapshot_id'}
+    assert source['account']['followers_count'] == 3
+    assert source['account']['snapshot_id'] == str(account_action['_id'])
+    assert account_action['_source']['account']['display_name'] == 'Alice'
+    content_hash = account_action['_source']['content_hash']
+    # Crawled from another instance with a new post.
+    _, other = split(
+        example_status(account=example_account(
+            id=7, acct='alice@example.com', statuses_count=1,
+            last_status_at=CRAWLED_AT)),
+        'other.example'
+    )
+    assert other['_id'] == account_action['_id']
+    assert other['_source']['content_hash'] == content_hash
+    _, changed = split(
+        example_status(account=example_account(note='<p>New bio</p>')),
+        'example.com')
+    assert changed['_source']['content_hash'] != content_hash
+    # Accounts that opted out of indexing are not stored.
+    source = status_to_action(
+        example_status(account=example_account(noindex=True)), 'example.com',
+        'api/v1/timelines/public', CRAWLED_AT
+    )['_source']
+    assert split_account(source) is None
+    assert source['account'] == {'noindex': True}
+
+
+def test_serializers_agree():
+    actions = [
+        to_action(status, 'example.com', 'api/v1/timelines/public', crawled_at)
+        for status in STATUSES
+        for to_action in (status_to_action, status_to_canonical_action)
+        # Mastodon.py gives timezone aware datetimes, but be safe.
+        for crawled_at in (CRAWLED_AT, datetime(2024, 5, 1, 12, 30, 0, 5))
+    ]
+    json, orjson = SERIALIZERS['json'](), SERIALIZERS['orjson']()
+    for action in actions:
+        assert loads(orjson.dumps(action)) == loads(json.dumps(action))
@@ -0,0 +1,559 @@
+"""Convert Mastodon statuses to Elasticsearch bulk actions.
+status_to_action builds the action dict directly, because constructing the
+elasticsearch_dsl documents of status_to_document for every status is slow.
+Both produce the same action, see: test_transform.py
+"""
+
+from datetime import datetime
+from hashlib import blake2b
+from json import dumps
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+from mastodon_search.globals import (
+    ACCOUNT_INDEX, CANONICAL_INDEX_PREFIX, INDEX_PREFIX
+)
+from mastodon_search.elastic_dsl.mastodon import Status
+
+INT_MAX = 2**31 - 1
+INT_MIN = -2**31
+NAMESPACE_FA = uuid5(NAMESPACE_URL, 'fediverse_analysis')
+NAMESPACE_MASTODON = uuid5(NAMESPACE_FA, 'Mastodon')
+# Values that elasticsearch_dsl leaves out of documents.
+_EMPTY = ([], {}, None)
+# Account attributes that statuses keep when accounts are stored
+# separately, see: split_account
+STATUS_ACCOUNT_KEYS = (
+    'acct', 'bot', 'discoverable', 'followers_count', 'following_count',
+    'group', 'handle', 'id', 'last_status_at', 'locked', 'noindex',
+    'statuses_count', 'uri'
+)
+# Account attributes that change with every status or differ between
+# crawled instances, so they are not part of an account's content hash.
+VOLATILE_ACCOUNT_KEYS = frozenset((
+    'acct', 'followers_count', 'following_count', 'id', 'last_status_at',
+    'statuses_count'
+))
+# Attributes of a status that can change when it is edited.
+EDITABLE_KEYS = (
+    'card', 'content', 'edited_at', 'emojis', 'language', 'media_attachments',
+    'mentions', 'poll', 'sensitive', 'spoiler_text', 'tags'
+)
+# Update a canonical status with another sighting, see:
+# status_to_canonical_action. A newer edit replaces the editable attributes.
+# Crawling the same status from the same instance again changes nothing.
+SIGHTING_SCRIPT = """
+boolean seen = false;
+for (s in ctx._source.sightings) {
+    if (s.instance == params.sighting.instance) {
+        seen = true;
+        break;
+    }
+}
+boolean edited = params.edit != null && (
+    ctx._source.edited_at == null
+    || ctx._source.edited_at.compareTo(params.edit.edited_at) < 0);
+if (seen && !edited) {
+    ctx.op = 'noop';
+    return;
+}
+if (edited) {
+    for (entry in params.edit.entrySet()) {
+        if (entry.getValue() == null) {
+            ctx._source.remove(entry.getKey());
+        } else {
+            ctx._source[entry.getKey()] = entry.getValue();
+        }
+    }
+}
+if (!seen) {
+    ctx._source.sightings.add(params.sighting);
+}
+"""
+
+
+def check_int(num: int) -> int | None:
+    if (num <= INT_MAX and num >= INT_MIN):
+        return num
+    else:
+        return None
+
+
+def check_str(value: object) -> str | None:
+    return (str(value) if value else None)
+
+
+def status_id(status: dict, crawled_from_instance: str) -> UUID:
+    """Return the Elasticsearch document ID of a status."""
+    return uuid5(
+        NAMESPACE_MASTODON,
+        crawled_from_instance + '/' + str(status.get('id'))
+    )
+
+
+def account_id(account: dict) -> UUID:
+    """Return the Elasticsearch document ID of an account snapshot, which is
+    the same for every instance the account was crawled from.
+    """
+    return uuid5(NAMESPACE_MASTODON, account['uri'])
+
+
+def canonical_id(status: dict, crawled_from_instance: str) -> UUID:
+    """Return the Elasticsearch document ID of a canonical status, which is
+    the same for every instance the status was crawled from.
+    """
+    if (not (uri := status.get('uri'))):
+        return status_id(status, crawled_from_instance)
+    return uuid5(NAMESPACE_MASTODON, uri)
+
+
+def _compact(d: dict) -> dict:
+    """Leave out empty values like elasticsearch_dsl's to_dict does."""
+    return {k: v for k, v in d.items() if v not in _EMPTY}
+
+
+def _emoji(emoji: dict) -> dict:
+    return _compact({
+        'shortcode': emoji.get('shortcode'),
+        'url': emoji.get('url'),
+        'static_url': emoji.get('static_url'),
+        'visible_in_picker': emoji.get('visible_in_picker'),
+    })
+
+
+def _media_meta(raw_meta: dict | None) -> dict | None:
+    if (not raw_meta):
+        return None
+    meta = {
+        'audio_bitrate': raw_meta.get('audio_bitrate'),
+        'audio_channels': raw_meta.get('audio_channels'),
+        'audio_encode': raw_meta.get('audio_encode'),
+        'focus': None,
+        'original': None,
+        'small': None,
+    }
+    if (raw_focus := raw_meta.get('focus')):
+        meta['focus'] = _compact({
+            'x': raw_focus.get('x'),
+            'y': raw_focus.get('y'),
+        })
+    for key in ('original', 'small'):
+        if (info := raw_meta.get(key)):
+            meta[key] = _compact({
+                'aspect': info.get('aspect'),
+                'bitrate': info.get('bitrate'),
+                'duration': info.get('duration'),
+                'frame_rate': info.get('frame_rate'),
+                'height': info.get('height'),
+                'width': info.get('width'),
+            })
+    return _compact(meta)
+
+
+def status_to_action(
+    status: dict, crawled_from_instance: str, api_method: str,
+    crawled_at: datetime
+) -> dict:
+    """Return the bulk action to index a status.
+
+    Arguments:
+    status -- the Mastodon status as received by Mastodon.py
+    crawled_from_instance -- which fediverse instance this status was
+        crawled from
+    api_method -- the API method/path, e. g. 'api/v1/streaming/public'
+    crawled_at -- when the status was crawled
+    """
+    acc = status.get('account')
+    if acc.get('noindex') is True:
+        source = {
+            'crawled_at': crawled_at,
+            'account': {'noindex': acc.get('noindex')},
+        }
+    else:
+        if (acc.get('acct') == acc.get('username')):
+            instance = crawled_from_instance
+            is_local = True
+        else:
+            instance = acc.get('acct').split('@', maxsplit=1)[1]
+            is_local = False
+        source = {
+            'api_url': ('https://' + crawled_from_instance
+                + '/api/v1/statuses/' + str(status.get('id'))),
+            'content': status.get('content'),
+            'crawled_at': crawled_at,
+            'crawled_from_api_url': (
+                'https://' + crawled_from_instance + '/' + api_method),
+            'crawled_from_instance': crawled_from_instance,
+            'created_at': status.get('created_at'),
+            'edited_at': status.get('edited_at'),
+            'id': str(status.get('id')),
+            'in_reply_to_id': check_str(status.get('in_reply_to_id')),
+            'in_reply_to_account_id': check_str(
+                status.get('in_reply_to_account_id')),
+            'instance': instance,
+            'is_local': is_local,
+            'language': status.get('language'),
+            'sensitive': status.get('sensitive'),
+            'spoiler_text': check_str(status.get('spoiler_text')),
+            'uri': status.get('uri'),
+            'url': status.get('url'),
+            'visibility': status.get('visibility'),
+        }
+        source['account'] = _compact({
+            'acct': acc.get('acct'),
+            'avatar': acc.get('avatar'),
+            'avatar_static': acc.get('avatar_static'),
+            'bot': acc.get('bot'),
+            'created_at': acc.get('created_at'),
+            'discoverable': acc.get('discoverable'),
+            'display_name': acc.get('display_name'),
+            'followers_count': check_int(acc.get('followers_count')),
+            'following_count': check_int(acc.get('following_count')),
+            'group': acc.get('group'),
+            'handle': (acc.get('username') + '@' + instance),
+            'header': acc.get('header'),
+            'header_static': acc.get('header_static'),
+            'id': str(acc.get('id')),
+            'last_status_at': acc.get('last_status_at'),
+            'locked': acc.get('locked'),
+            'noindex': acc.get('noindex'),
+            'note': check_str(acc.get('note')),
+            'statuses_count': check_int(acc.get('statuses_count')),
+            'uri': acc.get('uri'),
+            'url': acc.get('url'),
+            'username': acc.get('username'),
+            'emojis': [_emoji(emoji) for emoji in acc.get('emojis')],
+            'fields': [
+                _compact({
+                    'name': field.get('name'),
+                    'value': field.get('value'),
+                    'verified_at': field.get('verified_at'),
+                })
+                for field in acc.get('fields')
+            ],
+        })
+        if (
+            (app := status.get('application'))
+            and (app.get('name') or app.get('website'))
+        ):
+            source['application'] = {
+                'name': app.get('name'),
+                'website': app.get('website'),
+            }
+        if (card := status.get('card')):
+            source['card'] = {
+                'author_name': check_str(card.get('author_name')),
+                'author_url': check_str(card.get('author_url')),
+                'blurhash': check_str(card.get('blurhash')),
+                'description': check_str(card.get('description')),
+                'embed_url': check_str(card.get('embed_url')),
+                'height': card.get('height'),
+                'image': card.get('image'),
+                'image_description': check_str(
+                    card.get('image_description')),
+                'language': check_str(card.get('language')),
+                'provider_name': check_str(card.get('provider_name')),
+                'provider_url': check_str(card.get('provider_url')),
+                'published_at': card.get('published_at'),
+                'title': check_str(card.get('title')),
+                'type': card.get('type'),
+                'url': check_str(card.get('url')),
+                'width': card.get('width'),
+            }
+        if (poll := status.get('poll')):
+            source['poll'] = {
+                'expires_at': poll.get('expires_at'),
+                'expired': poll.get('expired'),
+                'id': str(poll.get('id')),
+                'multiple': poll.get('multiple'),
+                'voters_count': poll.get('voters_count'),
+                'votes_count': poll.get('votes_count'),
+                'options': [
+                    _compact({
+                        'title': option.get('title'),
+                        'votes_count': option.get('votes_count'),
+                    })
+                    for option in poll.get('options')
+                ],
+            }
+        if (reblog := status.get('reblog')):
+            source['reblog'] = {
+                'id': str(reblog.get('id')),
+                'url': reblog.get('url'),
+            }
+        source['emojis'] = [_emoji(emoji) for emoji in status.get('emojis')]
+        source['media_attachments'] = [
+            _compact({
+                'blurhash': check_str(ma.get('blurhash')),
+                'description': check_str(ma.get('description')),
+                'id': str(ma.get('id')),
+                'meta_': _media_meta(ma.get('meta')),
+                'preview_url': check_str(ma.get('preview_url')),
+                'remote_url': check_str(ma.get('remote_url')),
+                'type': ma.get('type'),
+                'url': ma.get('url'),
+            })
+            for ma in status.get('media_attachments')
+        ]
+        source['mentions'] = [
+            _compact({
+                'acct': mention.get('acct'),
+                'id': str(mention.get('id')),
+                'url': mention.get('url'),
+                'username': mention.get('username'),
+            })
+            for mention in status.get('mentions')
+        ]
+        source['tags'] = [
+            _compact({'name': tag.get('name'), 'url': tag.get('url')})
+            for tag in status.get('tags')
+        ]
+    for key in ('application', 'card', 'poll', 'reblog'):
+        if (key in source):
+            source[key] = _compact(source[key])
+    return {
+        '_id': status_id(status, crawled_from_instance),
+        '_index': crawled_at.strftime(f'{INDEX_PREFIX}_%Y_%m'),
+        '_source': _compact(source),
+    }
+
+
+def status_to_canonical_action(
+    status: dict, crawled_from_instance: str, api_method: str,
+    crawled_at: datetime
+) -> dict:
+    """Return the bulk action to add a sighting to the canonical document
+    of a status, keyed by its ActivityPub URI. The first sighting creates the
+    document like status_to_action. Canonical documents are stored in the
+    index of the month the status was created, so all sightings update the
+    same document.
+
+    Arguments:
+    see status_to_action
+    """
+    source = status_to_action(
+        status, crawled_from_instance, api_method, crawled_at)['_source']
+    sighting = {
+        'crawled_at': crawled_at,
+        'id': str(status.get('id')),
+        'instance': crawled_from_instance,
+    }
+    params = {'sighting': sighting}
+    if (source.get('edited_at')):
+        # Only edited statuses can differ between sightings.
+        params['edit'] = {key: source.get(key) for key in EDITABLE_KEYS}
+    created_at = status.get('created_at') or crawled_at
+    return {
+        '_id': canonical_id(status, crawled_from_instance),
+        '_index': created_at.strftime(f'{CANONICAL_INDEX_PREFIX}_%Y_%m'),
+        '_op_type': 'update',
+        # Other bulk workers may update the same status concurrently.
+        'retry_on_conflict': 3,
+        'script': {
+            'lang': 'painless',
+            'params': params,
+            'source': SIGHTING_SCRIPT,
+        },
+        'upsert': {**source, 'sightings': [sighting]},
+    }
+
+
+def account_to_action(
+    account: dict, crawled_from_instance: str, crawled_at: datetime
+) -> dict:
+    """Return the bulk action to index a snapshot of an account.
+
+    Arguments:
+    account -- the account as in the source of status_to_action
+    crawled_from_instance -- which fediverse instance the account was
+        crawled from
+    crawled_at -- when the account was crawled
+    """
+    content = {
+        k: v for k, v in account.items() if k not in VOLATILE_ACCOUNT_KEYS}
+    content_hash = blake2b(
+        dumps(content, default=str, sort_keys=True).encode(),
+        digest_size=16
+    ).hexdigest()
+    return {
+        '_id': account_id(account),
+        '_index': ACCOUNT_INDEX,
+        '_source': {
+            'account': account,
+            'content_hash': content_hash,
+            'crawled_at': crawled_at,
+            'crawled_from_instance': crawled_from_instance,
+        },
+    }
+
+
+def split_account(source: dict) -> dict | None:
+    """Replace the account of a status' source by a reference to its
+    snapshot and the attributes of STATUS_ACCOUNT_KEYS. Return the full
+    account, or None if it cannot be stored separately.
+
+    Arguments:
+    source -- the source of a status as built by status_to_action
+    """
+    account = source.get('account')
+    if (not account or not account.get('uri')):
+        # Accounts that opted out of indexing keep only the noindex flag.
+        return None
+    source['account'] = {
+        k: account[k] for k in STATUS_ACCOUNT_KEYS if k in account}
+    source['account']['snapshot_id'] = str(account_id(account))
+    return account
+
+
+def status_to_document(
+    status: dict, crawled_from_instance: str, api_method: str,
+    crawled_at: datetime
+) -> Status:
+    """Return a status as elasticsearch_dsl document. This is the reference
+    for status_to_action, which is much faster.
+
+    Arguments:
+    see status_to_action
+    """
+    status_uuid = status_id(status, crawled_from_instance)
+    acc = status.get('account')
+    if acc.get('noindex') is True:
+        dsl_status = Status(
+            meta={
+                'id': status_uuid,
+                'index': crawled_at.strftime(f'{INDEX_PREFIX}_%Y_%m')
+            },
+            crawled_at=crawled_at
+        )
+        dsl_status.set_account(
+            noindex=acc.get('noindex')
+        )
+    else:
+        if (acc.get('acct') == acc.get('username')):
+            instance = crawled_from_instance
+            is_local = True
+        else:
+            instance = acc.get('acct').split('@', maxsplit=1)[1]
+            is_local = False
+        dsl_status = Status(
+            meta={
+                'id': status_uuid,
+                'index': crawled_at.strftime(f'{INDEX_PREFIX}_%Y_%m')
+            },
+            api_url=('https://' + crawled_from_instance
+                       + '/api/v1/statuses/' + str(status.get('id'))),
+            content=status.get('content'),
+            crawled_at=crawled_at,
+            crawled_from_api_url=(
+                'https://' + crawled_from_instance + '/' + api_method),
+            crawled_from_instance=crawled_from_instance,
+            created_at=status.get('created_at'),
+            edited_at=status.get('edited_at'),
+            id=str(status.get('id')),
+            in_reply_to_id=check_str(status.get('in_reply_to_id')),
+            in_reply_to_account_id=check_str(
+                status.get('in_reply_to_account_id')),
+            instance=instance,
+            is_local=is_local,
+            language=status.get('language'),
+            sensitive=status.get('sensitive'),
+            spoiler_text=check_str(status.get('spoiler_text')),
+            uri=status.get('uri'),
+            url=status.get('url'),
+            visibility=status.get('visibility')
+        )
+        dsl_status.set_account(
+            acct=acc.get('acct'),
+            avatar=acc.get('avatar'),
+            avatar_static=acc.get('avatar_static'),
+            bot=acc.get('bot'),
+            created_at=acc.get('created_at'),
+            discoverable=acc.get('discoverable'),
+            display_name=acc.get('display_name'),
+            emojis=acc.get('emojis'),
+            fields=acc.get('fields'),
+            followers_count=check_int(acc.get('followers_count')),
+            following_count=check_int(acc.get('following_count')),
+            group=acc.get('group'),
+            handle=(acc.get('username') + '@' + instance),
+            header=acc.get('header'),
+            header_static=acc.get('header_static'),
+            id=str(acc.get('id')),
+            last_status_at=acc.get('last_status_at'),
+            locked=acc.get('locked'),
+            noindex=acc.get('noindex'),
+            note=check_str(acc.get('note')),
+            statuses_count=check_int(acc.get('statuses_count')),
+            uri=acc.get('uri'),
+            url=acc.get('url'),
+            username=acc.get('username')
+        )
+        if (app := status.get('application')):
+            dsl_status.set_application(
+                name=app.get('name'),
+                website=app.get('website'))
+        if (card := status.get('card')):
+            dsl_status.set_card(
+                author_name=check_str(card.get('author_name')),
+                author_url=check_str(card.get('author_url')),
+                blurhash=check_str(card.get('blurhash')),
+                description=check_str(card.get('description')),
+                embed_url=check_str(card.get('embed_url')),
+                height=card.get('height'),
+                image=card.get('image'),
+                image_description=check_str(
+                    card.get('image_description')),
+                language=check_str(card.get('language')),
+                provider_name=check_str(card.get('provider_name')),
+                provider_url=check_str(card.get('provider_url')),
+                published_at=card.get('published_at'),
+                title=check_str(card.get('title')),
+                type=card.get('type'),
+                url=check_str(card.get('url')),
+                width=card.get('width')
+            )
+        if (poll := status.get('poll')):
+            dsl_status.set_poll(
+                expires_at=poll.get('expires_at'),
+                expired=poll.get('expired'),
+                id=str(poll.get('id')),
+                multiple=poll.get('multiple'),
+                options=poll.get('options'),
+                voters_count=poll.get('voters_count'),
+                votes_count=poll.get('votes_count')
+            )
+        if (reblog := status.get('reblog')):
+            dsl_status.set_reblog(
+                id=str(reblog.get('id')),
+                url=reblog.get('url')
+            )
+        for emoji in status.get('emojis'):
+            dsl_status.add_emoji(
+                shortcode=emoji.get('shortcode'),
+                static_url=emoji.get('static_url'),
+                url=emoji.get('url'),
+                visible_in_picker=emoji.get('visible_in_picker')
+            )
+        for ma in status.get('media_attachments'):
+            dsl_status.add_media_attachment(
+                blurhash=check_str(ma.get('blurhash')),
+                description=check_str(ma.get('description')),
+                id=str(ma.get('id')),
+                raw_meta=ma.get('meta'),
+                preview_url=check_str(ma.get('preview_url')),
+                remote_url=check_str(ma.get('remote_url')),
+                type=ma.get('type'),
+                url=ma.get('url')
+            )
+        for mention in status.get('mentions'):
+            dsl_status.add_mention(
+                acct=mention.get('acct'),
+                id=str(mention.get('id')),
+                url=mention.get('url'),
+                username=mention.get('username')
+            )
+        for tag in status.get('tags'):
+            dsl_status.add_tag(
+                name=tag.get('name'),
+                url=tag.get('url')
+            )
+    return dsl_status
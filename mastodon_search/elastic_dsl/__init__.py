@@ -1 +1 @@
-__all__ = ['mastodon']
+__all__ = ['accounts', 'indices', 'mastodon']
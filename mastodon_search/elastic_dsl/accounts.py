@@ -0,0 +1,48 @@
+"""Join statuses with the account snapshots that are stored separately when
+crawling with --split-accounts. See: AccountSnapshot
+"""
+
+from collections.abc import Iterable, Iterator
+from elasticsearch_dsl import connections
+from itertools import islice
+
+from mastodon_search.globals import ACCOUNT_INDEX
+
+
+def join_accounts(
+    statuses: Iterable[dict], using: str = 'default', chunk_size: int = 500
+) -> Iterator[dict]:
+    """Yield statuses with the full account of their snapshot. Attributes
+    kept in the status, like followers_count, take precedence, as they are
+    those of when the status was crawled. Statuses without a snapshot are
+    yielded unchanged.
+
+    Example:
+    search = Search(index='corpus_mastodon_statuses_*').query(...)
+    DataFrame(join_accounts(hit.to_dict() for hit in search.scan()))
+
+    Arguments:
+    statuses -- statuses as dicts, e. g. from Hit.to_dict
+    using -- the elasticsearch_dsl connection alias
+    chunk_size -- number of statuses whose accounts are fetched at once
+    """
+    client = connections.get_connection(using)
+    statuses = iter(statuses)
+    while (chunk := list(islice(statuses, chunk_size))):
+        ids = {
+            s['account']['snapshot_id'] for s in chunk
+            if 'snapshot_id' in s.get('account', {})
+        }
+        snapshots = {}
+        if (ids):
+            response = client.mget(
+                index=ACCOUNT_INDEX, ids=list(ids), source=['account'])
+            snapshots = {
+                doc['_id']: doc['_source']['account']
+                for doc in response['docs'] if doc.get('found')
+            }
+        for status in chunk:
+            account = status.get('account', {})
+            if (snapshot := snapshots.get(account.get('snapshot_id'))):
+                status['account'] = {**snapshot, **account}
+            yield status
@@ -0,0 +1,146 @@
+"""Install the index templates and lifecycle policy of the status indices.
+See: setup_indices
+"""
+
+from elasticsearch import Elasticsearch
+from elasticsearch_dsl import Document, Index
+
+from mastodon_search.elastic_dsl.mastodon import (
+    AccountSnapshot, CanonicalStatus, Status
+)
+from mastodon_search.globals import (
+    ACCOUNT_INDEX, CANONICAL_INDEX_PREFIX, INDEX_PREFIX,
+    ROLLOVER_INDEX_PREFIX
+)
+
+# Templates installed here take precedence over templates of other tools
+# that match all indices.
+PRIORITY = 100
+
+
+def index_settings(
+    shards: int = 1,
+    replicas: int = 1,
+    refresh_interval: str = '30s',
+    best_compression: bool = True,
+    require: dict[str, str] | None = None,
+) -> dict:
+    """Return the settings of new status indices.
+
+    Arguments:
+    shards -- number of primary shards
+    replicas -- number of replicas of every shard
+    refresh_interval -- how often new statuses become searchable. Longer
+        intervals speed up indexing.
+    best_compression -- store the source with DEFLATE instead of LZ4,
+        which saves disk space at the cost of slower retrieval
+    require -- node attributes that nodes must have to hold the shards,
+        e. g. {'data': 'hot'}
+    """
+    settings = {
+        'number_of_shards': shards,
+        'number_of_replicas': replicas,
+        'refresh_interval': refresh_interval,
+    }
+    if (best_compression):
+        settings['codec'] = 'best_compression'
+    for attribute, value in (require or {}).items():
+        settings[f'routing.allocation.require.{attribute}'] = value
+    return settings
+
+
+def _put_template(
+    client: Elasticsearch, name: str, pattern: str, document: type[Document],
+    settings: dict, priority: int = PRIORITY
+) -> None:
+    index = Index(pattern)
+    index.document(document)
+    index.settings(**settings)
+    index.as_composable_template(name, priority=priority).save(using=client)
+
+
+def init_template(
+    client: Elasticsearch, name: str, pattern: str, document: type[Document]
+) -> None:
+    """Install an index template with the mapping of a document and
+    default settings, unless there is a template of that name, e. g. one
+    installed by setup_indices.
+
+    Arguments:
+    client -- connection to Elasticsearch
+    name -- name of the template
+    pattern -- index pattern the template applies to
+    document -- the document whose mapping the template installs
+    """
+    if (client.indices.exists_index_template(name=name)):
+        return
+    index = Index(pattern)
+    index.document(document)
+    index.as_composable_template(name).save(using=client)
+
+
+def setup_indices(
+    client: Elasticsearch,
+    settings: dict,
+    canonical: bool = False,
+    accounts: bool = False,
+    rollover: bool = False,
+    max_size: str = '50gb',
+    max_age: str = '30d',
+) -> None:
+    """Install or replace the index templates of the status indices. They
+    only apply to indices created afterwards.
+
+    Arguments:
+    client -- connection to Elasticsearch
+    settings -- index settings, see: index_settings
+    canonical -- also install the template of the canonical status indices
+    accounts -- also install the template of the index of account snapshots
+    rollover -- roll the status indices over by size or age with an index
+        lifecycle policy. Crawlers then save statuses to the alias
+        INDEX_PREFIX instead of monthly indices, see: _Save
+    max_size -- primary shard size at which the status index is rolled over
+    max_age -- age at which the status index is rolled over
+    """
+    _put_template(
+        client, INDEX_PREFIX, f'{INDEX_PREFIX}_*', Status, settings)
+    print(f'Installed index template {INDEX_PREFIX}.', flush=True)
+    if (canonical):
+        _put_template(
+            client, CANONICAL_INDEX_PREFIX, f'{CANONICAL_INDEX_PREFIX}_*',
+            CanonicalStatus, settings)
+        print(f'Installed index template {CANONICAL_INDEX_PREFIX}.',
+            flush=True)
+    if (accounts):
+        _put_template(
+            client, ACCOUNT_INDEX, ACCOUNT_INDEX, AccountSnapshot, settings)
+        print(f'Installed index template {ACCOUNT_INDEX}.', flush=True)
+    if (not rollover):
+        return
+    client.ilm.put_lifecycle(name=INDEX_PREFIX, policy={'phases': {'hot': {
+        'actions': {'rollover': {
+            'max_age': max_age,
+            'max_primary_shard_size': max_size,
+        }},
+    }}})
+    # Takes precedence over the template of the monthly indices, whose
+    # pattern also matches.
+    _put_template(
+        client, ROLLOVER_INDEX_PREFIX, f'{ROLLOVER_INDEX_PREFIX}-*', Status,
+        {
+            **settings,
+            'lifecycle.name': INDEX_PREFIX,
+            'lifecycle.rollover_alias': INDEX_PREFIX,
+        },
+        priority=PRIORITY + 1
+    )
+    print(f'Installed lifecycle policy {INDEX_PREFIX}, rolling over after '
+        +f'{max_size} per shard or {max_age}.', flush=True)
+    if (client.indices.exists_alias(name=INDEX_PREFIX)):
+        return
+    client.indices.create(
+        index=f'{ROLLOVER_INDEX_PREFIX}-000001',
+        aliases={INDEX_PREFIX: {'is_write_index': True}}
+    )
+    print(f'Created index {ROLLOVER_INDEX_PREFIX}-000001 with write alias '
+        +f'{INDEX_PREFIX}.', flush=True)
@@ -45,6 +45,9 @@ class Account(InnerDoc):
     locked: bool = Boolean()
     noindex: bool = Boolean()
     note: str = Text()
+    # Custom attribute: ID of the account's AccountSnapshot, if the account
+    # is stored separately
+    snapshot_id: str = Keyword()
     statuses_count: int = Integer()
     url: str = Keyword()
     uri: str = Keyword()
@@ -161,7 +164,8 @@ class Tag(InnerDoc):
 
 class Status(Document):
     """Mastodon status main class. Index and index settings are managed by
-    Elasticsearch index templates and by the method that saves the statuses.
+    Elasticsearch index templates (see: indices.setup_indices) and by the
+    method that saves the statuses.
     """
     account: Account = Object(Account)
     # Custom attribute
@@ -363,3 +367,34 @@ class Status(Document):
 
     def set_reblog(self, id, url) -> None:
         self.reblog = Reblog(id=id, url=url)
+
+
+# Custom: a crawl of a canonical status from one instance
+class Sighting(InnerDoc):
+    crawled_at: datetime = Date()
+    # The status' ID on the crawled instance
+    id: str = Keyword()
+    instance: str = Keyword()
+
+
+class CanonicalStatus(Status):
+    """A status stored once for all instances it was crawled from, with its
+    ActivityPub URI as ID. The instance specific attributes, like id,
+    crawled_at and crawled_from_instance, are those of the first sighting.
+    """
+    sightings: list[Sighting] = Nested(Sighting)
+
+
+class AccountSnapshot(Document):
+    """An account stored separately from its statuses, which keep only a
+    reference and some attributes of it. It is replaced when the account
+    changes. Whether it changed is only remembered per process, so after a
+    restart and in every ingest worker, unchanged accounts replace their
+    snapshot with an identical one once, which costs writes but stores no
+    duplicates.
+    """
+    account: Account = Object(Account)
+    # Hash of the attributes that do not change with every status
+    content_hash: str = Keyword()
+    crawled_at: datetime = Date()
+    crawled_from_instance: str = Keyword()
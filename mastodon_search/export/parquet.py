@@ -0,0 +1,347 @@
+"""Export crawled statuses from Elasticsearch to Parquet files for local
+analysis. See: Exporter
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, UTC
+from glob import glob
+from json import dump, load
+from os import makedirs, path, remove, rename, replace
+from sys import stderr
+
+from elasticsearch import Elasticsearch
+from elasticsearch_dsl import Document
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from mastodon_search.elastic_dsl.mastodon import CanonicalStatus, Status
+from mastodon_search.globals import CANONICAL_INDEX_PREFIX, INDEX_PREFIX
+
+# Name of the table of the statuses themselves. Nested fields go to side
+# tables named after the field, e. g. 'tags' or 'account.emojis'.
+STATUS_TABLE = 'statuses'
+STATE_FILE = 'export.json'
+# Rows per row group in each file.
+ROW_GROUP_SIZE = 50_000
+TMP_SUFFIX = '.tmp'
+TYPES = {
+    'boolean': pa.bool_(),
+    'date': pa.timestamp('ms', tz='UTC'),
+    'float': pa.float64(),
+    'integer': pa.int64(),
+    'keyword': pa.string(),
+    'long': pa.int64(),
+    'text': pa.string(),
+}
+
+
+def _to_datetime(value: object) -> datetime:
+    if (not isinstance(value, datetime)):
+        value = datetime.fromisoformat(str(value))
+    return value if value.tzinfo else value.replace(tzinfo=UTC)
+
+
+CONVERTERS = {
+    pa.bool_(): bool,
+    pa.float64(): float,
+    pa.int32(): int,
+    pa.int64(): int,
+    pa.string(): str,
+    pa.timestamp('ms', tz='UTC'): _to_datetime,
+}
+
+
+def fields(
+    properties: dict, prefix: str = ''
+) -> tuple[list[tuple[str, pa.DataType]], dict[str, dict]]:
+    """Return the columns of a mapping's properties and the properties of
+    its nested fields. Objects are flattened to columns named like their
+    Elasticsearch fields, e. g. 'account.bot'. Nested fields within nested
+    fields are left out.
+
+    Arguments:
+    properties -- properties of an Elasticsearch mapping
+    prefix -- name of the object the properties belong to
+    """
+    columns = []
+    nested = {}
+    for name, field in sorted(properties.items()):
+        name = prefix + name
+        if (field.get('type') == 'nested'):
+            nested[name] = field['properties']
+        elif ('properties' in field):
+            object_columns, object_nested = fields(
+                field['properties'], name + '.')
+            columns.extend(object_columns)
+            nested.update(object_nested)
+        else:
+            columns.append((name, TYPES.get(field['type'], pa.string())))
+    return columns, nested
+
+
+def schemas(document: type[Document]) -> dict[str, pa.Schema]:
+    """Return the schemas of the tables a document is exported to. Rows of
+    side tables reference their status by '_id' and keep the order of the
+    nested field with 'position'.
+    """
+    columns, nested = fields(
+        document._doc_type.mapping.to_dict()['properties'])
+    result = {STATUS_TABLE: pa.schema([('_id', pa.string()), *columns])}
+    for name, properties in nested.items():
+        nested_columns, _ = fields(properties)
+        result[name] = pa.schema([
+            ('_id', pa.string()), ('position', pa.int32()), *nested_columns
+        ])
+    return result
+
+
+def _get(source: dict, name: str) -> object:
+    """Return the value of a dotted field name, or None."""
+    value = source
+    for key in name.split('.'):
+        if (not isinstance(value, dict)):
+            return None
+        value = value.get(key)
+    return value
+
+
+class _Table:
+    """A Parquet file being written in row groups."""
+    def __init__(self, file: str, schema: pa.Schema) -> None:
+        self.converters = [
+            (field.name, CONVERTERS[field.type]) for field in schema]
+        self.file = file
+        self.rows: list[dict] = []
+        self.rows_written = 0
+        self.schema = schema
+        self.writer = None
+
+    def append(self, row: dict) -> None:
+        self.rows.append(row)
+        if (len(self.rows) >= ROW_GROUP_SIZE):
+            self.flush()
+
+    def close(self) -> None:
+        """Write the remaining rows. The file stays a temporary file until
+        the whole run succeeded.
+        """
+        self.flush()
+        if (self.writer is not None):
+            self.writer.close()
+
+    def flush(self) -> None:
+        if (not self.rows):
+            return
+        columns = {}
+        for name, convert in self.converters:
+            values = []
+            for row in self.rows:
+                value = _get(row, name)
+                if (value is not None):
+                    try:
+                        value = convert(value)
+                    except (TypeError, ValueError):
+                        value = None
+                values.append(value)
+            columns[name] = values
+        if (self.writer is None):
+            self.writer = pq.ParquetWriter(
+                self.file + TMP_SUFFIX, self.schema, compression='zstd')
+        self.writer.write_table(
+            pa.Table.from_pydict(columns, schema=self.schema))
+        self.rows_written += len(self.rows)
+        self.rows = []
+
+
+class _Writer:
+    """Write search hits to one file per table."""
+    def __init__(
+        self, directory: str, name: str, schemas: dict[str, pa.Schema]
+    ) -> None:
+        """Arguments:
+        directory -- directory of the export, with a directory per table
+        name -- file name of this writer's files, without extension
+        schemas -- schemas of the tables, see: schemas
+        """
+        self.tables = {
+            table: _Table(
+                path.join(directory, table, name + '.parquet'), schema)
+            for table, schema in schemas.items()
+        }
+
+    def add(self, hit: dict) -> None:
+        source = hit['_source']
+        for table_name, table in self.tables.items():
+            if (table_name == STATUS_TABLE):
+                table.append({**source, '_id': hit['_id']})
+                continue
+            for position, value in enumerate(_get(source, table_name) or []):
+                table.append({
+                    **value, '_id': hit['_id'], 'position': position})
+
+    def close(self) -> int:
+        """Finish all files. Return the number of statuses written."""
+        for table in self.tables.values():
+            table.close()
+        return self.tables[STATUS_TABLE].rows_written
+
+
+class Exporter:
+    """Export statuses crawled within a time window to Parquet files. The
+    window is read with a point in time, split into slices that are
+    searched concurrently with search_after. Every table is a directory of
+    Parquet files, one per slice and run:
+    <directory>/<table>/<run>_<slice>.parquet
+    The end of the last window is kept in export.json, so the next run
+    exports only statuses crawled since. Windows are selected by crawled_at,
+    so statuses saved after their window was exported and new sightings of
+    canonical statuses are only exported by exporting the window again.
+    """
+    def __init__(
+        self,
+        directory: str,
+        canonical: bool = False,
+        slices: int = 4,
+        page_size: int = 1000,
+        keep_alive: str = '5m',
+    ) -> None:
+        """Arguments:
+        directory -- where to write the tables to
+        canonical -- export the statuses stored with --canonical
+        slices -- number of slices searched concurrently
+        page_size -- number of statuses per search request
+        keep_alive -- how long Elasticsearch keeps the point in time
+            between two requests of a slice
+        """
+        self.directory = directory
+        self.document = CanonicalStatus if canonical else Status
+        self.index_prefix = CANONICAL_INDEX_PREFIX if canonical \
+            else INDEX_PREFIX
+        self.keep_alive = keep_alive
+        self.page_size = page_size
+        self.schemas = schemas(self.document)
+        self.slices = slices
+        self.source = list(
+            self.document._doc_type.mapping.to_dict()['properties'])
+
+    def _export_slice(
+        self, client: Elasticsearch, pit_id: str, query: dict, run: str,
+        slice_id: int
+    ) -> int:
+        writer = _Writer(self.directory, f'{run}_{slice_id:03d}', self.schemas)
+        kwargs = {}
+        if (self.slices > 1):
+            kwargs['slice'] = {'id': slice_id, 'max': self.slices}
+        search_after = None
+        while True:
+            response = client.search(
+                pit={'id': pit_id, 'keep_alive': self.keep_alive},
+                query=query,
+                search_after=search_after,
+                size=self.page_size,
+                sort=['_shard_doc'],
+                source=self.source,
+                track_total_hits=False,
+                **kwargs
+            )
+            pit_id = response.get('pit_id', pit_id)
+            hits = response['hits']['hits']
+            for hit in hits:
+                writer.add(hit)
+            if (len(hits) < self.page_size):
+                break
+            search_after = hits[-1]['sort']
+        statuses = writer.close()
+        print(f'Slice {slice_id}: {statuses} statuses.', flush=True)
+        return statuses
+
+    def _load_state(self) -> datetime | None:
+        """Return the end of the last exported window, or None."""
+        try:
+            with open(path.join(self.directory, STATE_FILE)) as f:
+                state = load(f)
+        except FileNotFoundError:
+            return None
+        if (state['index_prefix'] != self.index_prefix):
+            raise ValueError(f'{self.directory} holds an export of '
+                +f'{state["index_prefix"]}_*, not {self.index_prefix}_*.')
+        return datetime.fromisoformat(state['until'])
+
+    def _save_state(self, until: datetime) -> None:
+        file = path.join(self.directory, STATE_FILE)
+        with open(file + TMP_SUFFIX, mode='w') as f:
+            dump({
+                'index_prefix': self.index_prefix,
+                'until': until.isoformat(),
+            }, f, indent=1)
+        replace(file + TMP_SUFFIX, file)
+
+    def _tmp_files(self, table: str) -> list[str]:
+        return glob(path.join(self.directory, table, '*' + TMP_SUFFIX))
+
+    def export_from_elastic(
+        self,
+        host: str,
+        password: str,
+        port: int,
+        username: str,
+        since: datetime | None,
+        until: datetime,
+    ) -> None:
+        """Export the statuses crawled between since (inclusive) and until
+        (exclusive).
+
+        Arguments:
+        see mastodon_search.cli: export
+        since -- start of the window. Default: the end of the last run, or
+            the first crawled status
+        """
+        if (since is None):
+            since = self._load_state()
+        elif (not since.tzinfo):
+            since = since.replace(tzinfo=UTC)
+        if (not until.tzinfo):
+            until = until.replace(tzinfo=UTC)
+        if (since is not None and since >= until):
+            print('No new statuses to export.', flush=True)
+            return
+        for table in self.schemas:
+            makedirs(path.join(self.directory, table), exist_ok=True)
+            # Files of an interrupted run.
+            for file in self._tmp_files(table):
+                remove(file)
+        crawled_at = {'lt': until.isoformat()}
+        if (since is not None):
+            crawled_at['gte'] = since.isoformat()
+        query = {'range': {'crawled_at': crawled_at}}
+        run = until.strftime('%Y%m%dT%H%M%S')
+        print(f'Exporting statuses crawled from {since or "the start"} '
+            +f'until {until} in {self.slices} slices.', flush=True)
+        client = Elasticsearch(
+            host + ':' + str(port), basic_auth=(username, password),
+            timeout=60)
+        pit_id = client.open_point_in_time(
+            index=f'{self.index_prefix}_*', keep_alive=self.keep_alive
+        )['id']
+        try:
+            with ThreadPoolExecutor(max_workers=self.slices) as executor:
+                futures = [
+                    executor.submit(
+                        self._export_slice, client, pit_id, query, run, i)
+                    for i in range(self.slices)
+                ]
+                statuses = sum(future.result() for future in futures)
+        finally:
+            try:
+                client.close_point_in_time(id=pit_id)
+            except Exception as e:
+                print('Could not close point in time:', e,
+                    file=stderr, flush=True)
+        # Make the files visible only now, so a failed run can be repeated
+        # without duplicating the statuses of its finished slices.
+        for table in self.schemas:
+            for file in self._tmp_files(table):
+                rename(file, file.removesuffix(TMP_SUFFIX))
+        self._save_state(until)
+        print(f'Exported {statuses} statuses to {self.directory}.',
+            flush=True)
@@ -0,0 +1,57 @@
+from json import loads
+
+import pyarrow.parquet as pq
+
+from mastodon_search.crawl.save import SERIALIZERS
+from mastodon_search.crawl.examples import CRAWLED_AT, STATUSES
+from mastodon_search.crawl.transform import status_to_action
+from mastodon_search.elastic_dsl.mastodon import Status
+from mastodon_search.export.parquet import (
+    STATUS_TABLE, TMP_SUFFIX, _Writer, schemas
+)
+
+
+def _hit(status: dict) -> dict:
+    action = status_to_action(
+        status, 'example.com', 'api/v1/timelines/public', CRAWLED_AT)
+    # Like returned by a search.
+    return {
+        '_id': str(action['_id']),
+        '_source': loads(SERIALIZERS['json']().dumps(action['_source'])),
+    }
+
+
+def test_schemas():
+    tables = schemas(Status)
+    assert {'account.emojis', 'media_attachments', 'poll.options', 'tags'} \
+        <= set(tables)
+    statuses = tables[STATUS_TABLE]
+    assert str(statuses.field('account.followers_count').type) == 'int64'
+    assert str(statuses.field('crawled_at').type) == 'timestamp[ms, tz=UTC]'
+    assert 'media_attachments.id' not in statuses.names
+    assert 'meta_.focus.x' in tables['media_attachments'].names
+
+
+def test_writer(tmp_path):
+    tables = schemas(Status)
+    for table in tables:
+        (tmp_path / table).mkdir()
+    writer = _Writer(str(tmp_path), 'run_000', tables)
+    hits = [_hit(status) for status in STATUSES]
+    for hit in hits:
+        writer.add(hit)
+    assert writer.close() == len(STATUSES)
+
+    def read(table: str) -> list[dict]:
+        file = tmp_path / table / ('run_000.parquet' + TMP_SUFFIX)
+        return pq.read_table(file).to_pylist()
+
+    statuses = read(STATUS_TABLE)
+    assert [s['_id'] for s in statuses] == [hit['_id'] for hit in hits]
+    assert statuses[0]['crawled_at'] == CRAWLED_AT
+    assert statuses[0]['account.followers_count'] == 3
+    media = read('media_attachments')
+    assert [(m['_id'], m['position']) for m in media] \
+        == [(hits[2]['_id'], i) for i in range(3)]
+    assert media[0]['meta_.focus.x'] == -0.5
+    assert len(read('account.fields')) == 2
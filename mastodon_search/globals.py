@@ -1,2 +1,7 @@
 INDEX_PREFIX = 'corpus_mastodon_statuses'
+CANONICAL_INDEX_PREFIX = 'corpus_mastodon_canonical_statuses'
+ACCOUNT_INDEX = 'corpus_mastodon_accounts'
+CHECKPOINT_INDEX = 'corpus_mastodon_checkpoints'
+# Indices rolled over by size or age, see: elastic_dsl.indices
+ROLLOVER_INDEX_PREFIX = 'corpus_mastodon_statuses_rollover'
 USER_AGENT = 'Webis Mastodon crawler (https://webis.de/, webis@listserv.uni-weimar.de)'
@@ -121,6 +121,13 @@ class Analyzer:
         self.df = self.df[~(self.df['total_statuses'] < 0)]
         print(f'Removed for invalid data (faked/negative values): {len_pre - len(self.df)}\n')
 
+    def fit_distributions(self) -> dict[str, tuple[float, float, float]]:
+        """Fit a log-normal distribution to every activity column. Return the
+        shape, location and scale of each fit by column, as used by
+        scipy.stats.lognorm.
+        """
+        return {col: lognorm.fit(self.df[col]) for col in self.df.columns}
+
     def choose(self, out_file_prefix: str, sample_size: int = 1000) -> None:
         """Sample `sample_size` instances from all instances.
         See: mastodon_search.cli: choose_instances
@@ -131,10 +138,7 @@ class Analyzer:
             for col in self.df.columns
         }
         # Estimate probability distributions over activity columns
-        distributions = {
-            col: dist.fit(self.df[col])
-            for col, dist in cols_prob_measures.items()
-        }
+        distributions = self.fit_distributions()
         # Compute normalize activity score by dividing by the estimated
         # probability.
         for col, dist in cols_prob_measures.items():